@@ -1,10 +1,12 @@
 import csv
 import datetime
+import io
 import os
 import uuid
 from unittest import TestCase
 
 import pandas as pd
+import pytest
 import testing.postgresql
 from mock import Mock
 from sqlalchemy import create_engine
@@ -338,6 +340,67 @@ def test_make_entity_date_table():
             test = (result == ids_dates)
             assert(test.all().all())
 
+
+def test_shared_entity_date_table():
+    dates = [datetime.datetime(2016, 1, 1, 0, 0),
+             datetime.datetime(2016, 2, 1, 0, 0)]
+    with testing.postgresql.Postgresql() as postgresql:
+        engine = create_engine(postgresql.url())
+        create_schemas(
+            engine=engine,
+            features_tables=features_tables,
+            labels=labels,
+            states=states
+        )
+        builder = builders.HighMemoryCSVBuilder(
+            db_config,
+            None,
+            engine,
+            share_entity_date_tables=True
+        )
+        entity_date_args = dict(
+            as_of_times=dates,
+            label_type='binary',
+            label_name='booking',
+            state='state_one AND state_two',
+            matrix_type='train',
+            label_timespan='1 month'
+        )
+        # matrices with the same rows, and different features, share a table
+        table_name = builder.make_entity_date_table(matrix_uuid='one', **entity_date_args)
+        assert builder.make_entity_date_table(matrix_uuid='two', **entity_date_args) == \
+            table_name
+        assert builder.entity_date_table_name(**entity_date_args) == table_name
+        assert builder.entity_date_table_name(
+            **dict(entity_date_args, matrix_type='test')
+        ) != table_name
+
+        ((count,),) = engine.execute(
+            'select count(*) from features."{}"'.format(table_name)
+        )
+        assert count > 0
+
+        # a table left with stale rows is only reused when sharing
+        engine.execute('delete from features."{}"'.format(table_name))
+        builder.make_entity_date_table(matrix_uuid='three', **entity_date_args)
+        ((count,),) = engine.execute(
+            'select count(*) from features."{}"'.format(table_name)
+        )
+        assert count == 0
+        unshared_builder = builders.HighMemoryCSVBuilder(db_config, None, engine)
+        unshared_builder.make_entity_date_table(matrix_uuid='three', **entity_date_args)
+        ((count,),) = engine.execute(
+            'select count(*) from features."{}"'.format(table_name)
+        )
+        assert count > 0
+
+        builder.drop_entity_date_table(table_name)
+        ((exists,),) = engine.execute(
+            "select to_regclass('features.\"{}\"') is not null".format(table_name)
+        )
+        assert not exists
+
+
 def test_write_features_data():
     dates = [datetime.datetime(2016, 1, 1, 0, 0),
              datetime.datetime(2016, 2, 1, 0, 0)]
@@ -554,63 +617,65 @@ class TestMergeFeatureCSVs(TestCase):
                     matrix_uuid='1234'
                 )
 
-def test_generate_plans():
-    matrix_set_definitions = [
-        {
-            'feature_start_time': datetime.datetime(1990, 1, 1, 0, 0),
-            'modeling_start_time': datetime.datetime(2010, 1, 1, 0, 0),
-            'modeling_end_time': datetime.datetime(2010, 1, 16, 0, 0),
-            'train_matrix': {
-                'first_as_of_time': datetime.datetime(2010, 1, 1, 0, 0),
-                'matrix_info_end_time': datetime.datetime(2010, 1, 6, 0, 0),
-                'as_of_times': [
-                    datetime.datetime(2010, 1, 1, 0, 0),
-                    datetime.datetime(2010, 1, 2, 0, 0),
-                    datetime.datetime(2010, 1, 3, 0, 0),
-                    datetime.datetime(2010, 1, 4, 0, 0),
-                    datetime.datetime(2010, 1, 5, 0, 0)
-                ]
-            },
-            'test_matrices': [{
-                'first_as_of_time': datetime.datetime(2010, 1, 6, 0, 0),
-                'matrix_info_end_time': datetime.datetime(2010, 1, 11, 0, 0),
-                'as_of_times': [
-                    datetime.datetime(2010, 1, 6, 0, 0),
-                    datetime.datetime(2010, 1, 7, 0, 0),
-                    datetime.datetime(2010, 1, 8, 0, 0),
-                    datetime.datetime(2010, 1, 9, 0, 0),
-                    datetime.datetime(2010, 1, 10, 0, 0)
-                ]
-            }]
+matrix_set_definitions = [
+    {
+        'feature_start_time': datetime.datetime(1990, 1, 1, 0, 0),
+        'modeling_start_time': datetime.datetime(2010, 1, 1, 0, 0),
+        'modeling_end_time': datetime.datetime(2010, 1, 16, 0, 0),
+        'train_matrix': {
+            'first_as_of_time': datetime.datetime(2010, 1, 1, 0, 0),
+            'matrix_info_end_time': datetime.datetime(2010, 1, 6, 0, 0),
+            'as_of_times': [
+                datetime.datetime(2010, 1, 1, 0, 0),
+                datetime.datetime(2010, 1, 2, 0, 0),
+                datetime.datetime(2010, 1, 3, 0, 0),
+                datetime.datetime(2010, 1, 4, 0, 0),
+                datetime.datetime(2010, 1, 5, 0, 0)
+            ]
+        },
+        'test_matrices': [{
+            'first_as_of_time': datetime.datetime(2010, 1, 6, 0, 0),
+            'matrix_info_end_time': datetime.datetime(2010, 1, 11, 0, 0),
+            'as_of_times': [
+                datetime.datetime(2010, 1, 6, 0, 0),
+                datetime.datetime(2010, 1, 7, 0, 0),
+                datetime.datetime(2010, 1, 8, 0, 0),
+                datetime.datetime(2010, 1, 9, 0, 0),
+                datetime.datetime(2010, 1, 10, 0, 0)
+            ]
+        }]
+    },
+    {
+        'feature_start_time': datetime.datetime(1990, 1, 1, 0, 0),
+        'modeling_start_time': datetime.datetime(2010, 1, 1, 0, 0),
+        'modeling_end_time': datetime.datetime(2010, 1, 16, 0, 0),
+        'train_matrix': {
+            'first_as_of_time': datetime.datetime(2010, 1, 6, 0, 0),
+            'matrix_info_end_time': datetime.datetime(2010, 1, 11, 0, 0),
+            'as_of_times': [
+                datetime.datetime(2010, 1, 6, 0, 0),
+                datetime.datetime(2010, 1, 7, 0, 0),
+                datetime.datetime(2010, 1, 8, 0, 0),
+                datetime.datetime(2010, 1, 9, 0, 0),
+                datetime.datetime(2010, 1, 10, 0, 0)
+            ]
         },
-        {
-            'feature_start_time': datetime.datetime(1990, 1, 1, 0, 0),
-            'modeling_start_time': datetime.datetime(2010, 1, 1, 0, 0),
-            'modeling_end_time': datetime.datetime(2010, 1, 16, 0, 0),
-            'train_matrix': {
-                'first_as_of_time': datetime.datetime(2010, 1, 6, 0, 0),
-                'matrix_info_end_time': datetime.datetime(2010, 1, 11, 0, 0),
-                'as_of_times': [
-                    datetime.datetime(2010, 1, 6, 0, 0),
-                    datetime.datetime(2010, 1, 7, 0, 0),
-                    datetime.datetime(2010, 1, 8, 0, 0),
-                    datetime.datetime(2010, 1, 9, 0, 0),
-                    datetime.datetime(2010, 1, 10, 0, 0)
-                ]
-            },
-            'test_matrices': [{
-                'first_as_of_time': datetime.datetime(2010, 1, 11, 0, 0),
-                'matrix_info_end_time': datetime.datetime(2010, 1, 16, 0, 0),
-                'as_of_times': [
-                    datetime.datetime(2010, 1, 11, 0, 0),
-                    datetime.datetime(2010, 1, 12, 0, 0),
-                    datetime.datetime(2010, 1, 13, 0, 0),
-                    datetime.datetime(2010, 1, 14, 0, 0),
-                    datetime.datetime(2010, 1, 15, 0, 0)
-                ]
-            }]
-        }
-    ]
+        'test_matrices': [{
+            'first_as_of_time': datetime.datetime(2010, 1, 11, 0, 0),
+            'matrix_info_end_time': datetime.datetime(2010, 1, 16, 0, 0),
+            'as_of_times': [
+                datetime.datetime(2010, 1, 11, 0, 0),
+                datetime.datetime(2010, 1, 12, 0, 0),
+                datetime.datetime(2010, 1, 13, 0, 0),
+                datetime.datetime(2010, 1, 14, 0, 0),
+                datetime.datetime(2010, 1, 15, 0, 0)
+            ]
+        }]
+    }
+]
+
+
+def test_generate_plans():
     feature_dict_one = {'features0': ['f1', 'f2'], 'features1': ['f1', 'f2']}
     feature_dict_two = {'features2': ['f3', 'f4'], 'features3': ['f5', 'f6']}
     feature_dicts = [feature_dict_one, feature_dict_two]
@@ -646,6 +711,57 @@ def test_generate_plans():
     assert sum(1 for task in build_tasks if task['feature_dictionary'] == feature_dict_two) == 4
 
 
+def test_generate_plans_matrix_views():
+    feature_dict_one = {'features0': ['f1', 'f2']}
+    feature_dict_two = {'features1': ['f3', 'f4']}
+    feature_dict_both = {'features0': ['f1', 'f2'], 'features1': ['f3', 'f4']}
+    planner = Planner(
+        feature_start_time=datetime.datetime(2010, 1, 1, 0, 0),
+        label_names=['booking'],
+        label_types=['binary'],
+        states=['state_one AND state_two'],
+        db_config=db_config,
+        user_metadata={},
+        matrix_directory='',
+        engine=None,
+        matrix_views=True
+    )
+
+    # the matrices with all the features are built, and the rest are views of them
+    _, build_tasks = planner.generate_plans(
+        matrix_set_definitions,
+        [feature_dict_one, feature_dict_two, feature_dict_both]
+    )
+    assert len(build_tasks) == 12
+    sources = [task for task in build_tasks.values() if 'source_matrix_uuid' not in task]
+    assert len(sources) == 4
+    assert all(task['feature_dictionary'] == feature_dict_both for task in sources)
+    for task in build_tasks.values():
+        if 'source_matrix_uuid' in task:
+            source = build_tasks[task['source_matrix_uuid']]
+            assert source['as_of_times'] == task['as_of_times']
+            assert source['matrix_type'] == task['matrix_type']
+
+    # without one, a matrix with all the features is added
+    updated_definitions, build_tasks = planner.generate_plans(
+        matrix_set_definitions,
+        [feature_dict_one, feature_dict_two]
+    )
+    assert len(build_tasks) == 12
+    sources = [task for task in build_tasks.values() if 'source_matrix_uuid' not in task]
+    assert len(sources) == 4
+    assert all(
+        task['matrix_metadata']['feature_names'] == ['f1', 'f2', 'f3', 'f4']
+        for task in sources
+    )
+    planned_uuids = set(
+        uuid
+        for definition in updated_definitions
+        for uuid in [definition['train_uuid']] + definition['test_uuids']
+    )
+    assert all('source_matrix_uuid' in build_tasks[uuid] for uuid in planned_uuids)
+
+
 class TestBuildMatrix(TestCase):
     def test_train_matrix(self):
         with testing.postgresql.Postgresql() as postgresql:
@@ -705,6 +821,69 @@ class TestBuildMatrix(TestCase):
                     reader = csv.reader(f)
                     assert(len([row for row in reader]) == 6)
 
+    def test_estimate_memory(self):
+        with testing.postgresql.Postgresql() as postgresql:
+            engine = create_engine(postgresql.url())
+            create_schemas(
+                engine=engine,
+                features_tables=features_tables,
+                labels=labels,
+                states=states
+            )
+
+            dates = [datetime.datetime(2016, 1, 1, 0, 0),
+                     datetime.datetime(2016, 2, 1, 0, 0),
+                     datetime.datetime(2016, 3, 1, 0, 0)]
+
+            with TemporaryDirectory() as temp_dir:
+                planner = Planner(
+                    feature_start_time = datetime.datetime(2010, 1, 1, 0, 0),
+                    label_names = ['booking'],
+                    label_types = ['binary'],
+                    states = ['state_one AND state_two'],
+                    db_config = db_config,
+                    matrix_directory = temp_dir,
+                    user_metadata = {},
+                    engine = engine
+                )
+                feature_dictionary = {
+                    'features0': ['f1', 'f2'],
+                    'features1': ['f3', 'f4'],
+                }
+                matrix_metadata = {
+                    'matrix_id': 'hi',
+                    'state': 'state_one AND state_two',
+                    'label_name': 'booking',
+                    'end_time': datetime.datetime(2016, 3, 1, 0, 0),
+                    'feature_start_time': datetime.datetime(2016, 1, 1, 0, 0),
+                    'label_timespan': '1 month'
+                }
+                memory = planner.estimate_matrix_memory(
+                    as_of_times = dates,
+                    label_name = 'booking',
+                    label_type = 'binary',
+                    feature_dictionary = feature_dictionary,
+                    matrix_directory = temp_dir,
+                    matrix_metadata = matrix_metadata,
+                    matrix_uuid = metta.generate_uuid(matrix_metadata),
+                    matrix_type = 'train'
+                )
+                # the planner's estimate of the rows of the train matrix,
+                # with entity_id, as_of_date, 4 features, and the label
+                rows = planner.builder.estimate_entity_dates(
+                    dates,
+                    'booking',
+                    'binary',
+                    matrix_metadata['state'],
+                    'train',
+                    matrix_metadata['label_timespan']
+                )
+                assert rows > 0
+                assert memory == planner.builder.rows_in_memory(rows) * 7 * \
+                    planner.builder.bytes_per_value_in_memory
+                # nothing was built
+                assert os.listdir(temp_dir) == []
+
     def test_test_matrix(self):
         with testing.postgresql.Postgresql() as postgresql:
             # create an engine and generate a table with fake feature data
@@ -914,3 +1093,351 @@ class TestBuildMatrix(TestCase):
                     matrix_type = 'test'
                 )
                 assert not planner.builder.make_entity_date_table.called
+
+
+class SmallChunkStreamingCSVBuilder(builders.StreamingCSVBuilder):
+    chunk_size = 2
+
+
+class TestMatrixBuilders(TestCase):
+    dates = [datetime.datetime(2016, 1, 1, 0, 0),
+             datetime.datetime(2016, 2, 1, 0, 0),
+             datetime.datetime(2016, 3, 1, 0, 0)]
+    feature_dictionary = {
+        'features0': ['f1', 'f2'],
+        'features1': ['f3', 'f4'],
+    }
+    matrix_metadata = {
+        'matrix_id': 'hi',
+        'state': 'state_one AND state_two',
+        'label_name': 'booking',
+        'end_time': datetime.datetime(2016, 3, 1, 0, 0),
+        'feature_start_time': datetime.datetime(2016, 1, 1, 0, 0),
+        'label_timespan': '1 month',
+        'indices': ['entity_id', 'as_of_date'],
+    }
+
+    def build_matrix(self, engine, temp_dir, builder_class, matrix_type, **kwargs):
+        planner = Planner(
+            feature_start_time=datetime.datetime(2010, 1, 1, 0, 0),
+            label_names=['booking'],
+            label_types=['binary'],
+            states=['state_one AND state_two'],
+            db_config=db_config,
+            matrix_directory=temp_dir,
+            user_metadata={},
+            engine=engine,
+            builder_class=builder_class,
+            **kwargs
+        )
+        uuid = metta.generate_uuid(self.matrix_metadata)
+        planner.build_matrix(
+            as_of_times=self.dates,
+            label_name='booking',
+            label_type='binary',
+            feature_dictionary=self.feature_dictionary,
+            matrix_directory=temp_dir,
+            matrix_metadata=self.matrix_metadata,
+            matrix_uuid=uuid,
+            matrix_type=matrix_type
+        )
+        return uuid
+
+    def test_matches_high_memory_builder(self):
+        with testing.postgresql.Postgresql() as postgresql:
+            engine = create_engine(postgresql.url())
+            create_schemas(
+                engine=engine,
+                features_tables=features_tables,
+                labels=labels,
+                states=states
+            )
+            with TemporaryDirectory() as joined_dir, TemporaryDirectory() as merged_dir:
+                for matrix_type in ('train', 'test'):
+                    uuid = self.build_matrix(
+                        engine, joined_dir, builders.JoinedCSVBuilder, matrix_type
+                    )
+                    self.build_matrix(
+                        engine, merged_dir, builders.HighMemoryCSVBuilder, matrix_type
+                    )
+                    # the joined copy is the matrix, not a copy of it
+                    assert sorted(os.listdir(joined_dir)) == sorted(os.listdir(merged_dir))
+                    joined = pd.read_csv(os.path.join(joined_dir, '{}.csv'.format(uuid)))
+                    merged = pd.read_csv(os.path.join(merged_dir, '{}.csv'.format(uuid)))
+                    assert joined.columns.tolist() == [
+                        'entity_id', 'as_of_date', 'f1', 'f2', 'f3', 'f4', 'booking'
+                    ]
+                    assert joined.columns.tolist() == merged.columns.tolist()
+                    assert joined.fillna(-1).values.tolist() == \
+                        merged.fillna(-1).values.tolist()
+
+    def test_streaming_matches_high_memory_builder(self):
+        with testing.postgresql.Postgresql() as postgresql:
+            engine = create_engine(postgresql.url())
+            create_schemas(
+                engine=engine,
+                features_tables=features_tables,
+                labels=labels,
+                states=states
+            )
+            with TemporaryDirectory() as streamed_dir, TemporaryDirectory() as merged_dir:
+                for matrix_type in ('train', 'test'):
+                    uuid = self.build_matrix(
+                        engine, streamed_dir, SmallChunkStreamingCSVBuilder, matrix_type
+                    )
+                    self.build_matrix(
+                        engine, merged_dir, builders.HighMemoryCSVBuilder, matrix_type
+                    )
+                    # the per-table CSVs are removed
+                    assert sorted(os.listdir(streamed_dir)) == sorted(os.listdir(merged_dir))
+                    streamed = pd.read_csv(os.path.join(streamed_dir, '{}.csv'.format(uuid)))
+                    merged = pd.read_csv(os.path.join(merged_dir, '{}.csv'.format(uuid)))
+                    assert streamed.columns.tolist() == merged.columns.tolist()
+                    assert streamed.fillna(-1).values.tolist() == \
+                        merged.fillna(-1).values.tolist()
+
+    def test_streaming_nullcheck(self):
+        f0_dict = {(r[0], r[1]): r for r in features0_pre}
+        f1_dict = {(r[0], r[1]): r for r in features1_pre}
+        features_tables = [
+            sorted(f0_dict.values(), key=lambda x: (x[1], x[0])),
+            sorted(f1_dict.values(), key=lambda x: (x[1], x[0])),
+        ]
+        with testing.postgresql.Postgresql() as postgresql:
+            engine = create_engine(postgresql.url())
+            create_schemas(
+                engine=engine,
+                features_tables=features_tables,
+                labels=labels,
+                states=states
+            )
+            with TemporaryDirectory() as temp_dir:
+                with self.assertRaises(ValueError):
+                    self.build_matrix(engine, temp_dir, SmallChunkStreamingCSVBuilder, 'test')
+                assert os.listdir(temp_dir) == []
+
+    def test_binary_matches_high_memory_builder(self):
+        with testing.postgresql.Postgresql() as postgresql:
+            engine = create_engine(postgresql.url())
+            create_schemas(
+                engine=engine,
+                features_tables=features_tables,
+                labels=labels,
+                states=states
+            )
+            with TemporaryDirectory() as binary_dir, TemporaryDirectory() as merged_dir:
+                for matrix_type in ('train', 'test'):
+                    uuid = self.build_matrix(
+                        engine, binary_dir, builders.BinaryCopyBuilder, matrix_type
+                    )
+                    self.build_matrix(
+                        engine, merged_dir, builders.HighMemoryCSVBuilder, matrix_type
+                    )
+                    binary = pd.read_csv(os.path.join(binary_dir, '{}.csv'.format(uuid)))
+                    merged = pd.read_csv(os.path.join(merged_dir, '{}.csv'.format(uuid)))
+                    assert binary.columns.tolist() == merged.columns.tolist()
+                    assert binary['entity_id'].tolist() == merged['entity_id'].tolist()
+                    assert pd.to_datetime(binary['as_of_date']).tolist() == \
+                        pd.to_datetime(merged['as_of_date']).tolist()
+                    features = ['f1', 'f2', 'f3', 'f4', 'booking']
+                    assert binary[features].fillna(-1).values.tolist() == \
+                        merged[features].fillna(-1).values.tolist()
+
+    def test_binary_nullcheck(self):
+        f0_dict = {(r[0], r[1]): r for r in features0_pre}
+        f1_dict = {(r[0], r[1]): r for r in features1_pre}
+        features_tables = [
+            sorted(f0_dict.values(), key=lambda x: (x[1], x[0])),
+            sorted(f1_dict.values(), key=lambda x: (x[1], x[0])),
+        ]
+        with testing.postgresql.Postgresql() as postgresql:
+            engine = create_engine(postgresql.url())
+            create_schemas(
+                engine=engine,
+                features_tables=features_tables,
+                labels=labels,
+                states=states
+            )
+            with TemporaryDirectory() as temp_dir:
+                with self.assertRaises(ValueError):
+                    self.build_matrix(engine, temp_dir, builders.BinaryCopyBuilder, 'test')
+
+    def test_partitioned_matches_high_memory_builder(self):
+        with testing.postgresql.Postgresql() as postgresql:
+            engine = create_engine(postgresql.url())
+            create_schemas(
+                engine=engine,
+                features_tables=features_tables,
+                labels=labels,
+                states=states
+            )
+            with TemporaryDirectory() as partitioned_dir, TemporaryDirectory() as merged_dir:
+                for matrix_type in ('train', 'test'):
+                    uuid = self.build_matrix(
+                        engine, partitioned_dir, builders.PartitionedCSVBuilder, matrix_type
+                    )
+                    self.build_matrix(
+                        engine, merged_dir, builders.HighMemoryCSVBuilder, matrix_type
+                    )
+                    partitioned = pd.read_csv(os.path.join(partitioned_dir, '{}.csv'.format(uuid)))
+                    merged = pd.read_csv(os.path.join(merged_dir, '{}.csv'.format(uuid)))
+                    assert partitioned.columns.tolist() == merged.columns.tolist()
+                    # rows are ordered by date, then entity
+                    assert partitioned.fillna(-1).sort_values(['entity_id', 'as_of_date']) \
+                        .values.tolist() == merged.fillna(-1).values.tolist()
+
+    def test_partitions_extracted_once(self):
+        with testing.postgresql.Postgresql() as postgresql:
+            engine = create_engine(postgresql.url())
+            create_schemas(
+                engine=engine,
+                features_tables=features_tables,
+                labels=labels,
+                states=states
+            )
+            with TemporaryDirectory() as temp_dir:
+                builder = builders.PartitionedCSVBuilder(db_config, temp_dir, engine)
+                builder._copy_joined_query = Mock(wraps=builder._copy_joined_query)
+                for matrix_number, as_of_times in enumerate((self.dates[:2], self.dates[1:])):
+                    builder.build_matrix(
+                        as_of_times=as_of_times,
+                        label_name='booking',
+                        label_type='binary',
+                        feature_dictionary=self.feature_dictionary,
+                        matrix_directory=temp_dir,
+                        matrix_metadata=self.matrix_metadata,
+                        matrix_uuid='matrix{}'.format(matrix_number),
+                        matrix_type='train'
+                    )
+                # the date the matrices share is copied out only once
+                assert builder._copy_joined_query.call_count == 3
+                assert len(os.listdir(builder.partition_directory)) == 3
+                second = pd.read_csv(os.path.join(temp_dir, 'matrix1.csv'))
+                assert sorted(second['as_of_date'].unique()) == ['2016-02-01', '2016-03-01']
+
+                builder.clean_up()
+                assert not os.path.exists(builder.partition_directory)
+
+    def test_partitioned_nullcheck(self):
+        f0_dict = {(r[0], r[1]): r for r in features0_pre}
+        f1_dict = {(r[0], r[1]): r for r in features1_pre}
+        features_tables = [
+            sorted(f0_dict.values(), key=lambda x: (x[1], x[0])),
+            sorted(f1_dict.values(), key=lambda x: (x[1], x[0])),
+        ]
+        with testing.postgresql.Postgresql() as postgresql:
+            engine = create_engine(postgresql.url())
+            create_schemas(
+                engine=engine,
+                features_tables=features_tables,
+                labels=labels,
+                states=states
+            )
+            with TemporaryDirectory() as temp_dir:
+                with self.assertRaises(ValueError) as context:
+                    self.build_matrix(engine, temp_dir, builders.PartitionedCSVBuilder, 'test')
+                assert 'f1' in str(context.exception)
+                # no partial matrix or partition is left behind
+                assert not any(name.endswith('.csv') for name in os.listdir(temp_dir))
+                assert os.listdir(os.path.join(temp_dir, 'partitions')) == []
+
+    def test_other_format(self):
+        with testing.postgresql.Postgresql() as postgresql:
+            engine = create_engine(postgresql.url())
+            create_schemas(
+                engine=engine,
+                features_tables=features_tables,
+                labels=labels,
+                states=states
+            )
+            with TemporaryDirectory() as temp_dir:
+                uuid = self.build_matrix(
+                    engine,
+                    temp_dir,
+                    builders.JoinedCSVBuilder,
+                    'train',
+                    matrix_format='memmap'
+                )
+                assert sorted(os.listdir(temp_dir)) == sorted([
+                    '{}.memmap'.format(uuid),
+                    '{}.summary.json'.format(uuid),
+                    '{}.yaml'.format(uuid),
+                ])
+
+    def test_nullcheck(self):
+        f0_dict = {(r[0], r[1]): r for r in features0_pre}
+        f1_dict = {(r[0], r[1]): r for r in features1_pre}
+        features_tables = [
+            sorted(f0_dict.values(), key=lambda x: (x[1], x[0])),
+            sorted(f1_dict.values(), key=lambda x: (x[1], x[0])),
+        ]
+        with testing.postgresql.Postgresql() as postgresql:
+            engine = create_engine(postgresql.url())
+            create_schemas(
+                engine=engine,
+                features_tables=features_tables,
+                labels=labels,
+                states=states
+            )
+            with TemporaryDirectory() as temp_dir:
+                with self.assertRaises(ValueError) as context:
+                    self.build_matrix(engine, temp_dir, builders.JoinedCSVBuilder, 'test')
+                assert 'f1' in str(context.exception)
+                # no partial matrix is left behind
+                assert not any(name.endswith('.csv') for name in os.listdir(temp_dir))
+
+
+def test_binary_copy_decoder():
+    with testing.postgresql.Postgresql() as postgresql:
+        engine = create_engine(postgresql.url())
+        copy = io.BytesIO()
+        conn = engine.raw_connection()
+        conn.cursor().copy_expert(
+            """COPY (
+                SELECT entity_id::int8, '2016-01-01'::timestamp + entity_id * interval '1 day',
+                       entity_id / 2.0::float8, 'NaN'::float8
+                FROM generate_series(1, 100) entity_id
+            ) TO STDOUT WITH (FORMAT binary)""",
+            copy
+        )
+        conn.close()
+
+    decoder = builders.BinaryCopyDecoder(100, 2)
+    # rows split across writes are decoded once complete
+    data = copy.getvalue()
+    for position in range(0, len(data), 7):
+        decoder.write(data[position:position + 7])
+    decoder.finish()
+    assert decoder.entity_ids.tolist() == list(range(1, 101))
+    assert decoder.index()[0] == (1, pd.Timestamp('2016-01-02'))
+    assert decoder.values[:, 0].tolist() == [i / 2.0 for i in range(1, 101)]
+    assert pd.isnull(decoder.values[:, 1]).all()
+
+    # a copy with fewer rows than expected is an error
+    decoder = builders.BinaryCopyDecoder(101, 2)
+    decoder.write(data)
+    with pytest.raises(ValueError):
+        decoder.finish()
+
+
+def test_streaming_merge_checks_alignment():
+    builder = SmallChunkStreamingCSVBuilder(db_config, None, None)
+    # only a chunk of a matrix's rows is held in memory
+    assert builder.rows_in_memory(10) == 2
+    labels_chunk = pd.DataFrame({
+        'entity_id': [1, 2],
+        'as_of_date': ['2016-01-01', '2016-01-01'],
+        'booking': [0, 1],
+    }, columns=['entity_id', 'as_of_date', 'booking'])
+    features_chunk = pd.DataFrame({
+        'entity_id': [1, 2],
+        'as_of_date': ['2016-01-01', '2016-01-01'],
+        'f1': [0.5, 0.25],
+    }, columns=['entity_id', 'as_of_date', 'f1'])
+    merged = builder._merge_chunk((labels_chunk, features_chunk))
+    assert merged.columns.tolist() == ['entity_id', 'as_of_date', 'f1', 'booking']
+
+    with pytest.raises(ValueError):
+        builder._merge_chunk((labels_chunk, features_chunk.iloc[::-1].reset_index(drop=True)))
+    with pytest.raises(ValueError):
+        builder._merge_chunk((labels_chunk, None))
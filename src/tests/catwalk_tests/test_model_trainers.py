@@ -1,10 +1,13 @@
 import boto3
+import os
 import pandas
 import pickle
+import tempfile
 import testing.postgresql
 import datetime
 import sqlalchemy
 import unittest
+from collections import OrderedDict
 from unittest.mock import patch
 
 from moto import mock_s3
@@ -14,7 +17,8 @@ from triage.component.catwalk.utils import model_cache_key
 
 from triage.component.catwalk.model_trainers import ModelTrainer
 from triage.component.catwalk.storage import InMemoryModelStorageEngine,\
-    S3ModelStorageEngine, InMemoryMatrixStore
+    S3ModelStorageEngine, InMemoryMatrixStore, SparseMatrixStore, CSVMatrixStore
+from triage.component.metta import metta_io
 
 
 def test_model_trainer():
@@ -180,6 +184,91 @@ def test_model_trainer():
                 sorted([model_id for model_id in new_model_ids])
 
 
+def test_train_sparse_matrix():
+    matrix = pandas.DataFrame.from_dict({
+        'entity_id': [1, 2, 3, 4],
+        'feature_one': [0, 1, 0, 1],
+        'feature_two': [1, 0, 0, 0],
+    }).set_index('entity_id')
+    labels = pandas.Series([0, 1, 0, 1], index=matrix.index, name='label')
+    metadata = {'label_name': 'label', 'indices': ['entity_id'], 'metta-uuid': '1234'}
+    trainer = ModelTrainer(
+        project_path='econ-dev/inspections',
+        experiment_hash=None,
+        model_storage_engine=InMemoryModelStorageEngine('econ-dev/inspections'),
+        db_engine=None,
+        model_group_keys=[]
+    )
+    with tempfile.TemporaryDirectory() as temp_dir:
+        matrix_store = SparseMatrixStore.write(matrix, labels, metadata, temp_dir, '1234')
+        model, feature_names = trainer._train(
+            matrix_store,
+            'sklearn.linear_model.LogisticRegression',
+            {'random_state': 2193}
+        )
+        assert list(feature_names) == ['feature_one', 'feature_two']
+        # trained without making a dense copy
+        assert matrix_store._matrix is None
+
+        # models that need dense input are given a dense copy
+        model, feature_names = trainer._train(
+            matrix_store,
+            'triage.component.catwalk.estimators.classifiers.ScaledLogisticRegression',
+            {}
+        )
+        assert list(feature_names) == ['feature_one', 'feature_two']
+        assert model.predict_proba(matrix).shape == (4, 2)
+
+
+def test_estimate_memory():
+    matrix = pandas.DataFrame.from_dict(OrderedDict([
+        ('entity_id', [1, 2, 3]),
+        ('feature_one', [0.5, 0.4, 0.3]),
+        ('feature_two', [1, 0, 1]),
+        ('label', [0, 1, 0]),
+    ]))
+    metadata = {
+        'label_name': 'label',
+        'indices': ['entity_id'],
+        'feature_names': ['feature_one', 'feature_two'],
+        'feature_start_time': datetime.date(2016, 1, 1),
+        'end_time': datetime.date(2017, 1, 1),
+        'label_timespan': '1y',
+        'matrix_id': 'estimate_test',
+    }
+    trainer = ModelTrainer(
+        project_path='econ-dev/inspections',
+        experiment_hash=None,
+        model_storage_engine=InMemoryModelStorageEngine('econ-dev/inspections'),
+        db_engine=None,
+        model_group_keys=[]
+    )
+    with tempfile.TemporaryDirectory() as temp_dir:
+        matrix_csv = os.path.join(temp_dir, 'matrix.csv')
+        matrix.to_csv(matrix_csv, index=False)
+        uuid = metta_io.archive_matrix(metadata, matrix_csv, directory=temp_dir, format='csv')
+        matrix_store = CSVMatrixStore(
+            os.path.join(temp_dir, uuid + '.csv'),
+            os.path.join(temp_dir, uuid + '.yaml')
+        )
+        expected = 3 * 2 * trainer.bytes_per_value_in_memory
+        assert trainer.estimate_memory(matrix_store) == expected
+        # answered from the summary, without reading the matrix
+        assert matrix_store._matrix is None
+
+        # without a summary, rows are counted from the labels stored apart
+        os.remove(matrix_store.summary_path)
+        matrix_store = CSVMatrixStore(matrix_store.matrix_path, matrix_store.metadata_path)
+        assert trainer.estimate_memory(matrix_store) == expected
+        assert matrix_store._matrix is None
+
+        # without either, the matrix isn't read just to size it
+        os.remove(matrix_store.labels_path)
+        matrix_store = CSVMatrixStore(matrix_store.matrix_path, matrix_store.metadata_path)
+        assert trainer.estimate_memory(matrix_store) is None
+        assert matrix_store._matrix is None
+
+
 def test_n_jobs_not_new_model():
     grid_config = {
         'sklearn.ensemble.AdaBoostClassifier': {
@@ -5,7 +5,7 @@ from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.orm.session import make_transient
 
-from triage.component.results_schema import Prediction
+from triage.component.results_schema import Model, Prediction
 from triage.component.catwalk.db import ensure_db
 import pandas
 
@@ -14,7 +14,9 @@ from tests.utils import fake_trained_model, sample_metta_csv_diff_order
 from triage.component.catwalk.storage import \
     InMemoryModelStorageEngine,\
     S3ModelStorageEngine,\
-    InMemoryMatrixStore
+    InMemoryMatrixStore,\
+    MemmapMatrixStore,\
+    SparseMatrixStore
 import datetime
 
 from unittest.mock import Mock
@@ -173,6 +175,112 @@ def test_predictor_composite_index():
         assert len(records) == 4
 
 
+def test_predictor_memmap_matrix():
+    with testing.postgresql.Postgresql() as postgresql, \
+            tempfile.TemporaryDirectory() as temp_dir:
+        db_engine = create_engine(postgresql.url())
+        ensure_db(db_engine)
+        project_path = 'econ-dev/inspections'
+        model_storage_engine = InMemoryModelStorageEngine(project_path)
+        _, model_id = \
+            fake_trained_model(project_path, model_storage_engine, db_engine)
+        predictor = Predictor(project_path, model_storage_engine, db_engine)
+        dayone = datetime.datetime(2011, 1, 1)
+        daytwo = datetime.datetime(2011, 1, 2)
+        matrix = pandas.DataFrame.from_dict({
+            'entity_id': [1, 2, 1, 2],
+            'as_of_date': [dayone, dayone, daytwo, daytwo],
+            'feature_one': [3, 4, 5, 6],
+            'feature_two': [5, 6, 7, 8],
+            'label': [7, 8, 8, 7]
+        }).set_index(['entity_id', 'as_of_date'])
+        metadata = {
+            'label_name': 'label',
+            'end_time': AS_OF_DATE,
+            'label_timespan': '3month',
+            'metta-uuid': '1234',
+            'indices': ['entity_id', 'as_of_date'],
+        }
+        matrix_store = MemmapMatrixStore.write(
+            matrix[['feature_one', 'feature_two']],
+            matrix['label'],
+            metadata,
+            temp_dir,
+            '1234',
+            dtype='float32'
+        )
+        predict_proba = predictor.predict(
+            model_id,
+            matrix_store,
+            misc_db_parameters=dict(),
+            train_matrix_columns=['feature_one', 'feature_two']
+        )
+        assert len(predict_proba) == 4
+        records = [
+            row for row in
+            db_engine.execute('''select entity_id, as_of_date
+            from results.predictions
+            join results.models using (model_id)''')
+        ]
+        assert len(records) == 4
+
+
+def test_predictor_sparse_matrix():
+    from sklearn.linear_model import LogisticRegression
+    from triage.component.catwalk.estimators.classifiers import ScaledLogisticRegression
+    with testing.postgresql.Postgresql() as postgresql, \
+            tempfile.TemporaryDirectory() as temp_dir:
+        db_engine = create_engine(postgresql.url())
+        ensure_db(db_engine)
+        project_path = 'econ-dev/inspections'
+        model_storage_engine = InMemoryModelStorageEngine(project_path)
+        predictor = Predictor(project_path, model_storage_engine, db_engine)
+        dayone = datetime.datetime(2011, 1, 1)
+        daytwo = datetime.datetime(2011, 1, 2)
+        matrix = pandas.DataFrame.from_dict({
+            'entity_id': [1, 2, 1, 2],
+            'as_of_date': [dayone, dayone, daytwo, daytwo],
+            'feature_one': [0, 1, 0, 1],
+            'feature_two': [1, 0, 0, 0],
+            'label': [0, 1, 0, 1]
+        }).set_index(['entity_id', 'as_of_date'])
+        metadata = {
+            'label_name': 'label',
+            'end_time': AS_OF_DATE,
+            'label_timespan': '3month',
+            'metta-uuid': '1234',
+            'indices': ['entity_id', 'as_of_date'],
+        }
+        matrix_store = SparseMatrixStore.write(
+            matrix[['feature_one', 'feature_two']],
+            matrix['label'],
+            metadata,
+            temp_dir,
+            '1234'
+        )
+        # one model that accepts sparse input, and one that doesn't
+        for model_hash, model in (
+            ('abcd', LogisticRegression()),
+            ('efgh', ScaledLogisticRegression()),
+        ):
+            model.fit(matrix[['feature_two', 'feature_one']], matrix['label'])
+            model_storage_engine.get_store(model_hash).write(model)
+            session = sessionmaker(db_engine)()
+            db_model = Model(model_hash=model_hash, train_matrix_uuid='efgh')
+            session.add(db_model)
+            session.commit()
+            predict_proba = predictor.predict(
+                db_model.model_id,
+                matrix_store,
+                misc_db_parameters=dict(),
+                train_matrix_columns=['feature_two', 'feature_one']
+            )
+            assert_array_equal(
+                predict_proba,
+                model.predict_proba(matrix[['feature_two', 'feature_one']])[:, 1]
+            )
+
+
 def test_predictor_get_train_columns():
     with testing.postgresql.Postgresql() as postgresql:
         db_engine = create_engine(postgresql.url())
@@ -1,11 +1,16 @@
+import datetime
 import os
+import pickle
 import tempfile
+import threading
 import unittest
 import yaml
 from collections import OrderedDict
 
 import boto
 import pandas
+import pytest
+import scipy.sparse
 from moto import mock_s3, mock_s3_deprecated
 
 from triage.component.catwalk.storage import (
@@ -13,9 +18,17 @@ from triage.component.catwalk.storage import (
     FSStore,
     HDFMatrixStore,
     InMemoryMatrixStore,
+    MatrixBroker,
+    MatrixCache,
+    MatrixPrefetcher,
+    MatrixView,
+    MemmapMatrixStore,
     MemoryStore,
+    ParquetMatrixStore,
     S3Store,
+    SparseMatrixStore,
 )
+from triage.component.metta import metta_io
 
 
 class SomeClass(object):
@@ -216,3 +229,522 @@ class MatrixStoreTest(unittest.TestCase):
             assert csv.matrix.to_dict() == matrix_store_list[0].matrix.to_dict()
             assert hdf.metadata == matrix_store_list[0].metadata
             assert hdf.matrix.to_dict() == matrix_store_list[0].matrix.to_dict()
+
+
+def test_MatrixBroker():
+    data = OrderedDict([
+        ('entity_id', [1, 2, 1, 2]),
+        ('as_of_date', ['2016-01-01', '2016-01-01', '2017-01-01', '2017-01-01']),
+        ('k_feature', [0.5, 0.4, 0.3, 0.2]),
+        ('m_feature', [1, 2, 3, 4]),
+        ('label', [0, 1, 0, 1]),
+    ])
+    metadata = {
+        'label_name': 'label',
+        'indices': ['entity_id', 'as_of_date'],
+        'metta-uuid': 'abcd',
+    }
+    original = InMemoryMatrixStore(
+        matrix=pandas.DataFrame.from_dict(data),
+        metadata=metadata
+    )
+    expected_matrix = original.matrix.drop('label', axis=1).to_dict()
+    expected_labels = original.matrix['label'].to_dict()
+
+    broker = MatrixBroker()
+    shared = broker.share(original)
+    assert isinstance(shared, MemmapMatrixStore)
+    # each matrix is only copied once
+    assert broker.share(original) is shared
+
+    # workers receive only the paths, and map the arrays
+    unpickled = pickle.loads(pickle.dumps(shared))
+    for store in (shared, unpickled):
+        assert store.matrix.to_dict() == expected_matrix
+        assert not store.matrix.values.flags.writeable
+        assert store.labels().to_dict() == expected_labels
+        assert store.columns() == ['k_feature', 'm_feature']
+        assert store.columns(include_label=True) == ['k_feature', 'm_feature', 'label']
+        assert store.as_of_dates == ['2016-01-01', '2017-01-01']
+        assert store.uuid == 'abcd'
+        assert not store.empty
+        assert store.matrix_with_sorted_columns(
+            ['m_feature', 'k_feature']
+        ).values.tolist() == [[1, 0.5], [2, 0.4], [3, 0.3], [4, 0.2]]
+
+    # a released copy is removed, and made again if shared again
+    broker.release('abcd')
+    assert not os.path.exists(shared.matrix_path)
+    assert not os.path.exists(shared.metadata_path)
+    assert broker.share(original) is not shared
+    assert os.path.exists(shared.matrix_path)
+
+    broker.close()
+    assert not os.path.exists(broker.directory)
+
+
+def test_MatrixBroker_non_numeric():
+    matrix = pandas.DataFrame.from_dict(OrderedDict([
+        ('entity_id', [1, 2]),
+        ('category', ['a', 'b']),
+        ('label', [0, 1]),
+    ]))
+    original = InMemoryMatrixStore(
+        matrix=matrix,
+        metadata={'label_name': 'label', 'indices': ['entity_id'], 'metta-uuid': 'abcd'}
+    )
+    broker = MatrixBroker()
+    assert broker.share(original) is original
+    # the original isn't removed
+    broker.release('abcd')
+    broker.close()
+
+
+def test_MemmapMatrixStore_opens_lazily():
+    matrix = pandas.DataFrame.from_dict(OrderedDict([
+        ('entity_id', [1, 2, 3]),
+        ('k_feature', [0.5, 0.4, 0.3]),
+        ('m_feature', [0.4, 0.5, 0.6]),
+    ])).set_index('entity_id')
+    labels = pandas.Series([0, 1, 0], index=matrix.index, name='label')
+    metadata = {'label_name': 'label', 'indices': ['entity_id'], 'metta-uuid': 'abcd'}
+    with tempfile.TemporaryDirectory() as tmpdir:
+        MemmapMatrixStore.write(matrix, labels, metadata, tmpdir, 'abcd', dtype='float32')
+        store = MemmapMatrixStore(
+            os.path.join(tmpdir, 'abcd.memmap'),
+            os.path.join(tmpdir, 'abcd.yaml')
+        )
+        assert store.columns(include_label=True) == ['k_feature', 'm_feature', 'label']
+        assert store.head_of_matrix.index.tolist() == [1]
+        assert not store.empty
+        # none of the above needed the whole matrix
+        assert store._matrix is None
+
+        assert store.matrix.values.dtype == 'float32'
+        assert store.matrix.index.tolist() == [1, 2, 3]
+        assert store.labels().tolist() == [0, 1, 0]
+        assert store.matrix_with_sorted_columns(['k_feature', 'm_feature']) is store.matrix
+
+
+def test_CSVMatrixStore_summary():
+    matrix = pandas.DataFrame.from_dict(OrderedDict([
+        ('entity_id', [1, 2, 3]),
+        ('k_feature', [0.5, 0.4, None]),
+        ('m_feature', [1, 0, 1]),
+        ('label', [0, 1, 0]),
+    ]))
+    metadata = {
+        'label_name': 'label',
+        'indices': ['entity_id'],
+        'metta-uuid': 'abcd',
+        'feature_start_time': datetime.date(2016, 1, 1),
+        'end_time': datetime.date(2017, 1, 1),
+        'label_timespan': '1y',
+        'matrix_id': 'summary_test',
+    }
+    with tempfile.TemporaryDirectory() as tmpdir:
+        # as the builders do, archive a CSV already written
+        matrix_csv = os.path.join(tmpdir, 'matrix.csv')
+        matrix.to_csv(matrix_csv, index=False)
+        uuid = metta_io.archive_matrix(
+            metadata, matrix_csv, directory=tmpdir, format='csv', compact_dtypes=True
+        )
+        store = CSVMatrixStore(
+            os.path.join(tmpdir, uuid + '.csv'),
+            os.path.join(tmpdir, uuid + '.yaml')
+        )
+        assert not store.empty
+        assert store.columns(include_label=True) == ['k_feature', 'm_feature', 'label']
+        assert store.label_counts() == {0: 2, 1: 1}
+        assert store.summary['column_stats']['k_feature'] == {
+            'min': 0.4, 'max': 0.5, 'mean': 0.45, 'nulls': 1
+        }
+        # none of the above needed the matrix
+        assert store._matrix is None
+        assert store._head_of_matrix is None
+
+        # the matrix is read as the types in the summary
+        assert store.matrix['m_feature'].dtype == 'int8'
+        assert store.labels().tolist() == [0, 1, 0]
+
+        # what has been read is left out when pickling, but kept
+        unpickled = pickle.loads(pickle.dumps(store))
+        assert unpickled._matrix is None and unpickled._labels is None
+        assert store._matrix is not None and store._labels is not None
+
+        # without a summary, the matrix answers
+        os.remove(store.summary_path)
+        store = CSVMatrixStore(store.matrix_path, store.metadata_path)
+        assert store.summary == {}
+        assert store.columns() == ['k_feature', 'm_feature']
+        assert store.label_counts() == {0: 2, 1: 1}
+
+
+def test_labels_read_without_features():
+    matrix = pandas.DataFrame.from_dict(OrderedDict([
+        ('entity_id', [1, 2, 1]),
+        ('as_of_date', ['2016-01-01', '2016-01-01', '2016-02-01']),
+        ('k_feature', [0.5, 0.4, 0.3]),
+        ('label', [0, 1, 0]),
+    ]))
+    metadata = {
+        'label_name': 'label',
+        'indices': ['entity_id', 'as_of_date'],
+        'feature_start_time': datetime.date(2016, 1, 1),
+        'end_time': datetime.date(2016, 3, 1),
+        'label_timespan': '1y',
+        'matrix_id': 'labels_test',
+    }
+    with tempfile.TemporaryDirectory() as tmpdir:
+        matrix_csv = os.path.join(tmpdir, 'matrix.csv')
+        matrix.to_csv(matrix_csv, index=False)
+        uuid = metta_io.archive_matrix(metadata, matrix_csv, directory=tmpdir, format='csv')
+        store = CSVMatrixStore(
+            os.path.join(tmpdir, uuid + '.csv'),
+            os.path.join(tmpdir, uuid + '.yaml')
+        )
+        assert store.labels().tolist() == [0, 1, 0]
+        assert store.labels().index.tolist() == [
+            (1, '2016-01-01'), (2, '2016-01-01'), (1, '2016-02-01')
+        ]
+        assert store.as_of_dates == ['2016-01-01', '2016-02-01']
+        assert store.num_entities == 2
+        # none of the above needed the features
+        assert store._matrix is None
+
+        # the loaded matrix leaves the labels out, and matches them
+        assert store.matrix.columns.tolist() == ['k_feature']
+        assert store.matrix.index.equals(store.labels().index)
+
+        # hd5 matrices store dates as timestamps
+        matrix['as_of_date'] = pandas.to_datetime(matrix['as_of_date'])
+        uuid = metta_io.archive_matrix(
+            metadata, matrix, directory=tmpdir, format='hd5', overwrite=True
+        )
+        store = HDFMatrixStore(
+            os.path.join(tmpdir, uuid + '.h5'),
+            os.path.join(tmpdir, uuid + '.yaml')
+        )
+        assert store.labels().tolist() == [0, 1, 0]
+        assert store.num_entities == 2
+        assert store._matrix is None
+        assert store.matrix.index.equals(store.labels().index)
+
+        # dates written to a CSV are read back as strings, before the
+        # matrix is loaded as well as after
+        matrix['as_of_date'] = pandas.to_datetime(['2016-01-01', '2016-01-01', '2016-02-01'])
+        uuid = metta_io.archive_matrix(
+            metadata,
+            matrix.set_index(['entity_id', 'as_of_date']),
+            directory=tmpdir,
+            format='csv',
+            overwrite=True
+        )
+        store = CSVMatrixStore(
+            os.path.join(tmpdir, uuid + '.csv'),
+            os.path.join(tmpdir, uuid + '.yaml')
+        )
+        assert store.as_of_dates == ['2016-01-01', '2016-02-01']
+        assert store._matrix is None
+        assert store.matrix.index.equals(store.labels().index)
+        assert store.as_of_dates == ['2016-01-01', '2016-02-01']
+
+
+@pytest.mark.parametrize('as_of_dates', [
+    ['2016-01-01', '2016-01-01', '2016-02-01'],
+    ['2016-01-01 00:00:00', '2016-01-01 00:00:00', '2016-02-01 06:30:00'],
+])
+def test_CSVMatrixStore_index_dates(as_of_dates):
+    matrix = pandas.DataFrame.from_dict(OrderedDict([
+        ('entity_id', [1, 2, 1]),
+        ('as_of_date', pandas.to_datetime(as_of_dates)),
+        ('k_feature', [0.5, 0.4, 0.3]),
+        ('label', [0, 1, 0]),
+    ])).set_index(['entity_id', 'as_of_date'])
+    metadata = {
+        'label_name': 'label',
+        'indices': ['entity_id', 'as_of_date'],
+        'feature_start_time': datetime.date(2016, 1, 1),
+        'end_time': datetime.date(2016, 3, 1),
+        'label_timespan': '1y',
+        'matrix_id': 'index_dates_test',
+    }
+    with tempfile.TemporaryDirectory() as tmpdir:
+        uuid = metta_io.archive_matrix(metadata, matrix, directory=tmpdir, format='csv')
+        store = CSVMatrixStore(
+            os.path.join(tmpdir, uuid + '.csv'),
+            os.path.join(tmpdir, uuid + '.yaml')
+        )
+        # the dates are stored apart as the strings the CSV has
+        assert store.label_arrays['index_as_of_date'].tolist() == as_of_dates
+        index = store.index
+        assert store._matrix is None
+        assert index.tolist() == list(zip([1, 2, 1], as_of_dates))
+        assert store.matrix.index.equals(index)
+
+    matrix = pandas.DataFrame.from_dict(OrderedDict([
+        ('entity_id', [1, 2, 3]),
+        ('k_feature', [0.5, 0.4, 0.3]),
+        ('m_feature', [0.4, 0.5, 0.6]),
+        ('n_feature', [1, 2, 3]),
+    ])).set_index('entity_id')
+    labels = pandas.Series([0, 1, 0], index=matrix.index, name='label')
+    metadata = {'label_name': 'label', 'indices': ['entity_id'], 'metta-uuid': 'abcd'}
+    view_metadata = {
+        'label_name': 'label',
+        'indices': ['entity_id'],
+        'metta-uuid': 'efgh',
+        'feature_names': ['m_feature', 'k_feature'],
+        'source_matrix_uuid': 'abcd',
+    }
+    with tempfile.TemporaryDirectory() as tmpdir:
+        MemmapMatrixStore.write(matrix, labels, metadata, tmpdir, 'abcd')
+        with open(os.path.join(tmpdir, 'efgh.yaml'), 'w') as f:
+            yaml.dump(view_metadata, f)
+        source = MemmapMatrixStore(
+            os.path.join(tmpdir, 'abcd.memmap'),
+            os.path.join(tmpdir, 'abcd.yaml')
+        )
+        view = MatrixView(source, os.path.join(tmpdir, 'efgh.yaml'))
+        assert view.uuid == 'efgh'
+        # in the order of the source's columns
+        assert view.columns() == ['k_feature', 'm_feature']
+        assert view.columns(include_label=True) == ['k_feature', 'm_feature', 'label']
+        assert not view.empty
+        assert view.head_of_matrix.columns.tolist() == ['k_feature', 'm_feature']
+        assert view._matrix is None
+
+        assert view.matrix.values.tolist() == [[0.5, 0.4], [0.4, 0.5], [0.3, 0.6]]
+        assert view.labels().tolist() == [0, 1, 0]
+        assert view.matrix_with_sorted_columns(['m_feature', 'k_feature']).values.tolist() == \
+            [[0.4, 0.5], [0.5, 0.4], [0.6, 0.3]]
+        with pytest.raises(ValueError):
+            view.matrix_with_sorted_columns(['m_feature', 'n_feature'])
+
+        # a view can be shared with workers like any other matrix
+        broker = MatrixBroker(os.path.join(tmpdir, 'shared'))
+        shared = pickle.loads(pickle.dumps(broker.share(view)))
+        assert shared.columns() == ['k_feature', 'm_feature']
+        assert shared.labels().tolist() == [0, 1, 0]
+        broker.close()
+
+
+def test_SparseMatrixStore():
+    matrix = pandas.DataFrame.from_dict(OrderedDict([
+        ('entity_id', [1, 2, 1, 2]),
+        ('as_of_date', ['2016-01-01', '2016-01-01', '2017-01-01', '2017-01-01']),
+        ('k_feature', [0, 0, 0, 2.5]),
+        ('m_feature', [1, 0, 0, 0]),
+        ('n_feature', [0, 0, 3, 0]),
+    ])).set_index(['entity_id', 'as_of_date'])
+    labels = pandas.Series([0, 1, 0, 1], index=matrix.index, name='label')
+    metadata = {
+        'label_name': 'label',
+        'indices': ['entity_id', 'as_of_date'],
+        'metta-uuid': 'abcd',
+    }
+    view_metadata = dict(metadata, **{
+        'metta-uuid': 'efgh',
+        'feature_names': ['n_feature', 'k_feature'],
+        'source_matrix_uuid': 'abcd',
+    })
+    with tempfile.TemporaryDirectory() as tmpdir:
+        # written a chunk of rows at a time
+        SparseMatrixStore.write_chunks(
+            [(matrix[:3], labels[:3]), (matrix[3:], labels[3:])],
+            metadata,
+            tmpdir,
+            'abcd'
+        )
+        store = SparseMatrixStore(
+            os.path.join(tmpdir, 'abcd.sparse'),
+            os.path.join(tmpdir, 'abcd.yaml')
+        )
+        assert store.sparse
+        assert not store.empty
+        assert store.columns() == ['k_feature', 'm_feature', 'n_feature']
+        assert store.labels().tolist() == [0, 1, 0, 1]
+        assert store.as_of_dates == ['2016-01-01', '2017-01-01']
+        assert isinstance(store.sparse_matrix, scipy.sparse.csr_matrix)
+        assert store.sparse_matrix.nnz == 3
+        assert store.sparse_matrix_with_sorted_columns(
+            ['n_feature', 'k_feature', 'm_feature']
+        ).toarray().tolist() == [[0, 0, 1], [0, 0, 0], [3, 0, 0], [0, 2.5, 0]]
+        with pytest.raises(ValueError):
+            store.sparse_matrix_with_sorted_columns(['k_feature'])
+        # none of the above made a dense copy
+        assert store._matrix is None
+
+        assert store.matrix.to_dict() == matrix.to_dict()
+        assert store.head_of_matrix.index.tolist() == [(1, '2016-01-01')]
+
+        # sparse matrices are shared as they are, rather than densely
+        broker = MatrixBroker(os.path.join(tmpdir, 'shared'))
+        assert broker.share(store) is store
+        unpickled = pickle.loads(pickle.dumps(store))
+        assert unpickled.sparse_matrix.nnz == 3
+
+        with open(os.path.join(tmpdir, 'efgh.yaml'), 'w') as f:
+            yaml.dump(view_metadata, f)
+        view = MatrixView(store, os.path.join(tmpdir, 'efgh.yaml'))
+        assert view.sparse
+        assert view.sparse_matrix.toarray().tolist() == [[0, 0], [0, 0], [0, 3], [2.5, 0]]
+        assert view.sparse_matrix_with_sorted_columns(
+            ['n_feature', 'k_feature']
+        ).toarray().tolist() == [[0, 0], [0, 0], [3, 0], [0, 2.5]]
+        assert broker.share(view) is view
+        broker.close()
+
+        # a view's dense matrix is made from only its own columns
+        store = SparseMatrixStore(
+            os.path.join(tmpdir, 'abcd.sparse'),
+            os.path.join(tmpdir, 'abcd.yaml')
+        )
+        view = MatrixView(store, os.path.join(tmpdir, 'efgh.yaml'))
+        assert view.matrix.to_dict() == matrix[['k_feature', 'n_feature']].to_dict()
+        assert view.matrix_with_sorted_columns(
+            ['n_feature', 'k_feature']
+        ).to_dict() == matrix[['n_feature', 'k_feature']].to_dict()
+        assert store._matrix is None
+
+
+def test_ParquetMatrixStore():
+    pytest.importorskip('pyarrow')
+    matrix = pandas.DataFrame.from_dict(OrderedDict([
+        ('entity_id', [1, 2, 1, 2]),
+        ('as_of_date', ['2016-01-01', '2016-01-01', '2017-01-01', '2017-01-01']),
+        ('k_feature', [0.5, 0.4, 0.3, 0.2]),
+        ('m_feature', [1, 2, 3, 4]),
+    ])).set_index(['entity_id', 'as_of_date'])
+    labels = pandas.Series([0, 1, 0, 1], index=matrix.index, name='label')
+    metadata = {
+        'label_name': 'label',
+        'indices': ['entity_id', 'as_of_date'],
+        'metta-uuid': 'abcd',
+    }
+    with tempfile.TemporaryDirectory() as tmpdir:
+        ParquetMatrixStore.write(matrix, labels, metadata, tmpdir, 'abcd')
+        store = ParquetMatrixStore(
+            os.path.join(tmpdir, 'abcd.parquet'),
+            os.path.join(tmpdir, 'abcd.yaml')
+        )
+        assert not store.empty
+        assert store.columns() == ['k_feature', 'm_feature']
+        assert store.columns(include_label=True) == ['k_feature', 'm_feature', 'label']
+        # the footer is read once, and not sent to workers
+        file_metadata = store._file_metadata
+        assert file_metadata is not None
+        store.columns()
+        assert store._file_metadata is file_metadata
+        assert '_file_metadata' not in pickle.loads(pickle.dumps(store)).__dict__
+        assert store.labels().tolist() == [0, 1, 0, 1]
+        # only the requested columns are read
+        assert store.matrix_with_sorted_columns(
+            ['m_feature', 'k_feature']
+        ).values.tolist() == [[1, 0.5], [2, 0.4], [3, 0.3], [4, 0.2]]
+        assert store._matrix is None
+        with pytest.raises(ValueError):
+            store.matrix_with_sorted_columns(['m_feature'])
+
+        assert store.matrix.to_dict() == matrix.to_dict()
+        assert store.as_of_dates == ['2016-01-01', '2017-01-01']
+        assert store.head_of_matrix.index.tolist() == [(1, '2016-01-01')]
+
+
+def test_MatrixCache():
+    matrix = pandas.DataFrame.from_dict(OrderedDict([
+        ('entity_id', [1, 2, 3]),
+        ('k_feature', [0.5, 0.4, 0.3]),
+        ('label', [0, 1, 0]),
+    ]))
+    metadata = {'label_name': 'label', 'indices': ['entity_id']}
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for name in ('first', 'second'):
+            matrix.to_csv(os.path.join(tmpdir, name + '.csv'), index=False)
+            with open(os.path.join(tmpdir, name + '.yaml'), 'w') as f:
+                yaml.dump(metadata, f)
+
+        def make_store(name):
+            return lambda: CSVMatrixStore(
+                os.path.join(tmpdir, name + '.csv'),
+                os.path.join(tmpdir, name + '.yaml')
+            )
+
+        cache = MatrixCache(max_bytes=10 ** 6)
+        first = cache.get('first', make_store('first'))
+        assert cache.get('first', make_store('first')) is first
+        assert (cache.hits, cache.misses) == (1, 1)
+
+        # over the budget, the least recently used matrix is dropped
+        first.matrix
+        cache.max_bytes = first.loaded_bytes
+        second = cache.get('second', make_store('second'))
+        second.matrix
+        assert cache.get('second', make_store('second')) is second
+        assert cache.evictions == 1
+        assert cache.get('first', make_store('first')) is not first
+
+        # a matrix written again is read again
+        second_yaml = os.path.join(tmpdir, 'second.yaml')
+        os.utime(second_yaml, (0, 0))
+        assert cache.get('second', make_store('second')) is not second
+
+        # a matrix being read on another thread isn't sized until it's read
+        reading, done = threading.Event(), threading.Event()
+
+        def read_slowly():
+            with first._loading:
+                reading.set()
+                done.wait()
+
+        reader = threading.Thread(target=read_slowly)
+        reader.start()
+        reading.wait()
+        assert MatrixCache._loaded_bytes(first) == 0
+        done.set()
+        reader.join()
+        assert MatrixCache._loaded_bytes(first) == first.loaded_bytes > 0
+
+
+def test_MatrixPrefetcher():
+    matrix = pandas.DataFrame.from_dict(OrderedDict([
+        ('entity_id', [1, 2, 3]),
+        ('k_feature', [0.5, 0.4, 0.3]),
+        ('label', [0, 1, 0]),
+    ]))
+    metadata = {'label_name': 'label', 'indices': ['entity_id']}
+    with tempfile.TemporaryDirectory() as tmpdir:
+        names = ['first', 'second', 'third']
+        for name in names:
+            matrix.to_csv(os.path.join(tmpdir, name + '.csv'), index=False)
+            with open(os.path.join(tmpdir, name + '.yaml'), 'w') as f:
+                yaml.dump(metadata, f)
+        made = []
+
+        def make_store(name):
+            made.append(name)
+            return CSVMatrixStore(
+                os.path.join(tmpdir, name + '.csv'),
+                os.path.join(tmpdir, name + '.yaml')
+            )
+
+        prefetcher = MatrixPrefetcher(make_store, max_prefetched=1)
+        try:
+            first = prefetcher.get('first')
+            assert first._matrix is None
+            # only as many as allowed are loaded ahead
+            prefetcher.prefetch(['second', 'third'])
+            assert made == ['first', 'second']
+            second = prefetcher.get('second')
+            assert second._matrix is not None
+            assert second.labels().tolist() == [0, 1, 0]
+            assert second.matrix.columns.tolist() == ['k_feature']
+
+            # matrices already taken aren't loaded again, and those no longer
+            # coming up are let go
+            prefetcher.prefetch(['second', 'third'])
+            prefetcher.prefetch(['first'])
+            assert made == ['first', 'second', 'third']
+            assert prefetcher.get('third')._matrix is None
+        finally:
+            prefetcher.close()
@@ -1,14 +1,23 @@
 """Tests for Metta IO"""
 import copy
 import datetime
+import json
 import os
 import unittest
 from dateutil.relativedelta import relativedelta
 from shutil import rmtree
 from tempfile import mkdtemp
 
+import numpy
 import pandas as pd
-
+import pytest
+import yaml
+
+from triage.component.catwalk.storage import (
+    MemmapMatrixStore,
+    ParquetMatrixStore,
+    SparseMatrixStore,
+)
 from triage.component.metta import metta_io
 
 
@@ -116,6 +125,169 @@ class TestMettaIO(unittest.TestCase):
             assert os.path.isfile(self.temp_file('{}.csv'.format(test_uuid)))
             assert os.path.isfile(self.temp_file('{}.yaml'.format(test_uuid)))
 
+    def test_archive_matrix_memmap(self):
+        df_data = pd.read_csv(example_data_csv)
+        uuid = metta_io.archive_matrix(
+            dict_test_config,
+            df_data,
+            directory=self.temp_dir,
+            format='memmap'
+        )
+        assert os.path.isdir(self.temp_file('{}.memmap'.format(uuid)))
+        assert os.path.isfile(self.temp_file('{}.yaml'.format(uuid)))
+
+        matrix_store = MemmapMatrixStore(
+            self.temp_file('{}.memmap'.format(uuid)),
+            self.temp_file('{}.yaml'.format(uuid))
+        )
+        assert matrix_store.uuid == uuid
+        assert matrix_store.columns() == ['Age', 'SexCode']
+        assert matrix_store.labels().tolist() == df_data['Survived'].tolist()
+        numpy.testing.assert_array_equal(
+            matrix_store.matrix.values,
+            df_data[['Age', 'SexCode']].astype(float).values
+        )
+
+    def test_archive_matrix_parquet(self):
+        pytest.importorskip('pyarrow')
+        df_data = pd.read_csv(example_data_csv)
+        uuid = metta_io.archive_matrix(
+            dict_test_config,
+            df_data,
+            directory=self.temp_dir,
+            format='parquet'
+        )
+        assert os.path.isfile(self.temp_file('{}.parquet'.format(uuid)))
+
+        matrix_store = ParquetMatrixStore(
+            self.temp_file('{}.parquet'.format(uuid)),
+            self.temp_file('{}.yaml'.format(uuid))
+        )
+        assert matrix_store.uuid == uuid
+        assert matrix_store.columns() == ['Age', 'SexCode']
+        assert matrix_store.labels().tolist() == df_data['Survived'].tolist()
+
+    def test_infer_compact_dtypes(self):
+        df_data = pd.DataFrame({
+            'flag': [0, 1, 1, 0],
+            'count': [0, 300, 2, 1],
+            'halves': [0.5, 0.25, 1.5, 2.5],
+            'tenths': [0.1, 0.2, 0.3, 0.4],
+            'null_ints': [1, None, 3, 4],
+            'big': [0, 2 ** 40, 1, 1],
+        })
+        feature_names = ['flag', 'count', 'halves', 'tenths', 'null_ints', 'big']
+        expected = {
+            'flag': 'int8',
+            'count': 'int16',
+            'halves': 'float32',
+            'tenths': 'float64',
+            'null_ints': 'float32',
+            'big': 'float32',
+        }
+        assert metta_io.infer_compact_dtypes(df_data, feature_names) == expected
+
+        # a CSV is read in chunks, with the same result
+        csv_path = self.temp_file('compact.csv')
+        df_data.to_csv(csv_path, index=False)
+        assert metta_io.infer_compact_dtypes(csv_path, feature_names, chunksize=1) == expected
+
+    def test_archive_matrix_compact_dtypes(self):
+        df_data = pd.read_csv(example_data_csv)
+        uuid = metta_io.archive_matrix(
+            dict_test_config,
+            example_data_csv,
+            directory=self.temp_dir,
+            format='csv',
+            compact_dtypes=True
+        )
+        # the uuid doesn't depend on the types found
+        assert uuid == metta_io.generate_uuid(dict_test_config)
+        with open(self.temp_file('{}.yaml'.format(uuid))) as f:
+            metadata = yaml.load(f)
+        # fractional ages, such as 0.17, can't be stored exactly as float32
+        assert metadata['feature_dtypes'] == {'Age': 'float64', 'SexCode': 'int8'}
+        # the CSV itself is unchanged
+        assert pd.read_csv(self.temp_file('{}.csv'.format(uuid))).fillna(-1).values.tolist() == \
+            df_data.fillna(-1).values.tolist()
+
+        # with whole ages, every feature fits in float32
+        df_data['Age'] = df_data['Age'].round()
+        uuid = metta_io.archive_matrix(
+            dict_test_config,
+            df_data,
+            directory=self.temp_dir,
+            format='memmap',
+            compact_dtypes=True
+        )
+        matrix_store = MemmapMatrixStore(
+            self.temp_file('{}.memmap'.format(uuid)),
+            self.temp_file('{}.yaml'.format(uuid))
+        )
+        assert matrix_store.matrix.values.dtype == numpy.float32
+        numpy.testing.assert_array_equal(
+            matrix_store.matrix.values,
+            df_data[['Age', 'SexCode']].values
+        )
+
+    def test_archive_matrix_summary(self):
+        df_data = pd.read_csv(example_data_csv)
+        # CSVs are read a few rows at a time
+        original_chunk_rows = metta_io.CSV_CHUNK_ROWS
+        metta_io.CSV_CHUNK_ROWS = 100
+        try:
+            uuid = metta_io.archive_matrix(
+                dict_test_config,
+                example_data_csv,
+                directory=self.temp_dir,
+                format='csv',
+                compact_dtypes=True
+            )
+        finally:
+            metta_io.CSV_CHUNK_ROWS = original_chunk_rows
+        with open(self.temp_file('{}.summary.json'.format(uuid))) as f:
+            summary = json.load(f)
+        assert summary['rows'] == len(df_data)
+        assert summary['columns'] == ['Age', 'SexCode']
+        assert summary['dtypes'] == {'Age': 'float64', 'SexCode': 'int8', 'Survived': 'int64'}
+        assert summary['label_counts'] == [
+            [label, count] for label, count in sorted(df_data['Survived'].value_counts().items())
+        ]
+        assert summary['column_stats']['Age']['nulls'] == df_data['Age'].isnull().sum()
+        assert summary['column_stats']['Age']['min'] == df_data['Age'].min()
+        assert summary['column_stats']['Age']['max'] == df_data['Age'].max()
+        assert summary['column_stats']['Age']['mean'] == pytest.approx(df_data['Age'].mean())
+        assert summary['column_stats']['SexCode']['nulls'] == 0
+        # the summary isn't part of the metadata
+        with open(self.temp_file('{}.yaml'.format(uuid))) as f:
+            assert 'rows' not in yaml.load(f)
+
+    def test_archive_matrix_sparse(self):
+        df_data = pd.read_csv(example_data_csv)
+        # CSVs are read a few rows at a time
+        original_chunk_rows = metta_io.CSV_CHUNK_ROWS
+        metta_io.CSV_CHUNK_ROWS = 100
+        try:
+            uuid = metta_io.archive_matrix(
+                dict_test_config,
+                example_data_csv,
+                directory=self.temp_dir,
+                format='sparse'
+            )
+        finally:
+            metta_io.CSV_CHUNK_ROWS = original_chunk_rows
+        matrix_store = SparseMatrixStore(
+            self.temp_file('{}.sparse'.format(uuid)),
+            self.temp_file('{}.yaml'.format(uuid))
+        )
+        assert matrix_store.uuid == uuid
+        assert matrix_store.columns() == ['Age', 'SexCode']
+        assert matrix_store.labels().tolist() == df_data['Survived'].tolist()
+        numpy.testing.assert_array_equal(
+            matrix_store.sparse_matrix.toarray(),
+            df_data[['Age', 'SexCode']].values
+        )
+
     def test_archive_train_test(self):
         df_data = pd.read_csv(example_data_csv)
 
@@ -160,7 +332,8 @@ class TestMettaIO(unittest.TestCase):
 
         assert (later_creation_time - prior_creation_time) > 0
 
-        assert len(os.listdir(self.temp_dir)) == 2
+        # the matrix, its metadata, and its summary
+        assert len(os.listdir(self.temp_dir)) == 3
 
     def test_recover(self):
         df_data = pd.read_csv(example_data_csv)
@@ -1,10 +1,28 @@
+from unittest import mock
+
 import testing.postgresql
 from sqlalchemy import create_engine
 
-from triage.component.results_schema import Base
+from triage.component.catwalk.db import ensure_db
+from triage.component.results_schema import Base, schema_fingerprint
 
 
 def test_full_schema():
     with testing.postgresql.Postgresql() as postgres:
         engine = create_engine(postgres.url())
         Base.metadata.create_all(bind=engine)
+
+
+def test_ensure_db_records_schema_version():
+    with testing.postgresql.Postgresql() as postgres:
+        engine = create_engine(postgres.url())
+        ensure_db(engine)
+        ((fingerprint,),) = engine.execute(
+            'select schema_fingerprint from results.schema_versions'
+        )
+        assert fingerprint == schema_fingerprint()
+
+        # once recorded, the schema isn't created again
+        with mock.patch.object(Base.metadata, 'create_all') as create_all:
+            ensure_db(engine)
+            assert not create_all.called
@@ -0,0 +1,150 @@
+import multiprocessing
+import os
+import queue
+from tempfile import TemporaryDirectory
+
+import testing.postgresql
+from sqlalchemy import create_engine
+
+from triage.component.catwalk.db import ensure_db
+from triage.component.catwalk.storage import FSModelStorageEngine
+
+from tests.utils import sample_config, populate_source_data
+
+from triage.experiments import DistributedExperiment
+from triage.experiments.distributed import (
+    DatabaseTaskQueue,
+    run_next_task,
+    run_worker,
+)
+
+
+def add(first, second):
+    return first + second
+
+
+def fail():
+    raise ValueError('failed')
+
+
+def save_experiment(db_engine):
+    db_engine.execute(
+        "insert into results.experiments (experiment_hash, config) values ('abcd', '{}')"
+    )
+
+
+def test_task_queue_runs_tasks():
+    with testing.postgresql.Postgresql() as postgresql:
+        db_engine = create_engine(postgresql.url())
+        ensure_db(db_engine)
+        save_experiment(db_engine)
+        task_queue = DatabaseTaskQueue(db_engine, 'abcd', 'cpu', poll_interval=0.1)
+        results = queue.Queue()
+        task_queue.apply_async(add, (1, 2), callback=results.put)
+        task_queue.apply_async(fail, error_callback=results.put)
+
+        # only tasks in the requested pools are run
+        assert not run_next_task(db_engine, pools=['db'])
+        assert run_next_task(db_engine, experiment_hash='abcd', pools=['cpu'])
+        assert results.get(timeout=10) == 3
+        assert run_next_task(db_engine)
+        assert isinstance(results.get(timeout=10), RuntimeError)
+        assert not run_next_task(db_engine)
+
+        task_queue.terminate()
+        task_queue.join()
+        # finished tasks are removed from the queue
+        ((count,),) = db_engine.execute('select count(*) from results.task_queue')
+        assert count == 0
+
+
+def test_task_queue_terminate_removes_pending_tasks():
+    with testing.postgresql.Postgresql() as postgresql:
+        db_engine = create_engine(postgresql.url())
+        ensure_db(db_engine)
+        save_experiment(db_engine)
+        task_queue = DatabaseTaskQueue(db_engine, 'abcd', 'cpu')
+        task_queue.apply_async(add, (1, 2))
+        task_queue.terminate()
+        task_queue.join()
+        assert not run_next_task(db_engine)
+
+
+def test_task_queue_terminate_skips_claimed_tasks():
+    with testing.postgresql.Postgresql() as postgresql:
+        db_engine = create_engine(postgresql.url())
+        ensure_db(db_engine)
+        save_experiment(db_engine)
+        task_queue = DatabaseTaskQueue(db_engine, 'abcd', 'cpu')
+        task_queue.apply_async(add, (1, 2))
+        task_queue.apply_async(add, (3, 4))
+        # while a worker holds the first task, terminating doesn't wait for it
+        with db_engine.begin() as conn:
+            conn.execute(
+                'select * from results.task_queue order by task_id limit 1 for update'
+            )
+            # fail rather than hang if terminate waits on the lock
+            task_queue.db_engine = create_engine(
+                postgresql.url(),
+                connect_args={'options': '-c statement_timeout=5000'}
+            )
+            task_queue.terminate()
+            task_queue.join()
+        ((count,),) = db_engine.execute('select count(*) from results.task_queue')
+        assert count == 1
+
+
+def test_task_claimed_by_one_worker():
+    with testing.postgresql.Postgresql() as postgresql:
+        db_engine = create_engine(postgresql.url())
+        ensure_db(db_engine)
+        save_experiment(db_engine)
+        task_queue = DatabaseTaskQueue(db_engine, 'abcd', 'cpu')
+        task_queue.apply_async(add, (1, 2))
+        # while one worker holds the task, another finds nothing to claim
+        with db_engine.begin() as conn:
+            conn.execute('select * from results.task_queue for update')
+            other_engine = create_engine(postgresql.url())
+            assert not run_next_task(other_engine)
+        assert run_next_task(db_engine)
+        task_queue.terminate()
+
+
+def test_distributed_experiment():
+    n_workers = 2
+    with testing.postgresql.Postgresql() as postgresql:
+        db_engine = create_engine(postgresql.url())
+        ensure_db(db_engine)
+        populate_source_data(db_engine)
+        workers = [
+            multiprocessing.Process(
+                target=run_worker,
+                args=(postgresql.url(),),
+                kwargs={'poll_interval': 0.1}
+            )
+            for _ in range(n_workers)
+        ]
+        for worker in workers:
+            worker.start()
+        try:
+            with TemporaryDirectory() as temp_dir:
+                DistributedExperiment(
+                    config=sample_config(),
+                    db_engine=db_engine,
+                    model_storage_class=FSModelStorageEngine,
+                    project_path=os.path.join(temp_dir, 'inspections'),
+                    n_processes=n_workers,
+                    n_db_processes=n_workers,
+                    poll_interval=0.1,
+                ).run()
+        finally:
+            for worker in workers:
+                worker.terminate()
+                worker.join()
+
+        num_evaluations = len([
+            row for row in db_engine.execute('select * from results.evaluations')
+        ])
+        assert num_evaluations > 0
+        ((count,),) = db_engine.execute('select count(*) from results.task_queue')
+        assert count == 0
@@ -1,7 +1,11 @@
+import multiprocessing
 import os
+import subprocess
+import sys
 import time
 from datetime import datetime, timedelta
 from functools import partial
+from multiprocessing.pool import ThreadPool
 from tempfile import TemporaryDirectory
 from unittest import mock, TestCase
 
@@ -10,7 +14,10 @@ import testing.postgresql
 from sqlalchemy import create_engine
 
 from triage.component.catwalk.db import ensure_db
-from triage.component.catwalk.storage import FSModelStorageEngine
+from triage.component.catwalk.storage import (
+    FSModelStorageEngine,
+    MatrixBroker,
+)
 
 from tests.utils import sample_config, populate_source_data
 
@@ -19,6 +26,8 @@ from triage.experiments import (
     SingleThreadedExperiment,
     CONFIG_VERSION,
 )
+from triage.experiments.multicore import worker_db_engine
+from triage.experiments.task_graph import TaskGraph
 
 
 def num_linked_evaluations(db_engine):
@@ -124,6 +133,13 @@ def test_simple_experiment(experiment_class):
         ''')]
         assert len(individual_importances) == num_predictions * 2  # only 2 features
 
+        # 9. that the entity-date tables shared by matrices are dropped
+        entity_date_tables = [row for row in db_engine.execute('''
+            select * from information_schema.tables
+            where table_schema = 'features' and table_name like 'entity_dates%%'
+        ''')]
+        assert entity_date_tables == []
+
 
 @parametrize_experiment_classes
 def test_restart_experiment(experiment_class):
@@ -155,6 +171,144 @@ def test_restart_experiment(experiment_class):
             assert not experiment.make_entity_date_table.called
 
 
+def test_restart_experiment_skips_completed_tasks():
+    with testing.postgresql.Postgresql() as postgresql:
+        db_engine = create_engine(postgresql.url())
+        ensure_db(db_engine)
+        populate_source_data(db_engine)
+        with TemporaryDirectory() as temp_dir:
+            MultiCoreExperiment(
+                config=sample_config(),
+                db_engine=db_engine,
+                model_storage_class=FSModelStorageEngine,
+                project_path=os.path.join(temp_dir, 'inspections'),
+            ).run()
+            completed = dict(list(db_engine.execute('''
+                select task_type, count(*) from results.completed_tasks group by task_type
+            ''')))
+            assert completed['features'] == len(sample_config()['feature_aggregations'])
+            assert completed['matrix'] > 0
+            assert completed['model'] > 0
+            assert completed['evaluation'] > 0
+
+            experiment = MultiCoreExperiment(
+                config=sample_config(),
+                db_engine=db_engine,
+                model_storage_class=FSModelStorageEngine,
+                project_path=os.path.join(temp_dir, 'inspections'),
+                replace=False
+            )
+            with mock.patch.object(
+                TaskGraph,
+                'add_task',
+                autospec=True,
+                side_effect=TaskGraph.add_task
+            ) as add_task_mock:
+                experiment.run()
+            added_task_types = set(
+                call[0][1][0] for call in add_task_mock.call_args_list
+                if isinstance(call[0][1], tuple)
+            )
+            assert not added_task_types & {'feature_prepare', 'matrix', 'train', 'test'}
+
+
+def test_multicore_releases_shared_matrices():
+    with testing.postgresql.Postgresql() as postgresql:
+        db_engine = create_engine(postgresql.url())
+        ensure_db(db_engine)
+        populate_source_data(db_engine)
+        left_at_close = []
+        original_close = MatrixBroker.close
+
+        def close(broker):
+            left_at_close.extend(os.listdir(broker.directory))
+            original_close(broker)
+
+        with TemporaryDirectory() as temp_dir:
+            experiment = MultiCoreExperiment(
+                config=sample_config(),
+                db_engine=db_engine,
+                model_storage_class=FSModelStorageEngine,
+                project_path=os.path.join(temp_dir, 'inspections'),
+            )
+            with mock.patch.object(
+                MatrixBroker,
+                'release',
+                autospec=True,
+                side_effect=MatrixBroker.release
+            ) as release_mock, mock.patch.object(
+                MatrixBroker,
+                'close',
+                autospec=True,
+                side_effect=close
+            ):
+                experiment.run()
+            assert num_linked_evaluations(db_engine) > 0
+            released = [call[0][1] for call in release_mock.call_args_list]
+            # each matrix is released once, after the last split using it
+            assert sorted(released) == sorted(set(
+                matrix_uuid
+                for split in experiment.full_matrix_definitions
+                for matrix_uuid in [split['train_uuid']] + split['test_uuids']
+            ))
+            # so no copies were left to be removed at the end
+            assert left_at_close == []
+
+
+def _added_task_types(experiment):
+    with mock.patch.object(
+        TaskGraph,
+        'add_task',
+        autospec=True,
+        side_effect=TaskGraph.add_task
+    ) as add_task_mock:
+        experiment.run()
+    return set(
+        call[0][1][0] for call in add_task_mock.call_args_list
+        if isinstance(call[0][1], tuple)
+    )
+
+
+def test_restart_experiment_rebuilds_missing_outputs():
+    with testing.postgresql.Postgresql() as postgresql:
+        db_engine = create_engine(postgresql.url())
+        ensure_db(db_engine)
+        populate_source_data(db_engine)
+        with TemporaryDirectory() as temp_dir:
+            MultiCoreExperiment(
+                config=sample_config(),
+                db_engine=db_engine,
+                model_storage_class=FSModelStorageEngine,
+                project_path=os.path.join(temp_dir, 'inspections'),
+            ).run()
+
+            # the same experiment in another project has none of the matrices
+            # or models, so the ledger must not skip them
+            added_task_types = _added_task_types(MultiCoreExperiment(
+                config=sample_config(),
+                db_engine=db_engine,
+                model_storage_class=FSModelStorageEngine,
+                project_path=os.path.join(temp_dir, 'other_inspections'),
+                replace=False
+            ))
+            assert {'matrix', 'train'} <= added_task_types
+
+            # deleted matrix files are rebuilt even though the ledger has them
+            matrices_directory = os.path.join(temp_dir, 'inspections', 'matrices')
+            for filename in os.listdir(matrices_directory):
+                if not filename.endswith('.yaml'):
+                    os.remove(os.path.join(matrices_directory, filename))
+            added_task_types = _added_task_types(MultiCoreExperiment(
+                config=sample_config(),
+                db_engine=db_engine,
+                model_storage_class=FSModelStorageEngine,
+                project_path=os.path.join(temp_dir, 'inspections'),
+                replace=False
+            ))
+            assert 'matrix' in added_task_types
+            assert 'train' not in added_task_types
+
+
 @parametrize_experiment_classes
 def test_nostate_experiment(experiment_class):
     with testing.postgresql.Postgresql() as postgresql:
@@ -337,3 +491,362 @@ def test_build_error_cleanup_timeout(_clean_up_mock, experiment_class):
     # Last exception is TimeoutError, but earlier error is preserved in
     # __context__, and will be noted as well in any standard traceback:
     assert exc_info.value.__context__ is build_mock.side_effect
+
+
+def test_worker_db_engine_reused():
+    assert worker_db_engine('sqlite://') is worker_db_engine('sqlite://')
+    assert worker_db_engine('sqlite://') is not worker_db_engine('sqlite:///:memory:')
+
+
+def test_import_does_not_load_modeling_libraries():
+    # a fresh interpreter, since this one has already imported them
+    loaded = subprocess.check_output([
+        sys.executable,
+        '-c',
+        'import sys, triage.experiments; '
+        'print(" ".join(m for m in ("sklearn", "pandas", "boto3", "alembic") '
+        'if m in sys.modules))'
+    ], env=dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))).decode().split()
+    assert loaded == []
+
+
+def test_multicore_pools_reused():
+    with testing.postgresql.Postgresql() as postgresql:
+        db_engine = create_engine(postgresql.url())
+        ensure_db(db_engine)
+        populate_source_data(db_engine)
+        with TemporaryDirectory() as temp_dir:
+            experiment = MultiCoreExperiment(
+                config=sample_config(),
+                db_engine=db_engine,
+                model_storage_class=FSModelStorageEngine,
+                project_path=os.path.join(temp_dir, 'inspections'),
+                n_processes=2,
+                n_db_processes=2,
+            )
+            with mock.patch(
+                'triage.experiments.multicore.Pool',
+                wraps=multiprocessing.Pool
+            ) as pool_mock:
+                experiment.build_matrices()
+                experiment.catwalk()
+                assert pool_mock.call_count == 2
+                experiment.close_pools()
+                assert experiment._pools is None
+            assert num_linked_evaluations(db_engine) > 0
+
+
+def test_worker_db_engine_pool_size():
+    with testing.postgresql.Postgresql() as postgresql:
+        db_engine = worker_db_engine(postgresql.url())
+        assert worker_db_engine(postgresql.url(), pool_size=2) is db_engine
+        # a larger engine replaces the default one, and is then reused
+        larger_engine = worker_db_engine(postgresql.url(), pool_size=20)
+        assert larger_engine is not db_engine
+        assert larger_engine.pool.size() == 20
+        assert worker_db_engine(postgresql.url()) is larger_engine
+        larger_engine.dispose()
+
+
+def test_multicore_db_threads():
+    with testing.postgresql.Postgresql() as postgresql:
+        db_engine = create_engine(postgresql.url())
+        ensure_db(db_engine)
+        populate_source_data(db_engine)
+        with TemporaryDirectory() as temp_dir:
+            experiment = MultiCoreExperiment(
+                config=sample_config(),
+                db_engine=db_engine,
+                model_storage_class=FSModelStorageEngine,
+                project_path=os.path.join(temp_dir, 'inspections'),
+                n_processes=2,
+                n_db_processes=8,
+                db_threads=True,
+            )
+            assert isinstance(experiment.pools['db'], ThreadPool)
+            assert not isinstance(experiment.pools['cpu'], ThreadPool)
+            experiment.run()
+        assert num_linked_evaluations(db_engine) > 0
+
+        # peak memory of the whole process isn't recorded for a thread's task
+        telemetry = list(db_engine.execute('''
+            select task_type, peak_rss from results.task_telemetry
+            where experiment_hash = %s
+        ''', experiment.experiment_hash))
+        for row in telemetry:
+            if row['task_type'] in ('labels', 'test'):
+                assert row['peak_rss'] is None
+            if row['task_type'] in ('matrix', 'train'):
+                assert row['peak_rss'] > 0
+
+
+@parametrize_experiment_classes
+def test_experiment_matrix_format(experiment_class):
+    with testing.postgresql.Postgresql() as postgresql:
+        db_engine = create_engine(postgresql.url())
+        ensure_db(db_engine)
+        populate_source_data(db_engine)
+        with TemporaryDirectory() as temp_dir:
+            project_path = os.path.join(temp_dir, 'inspections')
+            experiment_class(
+                config=sample_config(),
+                db_engine=db_engine,
+                model_storage_class=FSModelStorageEngine,
+                project_path=project_path,
+                matrix_format='memmap',
+            ).run()
+            matrix_files = os.listdir(os.path.join(project_path, 'matrices'))
+            assert any(name.endswith('.memmap') for name in matrix_files)
+            assert not any(name.endswith('.csv') for name in matrix_files)
+        assert num_linked_evaluations(db_engine) > 0
+
+
+@parametrize_experiment_classes
+def test_experiment_sparse_matrices(experiment_class):
+    with testing.postgresql.Postgresql() as postgresql:
+        db_engine = create_engine(postgresql.url())
+        ensure_db(db_engine)
+        populate_source_data(db_engine)
+        with TemporaryDirectory() as temp_dir:
+            project_path = os.path.join(temp_dir, 'inspections')
+            experiment = experiment_class(
+                config=sample_config(),
+                db_engine=db_engine,
+                model_storage_class=FSModelStorageEngine,
+                project_path=project_path,
+                matrix_format='sparse',
+            )
+            experiment.run()
+            for matrix_uuid in experiment.matrix_build_tasks:
+                assert experiment.matrix_store(matrix_uuid).sparse
+        assert num_linked_evaluations(db_engine) > 0
+
+
+@pytest.mark.parametrize(('matrix_builder', 'builder_class_name', 'matrix_format'), [
+    ('streaming', 'StreamingCSVBuilder', 'csv'),
+    ('joined', 'JoinedCSVBuilder', 'csv'),
+    ('joined', 'JoinedCSVBuilder', 'hd5'),
+    ('binary', 'BinaryCopyBuilder', 'csv'),
+    ('partitioned', 'PartitionedCSVBuilder', 'csv'),
+])
+def test_experiment_matrix_builder(matrix_builder, builder_class_name, matrix_format):
+    with testing.postgresql.Postgresql() as postgresql:
+        db_engine = create_engine(postgresql.url())
+        ensure_db(db_engine)
+        populate_source_data(db_engine)
+        with TemporaryDirectory() as temp_dir:
+            experiment = SingleThreadedExperiment(
+                config=sample_config(),
+                db_engine=db_engine,
+                model_storage_class=FSModelStorageEngine,
+                project_path=os.path.join(temp_dir, 'inspections'),
+                matrix_builder=matrix_builder,
+                matrix_format=matrix_format,
+            )
+            assert type(experiment.planner.builder).__name__ == builder_class_name
+            experiment.run()
+            for matrix_uuid in experiment.matrix_build_tasks:
+                matrix_store = experiment.matrix_store(matrix_uuid)
+                assert matrix_store.matrix.index.names == matrix_store.metadata['indices']
+        assert num_linked_evaluations(db_engine) > 0
+
+
+def test_experiment_compact_dtypes():
+    with testing.postgresql.Postgresql() as postgresql:
+        db_engine = create_engine(postgresql.url())
+        ensure_db(db_engine)
+        populate_source_data(db_engine)
+        with TemporaryDirectory() as temp_dir:
+            experiment = SingleThreadedExperiment(
+                config=sample_config(),
+                db_engine=db_engine,
+                model_storage_class=FSModelStorageEngine,
+                project_path=os.path.join(temp_dir, 'inspections'),
+                compact_dtypes=True,
+            )
+            experiment.run()
+            for matrix_uuid in experiment.matrix_build_tasks:
+                matrix_store = experiment.matrix_store(matrix_uuid)
+                feature_dtypes = matrix_store.metadata['feature_dtypes']
+                assert sorted(feature_dtypes.keys()) == sorted(matrix_store.columns())
+                assert all(
+                    matrix_store.matrix[column].dtype == feature_dtypes[column]
+                    for column in matrix_store.columns()
+                )
+                # imputation flags are stored as small integers
+                assert all(
+                    feature_dtypes[column] == 'int8'
+                    for column in matrix_store.columns() if column.endswith('_imp')
+                )
+        assert num_linked_evaluations(db_engine) > 0
+
+
+def test_experiment_matrix_cache():
+    with testing.postgresql.Postgresql() as postgresql:
+        db_engine = create_engine(postgresql.url())
+        ensure_db(db_engine)
+        populate_source_data(db_engine)
+        with TemporaryDirectory() as temp_dir:
+            experiment = SingleThreadedExperiment(
+                config=sample_config(),
+                db_engine=db_engine,
+                model_storage_class=FSModelStorageEngine,
+                project_path=os.path.join(temp_dir, 'inspections'),
+                matrix_cache_bytes=10 ** 9,
+            )
+            assert experiment.matrix_cache.max_bytes == 10 ** 9
+            experiment.run()
+            # matrices used more than once, like the test matrices shared
+            # by splits, were only read once
+            assert experiment.matrix_cache.hits > 0
+            # and aren't held onto after the run
+            assert len(experiment.matrix_cache._stores) == 0
+            matrix_uuid = next(iter(experiment.matrix_build_tasks))
+            assert experiment.matrix_store(matrix_uuid) is experiment.matrix_store(matrix_uuid)
+
+
+@parametrize_experiment_classes
+def test_experiment_matrix_views(experiment_class):
+    config = sample_config()
+    config['feature_group_definition'] = {
+        'prefix': ['entity_features', 'zip_code_features']
+    }
+    config['feature_group_strategies'] = ['leave-one-in']
+    with testing.postgresql.Postgresql() as postgresql:
+        db_engine = create_engine(postgresql.url())
+        ensure_db(db_engine)
+        populate_source_data(db_engine)
+        with TemporaryDirectory() as temp_dir:
+            project_path = os.path.join(temp_dir, 'inspections')
+            experiment = experiment_class(
+                config=config,
+                db_engine=db_engine,
+                model_storage_class=FSModelStorageEngine,
+                project_path=project_path,
+                matrix_views=True,
+            )
+            experiment.run()
+            matrix_files = os.listdir(os.path.join(project_path, 'matrices'))
+            # only the matrices with both feature groups are built
+            views = [
+                matrix_uuid for matrix_uuid, build_task
+                in experiment.matrix_build_tasks.items()
+                if build_task.get('source_matrix_uuid')
+            ]
+            assert len(views) == 2 * (len(experiment.matrix_build_tasks) - len(views))
+            assert len([name for name in matrix_files if name.endswith('.csv')]) == \
+                len(experiment.matrix_build_tasks) - len(views)
+            assert len([name for name in matrix_files if name.endswith('.yaml')]) == \
+                len(experiment.matrix_build_tasks)
+            for view_uuid in views:
+                assert len(experiment.matrix_store(view_uuid).columns()) < \
+                    len(experiment.matrix_store(
+                        experiment.matrix_build_tasks[view_uuid]['source_matrix_uuid']
+                    ).columns())
+        assert num_linked_evaluations(db_engine) > 0
+
+        # models are trained on the views' features only
+        feature_counts = set(
+            row[0] for row in db_engine.execute('''
+                select count(*) from results.feature_importances group by model_id
+            ''')
+        )
+        assert len(feature_counts) == 2
+
+
+def test_multicore_memory_budget():
+    with testing.postgresql.Postgresql() as postgresql:
+        db_engine = create_engine(postgresql.url())
+        ensure_db(db_engine)
+        populate_source_data(db_engine)
+        with TemporaryDirectory() as temp_dir:
+            experiment = MultiCoreExperiment(
+                config=sample_config(),
+                db_engine=db_engine,
+                model_storage_class=FSModelStorageEngine,
+                project_path=os.path.join(temp_dir, 'inspections'),
+                n_processes=2,
+                n_db_processes=2,
+                memory_budget=10 * 1024,
+            )
+            with mock.patch.object(
+                TaskGraph,
+                'run',
+                autospec=True,
+                side_effect=TaskGraph.run
+            ) as run_mock:
+                experiment.run()
+            assert run_mock.call_args[1]['memory_budget'] == {'cpu': 10 * 1024}
+            task_graph = run_mock.call_args[0][0]
+            for key, task in task_graph.tasks.items():
+                if task.task_type in ('matrix', 'train'):
+                    assert task.memory > 0
+        assert num_linked_evaluations(db_engine) > 0
+
+
+def test_estimate_costs():
+    with testing.postgresql.Postgresql() as postgresql:
+        db_engine = create_engine(postgresql.url())
+        ensure_db(db_engine)
+        populate_source_data(db_engine)
+        with TemporaryDirectory() as temp_dir:
+            experiment = SingleThreadedExperiment(
+                config=sample_config(),
+                db_engine=db_engine,
+                model_storage_class=FSModelStorageEngine,
+                project_path=os.path.join(temp_dir, 'inspections'),
+            )
+            estimate = experiment.estimate_costs()
+
+            # nothing was built
+            assert not db_engine.has_table(experiment.labels_table_name)
+            assert not db_engine.has_table(
+                experiment.state_table_generator.sparse_table_name
+            )
+            assert not os.listdir(experiment.matrices_directory)
+
+            assert sum(estimate['feature_inserts'].values()) > 0
+            assert estimate['sparse_state_rows'] > 0
+            assert estimate['label_rows'] > 0
+            assert estimate['total_matrix_bytes'] > 0
+            assert all(matrix['columns'] > 3 for matrix in estimate['matrices'].values())
+            experiment.print_cost_estimate()
+
+            experiment.run()
+            assert len(estimate['matrices']) == len(experiment.matrix_build_tasks)
+            ((num_models,),) = db_engine.execute('select count(*) from results.models')
+            assert estimate['total_models'] == num_models
+
+
+@parametrize_experiment_classes
+def test_task_telemetry(experiment_class):
+    with testing.postgresql.Postgresql() as postgresql:
+        db_engine = create_engine(postgresql.url())
+        ensure_db(db_engine)
+        populate_source_data(db_engine)
+        with TemporaryDirectory() as temp_dir:
+            experiment = experiment_class(
+                config=sample_config(),
+                db_engine=db_engine,
+                model_storage_class=FSModelStorageEngine,
+                project_path=os.path.join(temp_dir, 'inspections'),
+            )
+            with mock.patch('triage.experiments.telemetry.logging') as logging_mock:
+                experiment.run()
+            assert any(
+                call[0][0].startswith('Slowest')
+                for call in logging_mock.info.call_args_list
+            )
+
+        telemetry = list(db_engine.execute('''
+            select task_type, wall_time, cpu_time, peak_rss, rows, bytes_written
+            from results.task_telemetry where experiment_hash = %s
+        ''', experiment.experiment_hash))
+        task_types = set(row['task_type'] for row in telemetry)
+        assert {'sparse_states', 'labels', 'imputation', 'matrix', 'train', 'test'} <= task_types
+        assert all(row['wall_time'] >= 0 and row['peak_rss'] > 0 for row in telemetry)
+        for row in telemetry:
+            if row['task_type'] in ('sparse_states', 'labels', 'imputation'):
+                assert row['rows'] > 0
+            if row['task_type'] == 'matrix':
+                assert row['bytes_written'] > 0
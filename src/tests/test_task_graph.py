@@ -0,0 +1,167 @@
+import threading
+import time
+from functools import partial
+from multiprocessing.pool import ThreadPool
+from unittest import mock
+
+import pytest
+
+from triage.experiments.task_graph import TaskGraph
+
+
+def record(name, log, delay=0):
+    time.sleep(delay)
+    log.append(name)
+    return True
+
+
+def test_dependencies_run_first():
+    log = []
+    task_graph = TaskGraph()
+    task_graph.add_task('c', record, args=('c', log), dependencies=['a', 'b'], pool='db')
+    task_graph.add_task('a', record, args=('a', log, 0.05), pool='db')
+    task_graph.add_task('b', record, args=('b', log), dependencies=['a'], pool='cpu')
+    with ThreadPool(2) as pool, ThreadPool(2) as db_pool:
+        task_graph.run({'cpu': pool, 'db': db_pool})
+    assert log == ['a', 'b', 'c']
+
+
+def test_independent_tasks_overlap():
+    log = []
+    task_graph = TaskGraph()
+    task_graph.add_task('slow', record, args=('slow', log, 0.2), pool='db')
+    task_graph.add_task('fast', record, args=('fast', log), pool='db')
+    task_graph.add_task('after_fast', record, args=('after_fast', log), dependencies=['fast'],
+                        pool='db')
+    with ThreadPool(2) as pool:
+        task_graph.run({'db': pool})
+    assert log == ['fast', 'after_fast', 'slow']
+
+
+def test_parent_tasks_and_callbacks_add_tasks():
+    log = []
+    task_graph = TaskGraph()
+
+    def plan():
+        task_graph.add_task(
+            'planned',
+            record,
+            args=('planned', log),
+            pool='cpu',
+            callback=lambda result: task_graph.add_task(
+                'from_callback',
+                record,
+                args=('from_callback', log),
+                pool='cpu'
+            )
+        )
+
+    task_graph.add_task('plan', plan)
+    task_graph.add_task('final', partial(record, 'final', log), dependencies=['planned'])
+    with ThreadPool(1) as pool:
+        task_graph.run({'cpu': pool})
+    assert log[0] == 'planned'
+    assert sorted(log) == ['final', 'from_callback', 'planned']
+
+
+def test_exception_stops_graph():
+    def boom():
+        raise RuntimeError('boom!')
+
+    log = []
+    task_graph = TaskGraph()
+    task_graph.add_task('boom', boom, pool='cpu')
+    task_graph.add_task('after', record, args=('after', log), dependencies=['boom'], pool='cpu')
+    with ThreadPool(1) as pool:
+        with pytest.raises(RuntimeError):
+            task_graph.run({'cpu': pool})
+    assert log == []
+
+
+def test_failed_tasks_release_dependents():
+    log = []
+    task_graph = TaskGraph()
+    task_graph.add_task('fails', lambda: False, pool='cpu')
+    task_graph.add_task('after', record, args=('after', log), dependencies=['fails'], pool='cpu')
+    with ThreadPool(1) as pool:
+        task_graph.run({'cpu': pool})
+    assert log == ['after']
+    assert task_graph.failed == {'fails'}
+
+
+def test_missing_dependency():
+    task_graph = TaskGraph()
+    task_graph.add_task('orphan', dependencies=['never_added'])
+    with pytest.raises(ValueError):
+        task_graph.run({})
+
+
+def test_duplicate_key():
+    task_graph = TaskGraph()
+    task_graph.add_task('a')
+    with pytest.raises(ValueError):
+        task_graph.add_task('a')
+
+
+def test_max_in_flight():
+    lock = threading.Lock()
+    running = []
+    max_running = []
+
+    def track():
+        with lock:
+            running.append(1)
+            max_running.append(len(running))
+        time.sleep(0.01)
+        with lock:
+            running.pop()
+        return True
+
+    task_graph = TaskGraph()
+    for i in range(10):
+        task_graph.add_task(i, track, pool='db')
+    with ThreadPool(4) as pool:
+        task_graph.run({'db': pool}, max_in_flight={'db': 2})
+    assert len(task_graph.finished) == 10
+    assert max(max_running) <= 2
+
+
+def test_memory_budget():
+    lock = threading.Lock()
+    running = []
+    max_memory_running = []
+
+    def track(memory):
+        with lock:
+            running.append(memory)
+            max_memory_running.append(sum(running))
+        time.sleep(0.01)
+        with lock:
+            running.remove(memory)
+        return True
+
+    task_graph = TaskGraph()
+    # small tasks run several at once, and large ones alone, even when
+    # one is over the budget by itself
+    for i, memory in enumerate([10, 10, 10, 60, 60, 120, 10, 10]):
+        task_graph.add_task(i, track, args=(memory,), pool='cpu', memory=memory)
+    with ThreadPool(4) as pool:
+        task_graph.run({'cpu': pool}, memory_budget={'cpu': 100})
+    assert len(task_graph.finished) == 8
+    assert max(max_memory_running) == 120
+    assert max(
+        memory_running for memory_running in max_memory_running
+        if memory_running != 120
+    ) <= 100
+    assert 30 in max_memory_running or 20 in max_memory_running
+
+
+def test_progress_logged():
+    task_graph = TaskGraph(progress_interval=0)
+    task_graph.add_task('a', record, args=('a', []), pool='db')
+    with ThreadPool(1) as pool:
+        with mock.patch('triage.experiments.task_graph.logging') as logging_mock:
+            task_graph.run({'db': pool})
+    assert mock.call(
+        'Progress: %s of %s tasks done, %s running, %s waiting to run', 1, 1, 0, 0
+    ) in logging_mock.info.call_args_list
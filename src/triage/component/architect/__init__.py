@@ -1,8 +1,14 @@
 """Main application"""
-from .planner import Planner
-from . import builders
+from triage.util.lazy import lazy_attributes
 
 __all__ = (
     'Planner',
     'builders',
 )
+
+# imported when first used, so the lightweight modules of this package
+# can be imported without pandas
+lazy_attributes(__name__, {
+    'Planner': ('.planner', 'Planner'),
+    'builders': ('.builders', None),
+})
@@ -1,17 +1,44 @@
+import hashlib
 import io
+import itertools
+import json
 import logging
+import numpy
 import pandas
 import os
+import shutil
+
+from psycopg2 import DataError, errorcodes
 
 from triage.component import metta
+from triage.component.architect.utils import explain_row_estimate
 
 
 class BuilderBase(object):
-    def __init__(self, db_config, matrix_directory, engine, replace=True):
+    # a rough number of bytes of memory that each value of a matrix takes
+    # up while the matrix is being built, for estimating the memory a
+    # build will need
+    bytes_per_value_in_memory = 8
+
+    def __init__(
+        self,
+        db_config,
+        matrix_directory,
+        engine,
+        replace=True,
+        matrix_format='csv',
+        compact_dtypes=False,
+        share_entity_date_tables=False
+    ):
         self.db_config = db_config
         self.matrix_directory = matrix_directory
         self.engine = engine
         self.replace = replace
+        self.matrix_format = matrix_format
+        self.compact_dtypes = compact_dtypes
+        # only safe when the caller drops any table left by an earlier run
+        # before the first matrix uses it, as experiments do
+        self.share_entity_date_tables = share_entity_date_tables
 
     def validate(self):
         for expected_db_config_val in [
@@ -73,6 +100,181 @@ class BuilderBase(object):
         )
         return(query)
 
+    def _entity_dates_query(
+        self,
+        as_of_times,
+        label_name,
+        label_type,
+        state,
+        matrix_type,
+        label_timespan
+    ):
+        """ The query for the entity_ids and as_of_dates in a matrix: those
+        with labels for train matrices, and all those in the state for test
+        matrices. Arguments are those of make_entity_date_table.
+
+        :return: postgresql query
+        :rtype: str
+        """
+        as_of_time_strings = [str(as_of_time) for as_of_time in as_of_times]
+        if matrix_type == 'train':
+            indices_query = self._all_labeled_entity_dates_query(
+                as_of_time_strings=as_of_time_strings,
+                state=state,
+                label_name=label_name,
+                label_type=label_type,
+                label_timespan=label_timespan
+            )
+        elif matrix_type == 'test':
+            indices_query = self._all_valid_entity_dates_query(
+                as_of_time_strings=as_of_time_strings,
+                state=state
+            )
+        else:
+            raise ValueError('Unknown matrix type passed: {}'.format(matrix_type))
+        return indices_query
+
+    def estimate_entity_dates(
+        self,
+        as_of_times,
+        label_name,
+        label_type,
+        state,
+        matrix_type,
+        label_timespan
+    ):
+        """ Estimate the rows a matrix will have from the Postgres planner,
+        without building it or running its query. Arguments are those of
+        make_entity_date_table.
+
+        :return: estimated number of entity_id and as_of_date pairs in the matrix
+        :rtype: int
+        """
+        return explain_row_estimate(
+            self.engine,
+            self._entity_dates_query(
+                as_of_times,
+                label_name,
+                label_type,
+                state,
+                matrix_type,
+                label_timespan
+            )
+        )
+
+    def estimate_memory(
+        self,
+        as_of_times,
+        label_name,
+        label_type,
+        feature_dictionary,
+        matrix_metadata,
+        matrix_type,
+        **kwargs
+    ):
+        """ Estimate the peak memory used to build a matrix, from its number
+        of rows and columns. Arguments are those of build_matrix.
+
+        :return: estimated bytes of memory
+        :rtype: int
+        """
+        if kwargs.get('source_matrix_uuid'):
+            # views of other matrices aren't built
+            return 0
+        rows = self.estimate_entity_dates(
+            as_of_times,
+            label_name,
+            label_type,
+            matrix_metadata['state'],
+            matrix_type,
+            matrix_metadata['label_timespan']
+        )
+        # entity_id and as_of_date, the features, and the label
+        columns = 2 + sum(len(features) for features in feature_dictionary.values()) + 1
+        return self.rows_in_memory(rows) * columns * self.bytes_per_value_in_memory
+
+    def build_matrix_view(self, matrix_metadata, matrix_uuid, source_matrix_uuid):
+        """ Store a matrix as a view of some of the columns of another matrix
+        with the same rows, which is built instead.
+
+        :param matrix_metadata: a dictionary of metadata about the matrix
+        :param matrix_uuid: a unique id for the matrix
+        :param source_matrix_uuid: the unique id of the other matrix
+        :type matrix_metadata: dict
+        :type matrix_uuid: str
+        :type source_matrix_uuid: str
+
+        :return: none
+        :rtype: none
+        """
+        metadata_filename = os.path.join(self.matrix_directory, '{}.yaml'.format(matrix_uuid))
+        if not self.replace and os.path.exists(metadata_filename):
+            logging.info('Skipping %s because matrix view already exists', metadata_filename)
+            return
+        logging.info('Storing matrix %s as a view of matrix %s', matrix_uuid, source_matrix_uuid)
+        metta.archive_matrix_view(
+            matrix_config=matrix_metadata,
+            source_uuid=source_matrix_uuid,
+            directory=self.matrix_directory
+        )
+
+    def clean_up(self):
+        """ Remove anything kept between building matrices, once all of
+        an experiment's matrices are built. Nothing by default.
+        """
+        pass
+
+    def rows_in_memory(self, rows):
+        """ The most rows of a matrix held in memory at once while building it
+
+        :param rows: the number of rows in the matrix
+        :type rows: int
+
+        :rtype: int
+        """
+        return rows
+
+    def entity_date_table_name(
+        self,
+        as_of_times,
+        label_name,
+        label_type,
+        state,
+        matrix_type,
+        label_timespan
+    ):
+        """ The name of the table of a matrix's entity_ids and as_of_dates,
+        shared by every matrix with the same rows (such as those differing
+        only in their feature groups). Arguments are those of
+        make_entity_date_table.
+
+        :return: table name
+        :rtype: str
+        """
+        indices_query = self._entity_dates_query(
+            as_of_times,
+            label_name,
+            label_type,
+            state,
+            matrix_type,
+            label_timespan
+        )
+        return 'entity_dates_{}'.format(
+            hashlib.md5(indices_query.encode('utf-8')).hexdigest()
+        )
+
+    def drop_entity_date_table(self, table_name):
+        """ Drop an entity date table once no more matrices need it
+
+        :param table_name: the name of the table
+        :type table_name: str
+        """
+        logging.info('Dropping entity-date table %s', table_name)
+        self.engine.execute('DROP TABLE IF EXISTS {}."{}"'.format(
+            self.db_config['features_schema_name'],
+            table_name
+        ))
+
     def make_entity_date_table(
         self,
         as_of_times,
@@ -84,7 +286,9 @@ class BuilderBase(object):
         label_timespan
     ):
         """ Make a table containing the entity_ids and as_of_dates required for
-        the current matrix.
+        the current matrix. When sharing entity-date tables, one that a matrix
+        with the same rows already made is used instead; otherwise any existing
+        table of the same name is replaced.
 
         :param as_of_times: the times to be used for the current matrix
         :param label_name: name of the label to be used
@@ -105,36 +309,46 @@ class BuilderBase(object):
         :rtype: str
         """
 
-        as_of_time_strings = [str(as_of_time) for as_of_time in as_of_times]
-        if matrix_type == 'train':
-            indices_query = self._all_labeled_entity_dates_query(
-                as_of_time_strings=as_of_time_strings,
-                state=state,
-                label_name=label_name,
-                label_type=label_type,
-                label_timespan=label_timespan
-            )
-        elif matrix_type == 'test':
-            indices_query = self._all_valid_entity_dates_query(
-                as_of_time_strings=as_of_time_strings,
-                state=state
-            )
-        else:
-            raise ValueError('Unknown matrix type passed: {}'.format(matrix_type))
+        indices_query = self._entity_dates_query(
+            as_of_times,
+            label_name,
+            label_type,
+            state,
+            matrix_type,
+            label_timespan
+        )
 
-        table_name = '_'.join([matrix_uuid, 'matrix_entity_date'])
+        table_name = self.entity_date_table_name(
+            as_of_times,
+            label_name,
+            label_type,
+            state,
+            matrix_type,
+            label_timespan
+        )
         query = """
-            DROP TABLE IF EXISTS {features_schema_name}."{table_name}";
-            CREATE TABLE {features_schema_name}."{table_name}"
+            CREATE TABLE {if_not_exists}{features_schema_name}."{table_name}"
             AS ({index_query})
         """.format(
+            if_not_exists='IF NOT EXISTS ' if self.share_entity_date_tables else '',
             features_schema_name=self.db_config['features_schema_name'],
             table_name=table_name,
             index_query=indices_query
         )
-        logging.info('Creating matrix-specific entity-date table for matrix '
+        logging.info('Finding or creating entity-date table for matrix '
                      '%s with query %s', matrix_uuid, query)
-        self.engine.execute(query)
+        with self.engine.begin() as conn:
+            # matrices sharing the table may be built at once in other
+            # processes, which wait here for the first to create it
+            conn.execute('SELECT pg_advisory_xact_lock(hashtext(%(table)s))', table=table_name)
+            if not self.share_entity_date_tables:
+                # the table's name only depends on the query, so one left
+                # by an earlier run may hold rows from since-changed tables
+                conn.execute('DROP TABLE IF EXISTS {}."{}"'.format(
+                    self.db_config['features_schema_name'],
+                    table_name
+                ))
+            conn.execute(query)
 
         return table_name
 
@@ -195,7 +409,8 @@ class CSVBuilder(BuilderBase):
         matrix_directory,
         matrix_metadata,
         matrix_uuid,
-        matrix_type
+        matrix_type,
+        source_matrix_uuid=None
     ):
         """ Write a design matrix to disk with the specified paramters.
 
@@ -208,6 +423,9 @@ class CSVBuilder(BuilderBase):
         :param matrix_metadata: a dictionary of metadata about the matrix
         :param matrix_uuid: a unique id for the matrix
         :param matrix_type: the type (train/test) of matrix
+        :param source_matrix_uuid: the unique id of a matrix with the same
+                                   rows and all of this matrix's columns, to
+                                   store this matrix as a view of
         :type as_of_times: list
         :type label_name: str
         :type label_type: str
@@ -216,20 +434,65 @@ class CSVBuilder(BuilderBase):
         :type matrix_metadata: dict
         :type matrix_uuid: str
         :type matrix_type: str
+        :type source_matrix_uuid: str
 
         :return: none
         :rtype: none
         """
+        if source_matrix_uuid:
+            self.build_matrix_view(matrix_metadata, matrix_uuid, source_matrix_uuid)
+            return
+
         matrix_filename = os.path.join(
             matrix_directory,
-            '{}.csv'.format(matrix_uuid)
+            '{}.{}'.format(matrix_uuid, metta.MATRIX_SUFFIXES[self.matrix_format])
         )
         if not self.replace and os.path.exists(matrix_filename):
             logging.info('Skipping %s because matrix already exists', matrix_filename)
             return
 
         logging.info('Creating matrix %s > %s', matrix_metadata['matrix_id'], matrix_filename)
-        # make the entity time table and query the labels and features tables
+        output = self.make_matrix_output(
+            as_of_times,
+            label_name,
+            label_type,
+            feature_dictionary,
+            matrix_metadata,
+            matrix_uuid,
+            matrix_type
+        )
+        try:
+            # store the matrix
+            logging.info('Archiving matrix %s with metta', matrix_uuid)
+            metta.archive_matrix(
+                matrix_config=matrix_metadata,
+                df_matrix=output,
+                overwrite=True,
+                directory=self.matrix_directory,
+                format=self.matrix_format,
+                compact_dtypes=self.compact_dtypes
+            )
+        finally:
+            # a CSV written straight to the matrix's file is the matrix
+            if isinstance(output, str) and output != self.csv_matrix_path(matrix_uuid):
+                os.remove(output)
+
+    def make_matrix_output(
+        self,
+        as_of_times,
+        label_name,
+        label_type,
+        feature_dictionary,
+        matrix_metadata,
+        matrix_uuid,
+        matrix_type
+    ):
+        """ Make the entity date table of a matrix, and query its labels and
+        features. Arguments are those of build_matrix.
+
+        :return: the matrix, or the path of a CSV of it
+        :rtype: pandas.DataFrame or str
+        """
         logging.info('Making entity date table for matrix %s', matrix_uuid)
         entity_date_table_name = self.make_entity_date_table(
             as_of_times,
@@ -240,6 +503,59 @@ class CSVBuilder(BuilderBase):
             matrix_uuid,
             matrix_metadata['label_timespan']
         )
+        return self.extract_matrix(
+            as_of_times,
+            label_name,
+            label_type,
+            feature_dictionary,
+            entity_date_table_name,
+            matrix_uuid,
+            matrix_metadata['label_timespan']
+        )
+
+    def csv_matrix_path(self, matrix_uuid):
+        """ The path a matrix is archived to in CSV format
+
+        :param matrix_uuid: a unique id for the matrix
+        :type matrix_uuid: str
+
+        :return: path of the matrix's CSV
+        :rtype: str
+        """
+        return os.path.join(self.matrix_directory, '{}.csv'.format(matrix_uuid))
+
+    def extract_matrix(
+        self,
+        as_of_times,
+        label_name,
+        label_type,
+        feature_dictionary,
+        entity_date_table_name,
+        matrix_uuid,
+        label_timespan
+    ):
+        """ Query the features and labels of a matrix's entities and dates
+        and join them into one matrix, with the label in the last column.
+
+        :param as_of_times: the times to be included in the matrix
+        :param label_name: name of the label to be used
+        :param label_type: the type of label to be used
+        :param feature_dictionary: a dictionary of feature tables and features
+                                   to be included in the matrix
+        :param entity_date_table_name: the name of the entity date table
+        :param matrix_uuid: a unique id for the matrix
+        :param label_timespan: the time timespan that labels in matrix will include
+        :type as_of_times: list
+        :type label_name: str
+        :type label_type: str
+        :type feature_dictionary: dict
+        :type entity_date_table_name: str
+        :type matrix_uuid: str
+        :type label_timespan: str
+
+        :return: the matrix, or the path of a CSV of it
+        :rtype: pandas.DataFrame or str
+        """
         logging.info('Extracting feature group data from database into file '
                      'for matrix %s', matrix_uuid)
         features_csv_names = self.write_features_data(
@@ -256,34 +572,21 @@ class CSVBuilder(BuilderBase):
                 label_type,
                 entity_date_table_name,
                 matrix_uuid,
-                matrix_metadata['label_timespan']
+                label_timespan
             )
             features_csv_names.insert(0, labels_csv_name)
 
             # stitch together the csvs
             logging.info('Merging feature files for matrix %s', matrix_uuid)
-            output = self.merge_feature_csvs(
+            return self.merge_feature_csvs(
                 features_csv_names,
-                matrix_directory,
+                self.matrix_directory,
                 matrix_uuid
             )
         finally:
             # clean up files and database before finishing
             for csv_name in features_csv_names:
                 self.remove_file(csv_name)
-        try:
-            # store the matrix
-            logging.info('Archiving matrix %s with metta', matrix_uuid)
-            metta.archive_matrix(
-                matrix_config=matrix_metadata,
-                df_matrix=output,
-                overwrite=True,
-                directory=self.matrix_directory,
-                format='csv'
-            )
-        finally:
-            if isinstance(output, str):
-                os.remove(output)
 
     def write_labels_data(
         self,
@@ -420,6 +723,10 @@ class CSVBuilder(BuilderBase):
 
 
 class HighMemoryCSVBuilder(CSVBuilder):
+    # each value is held as CSV text, then in a DataFrame for its feature
+    # table, and again in the joined DataFrame
+    bytes_per_value_in_memory = 32
+
     def __init__(self, *args, **kwargs):
         super(HighMemoryCSVBuilder, self).__init__(*args, **kwargs)
         self.filehandles = {}
@@ -489,3 +796,738 @@ class HighMemoryCSVBuilder(CSVBuilder):
 
         big_df = dataframes[1].join(dataframes[2:] + [dataframes[0]])
         return big_df
+
+
+class StreamingCSVBuilder(CSVBuilder):
+    """ Builds a matrix in bounded memory by copying each feature table and
+    the labels to CSV files on disk, all sorted by entity id and as of date,
+    and merging them a chunk of rows at a time into the matrix's CSV.
+
+    In CSV format the matrix is never held in memory; in other formats it
+    is read once to be converted.
+    """
+    # the number of rows of each CSV read at once
+    chunk_size = 100000
+
+    # each value is held as a parsed chunk of its file, and again in the
+    # joined chunk
+    bytes_per_value_in_memory = 16
+
+    def __init__(self, *args, **kwargs):
+        super(StreamingCSVBuilder, self).__init__(*args, **kwargs)
+        self.filehandles = {}
+
+    def rows_in_memory(self, rows):
+        return min(rows, self.chunk_size)
+
+    def open_fh_for_writing(self, filename):
+        self.filehandles[filename] = open(filename, 'w')
+        return self.filehandles[filename]
+
+    def open_fh_for_reading(self, filename):
+        self.filehandles[filename] = open(filename, 'r')
+        return self.filehandles[filename]
+
+    def close_filehandle(self, filename):
+        self.filehandles.pop(filename).close()
+
+    def remove_file(self, filename):
+        if filename in self.filehandles:
+            self.close_filehandle(filename)
+        if os.path.exists(filename):
+            os.remove(filename)
+
+    def merge_feature_csvs(self, source_filenames, matrix_directory, matrix_uuid):
+        """Horizontally merge a list of feature CSVs a chunk of rows at a
+        time, with the same assumptions as HighMemoryCSVBuilder
+
+        :param source_filenames: the filenames of each feature csv, the
+                                 labels first
+        :param matrix_directory: unused, the matrix is written to the
+                                 builder's matrix directory
+        :param matrix_uuid: a unique id for the matrix
+        :type source_filenames: list
+        :type matrix_directory: str
+        :type matrix_uuid: str
+
+        :return: the path of the merged csv
+        :rtype: str
+
+        :raises: ValueError if the entity ids and as of dates of the CSVs
+                 don't match, or any features are null
+        """
+        if self.matrix_format == 'csv':
+            out_filename = self.csv_matrix_path(matrix_uuid)
+        else:
+            out_filename = os.path.join(
+                self.matrix_directory,
+                '{}-merged.csv'.format(matrix_uuid)
+            )
+        chunk_readers = [
+            pandas.read_csv(self.open_fh_for_reading(filename), chunksize=self.chunk_size)
+            for filename in source_filenames
+        ]
+        try:
+            with open(out_filename, 'w') as out_file:
+                for chunk_number, chunks in enumerate(
+                    itertools.zip_longest(*chunk_readers)
+                ):
+                    self._merge_chunk(chunks).to_csv(
+                        out_file,
+                        index=False,
+                        header=(chunk_number == 0)
+                    )
+        except Exception:
+            # don't leave a partial matrix to be mistaken for a built one
+            os.remove(out_filename)
+            raise
+        return out_filename
+
+    def _merge_chunk(self, chunks):
+        """ Join the same rows of each CSV, the labels first
+
+        :param chunks: DataFrames of the rows, or None for a CSV that has
+                       run out of rows
+        :type chunks: tuple
+
+        :return: the rows' entity ids, as of dates, features, and label
+        :rtype: pandas.DataFrame
+        """
+        labels = chunks[0]
+        if any(chunk is None or len(chunk) != len(labels) for chunk in chunks):
+            raise ValueError('Feature and label CSVs have different numbers of rows')
+        keys = labels[['entity_id', 'as_of_date']]
+        features = []
+        for chunk in chunks[1:]:
+            if not (chunk[['entity_id', 'as_of_date']].values == keys.values).all():
+                raise ValueError('Feature and label CSVs are not in the same order')
+            chunk = chunk.drop(['entity_id', 'as_of_date'], axis=1)
+            columns_with_nulls = [
+                column
+                for column in chunk.columns
+                if chunk[column].isnull().values.any()
+            ]
+            if len(columns_with_nulls) > 0:
+                raise ValueError(
+                    "Imputation failed for the following features: %s" %
+                    columns_with_nulls
+                )
+            features.append(chunk)
+        return pandas.concat(
+            [keys] + features + [labels.drop(['entity_id', 'as_of_date'], axis=1)],
+            axis=1
+        )
+
+
+class JoinedCSVBuilder(CSVBuilder):
+    """ Extracts a matrix with one query joining the entity date table to
+    every feature table and the labels, copied out of the database as a
+    single CSV, instead of copying out each table to be joined in pandas.
+
+    In CSV format the copy is written straight to the matrix's file, so
+    the matrix is never held in memory; in other formats it is read once
+    to be converted.
+    """
+    def _joined_query(
+        self,
+        label_name,
+        label_type,
+        feature_dictionary,
+        entity_date_table_name,
+        label_timespan,
+        null_check=True,
+        as_floats=False,
+        entity_dates_query=None
+    ):
+        """ The query for a whole matrix: the entity ids and as of dates,
+        then the features of each table, then the label.
+
+        :param null_check: make the query fail with a division by zero error
+                           when it finds a null feature, which should have
+                           been imputed
+        :param as_floats: select the entity ids as bigints, the as of dates
+                          as timestamps, and the features and label as
+                          double precision with NaN for a null label, so
+                          every row of a binary copy is the same width
+        :param entity_dates_query: a query for the entity ids and as of
+                                   dates, to select from instead of the
+                                   entity date table
+        :type null_check: bool
+        :type as_floats: bool
+        :type entity_dates_query: str
+
+        Other arguments are those of extract_matrix.
+
+        :return: postgresql query
+        :rtype: str
+        """
+        selections = []
+        joins = []
+        for table_number, (feature_table_name, feature_names) in enumerate(
+            feature_dictionary.items()
+        ):
+            alias = 'f{}'.format(table_number)
+            for feature_name in feature_names:
+                column = '{}."{}"'.format(alias, feature_name)
+                if null_check:
+                    # the division is only evaluated for a null feature
+                    column = 'COALESCE({0}, 1 / ({0} IS NOT NULL)::int)'.format(column)
+                if as_floats:
+                    column = '({})::float8'.format(column)
+                selections.append(', {} AS "{}"'.format(column, feature_name))
+            joins.append("""
+                LEFT OUTER JOIN {schema}.{table} {alias}
+                ON ed.entity_id = {alias}.entity_id AND
+                   ed.as_of_date = {alias}.as_of_date
+            """.format(
+                schema=self.db_config['features_schema_name'],
+                table=feature_table_name,
+                alias=alias
+            ))
+        if as_floats:
+            index_columns = (
+                'ed.entity_id::int8 AS entity_id, '
+                'ed.as_of_date::timestamp AS as_of_date'
+            )
+            label_column = "COALESCE(l.label::float8, 'NaN')"
+        else:
+            index_columns = 'ed.entity_id, ed.as_of_date'
+            label_column = 'l.label'
+        if entity_dates_query:
+            entity_dates = '({})'.format(entity_dates_query)
+        else:
+            entity_dates = '{}."{}"'.format(
+                self.db_config['features_schema_name'],
+                entity_date_table_name
+            )
+        return """
+            SELECT {index_columns}{features},
+                   {label_column} AS {label_name}
+            FROM {entity_dates} ed
+            {joins}
+            LEFT OUTER JOIN {labels_schema}.{labels_table} l
+            ON ed.entity_id = l.entity_id AND
+               ed.as_of_date = l.as_of_date AND
+               l.label_name = '{label_name}' AND
+               l.label_type = '{label_type}' AND
+               l.label_timespan = '{label_timespan}'
+            ORDER BY ed.entity_id,
+                     ed.as_of_date
+        """.format(
+            index_columns=index_columns,
+            features=''.join(selections),
+            label_column=label_column,
+            label_name=label_name,
+            label_type=label_type,
+            label_timespan=label_timespan,
+            entity_dates=entity_dates,
+            joins=''.join(joins),
+            labels_schema=self.db_config['labels_schema_name'],
+            labels_table=self.db_config['labels_table_name'],
+        )
+
+    def _null_features(
+        self,
+        feature_dictionary,
+        entity_date_table_name,
+        entity_dates_query=None
+    ):
+        """ The features that are null for any of a matrix's entities and
+        dates, found when the joined query fails its null check.
+
+        :return: names of the null features
+        :rtype: list
+        """
+        query = self._joined_query(
+            label_name='label',
+            label_type='',
+            feature_dictionary=feature_dictionary,
+            entity_date_table_name=entity_date_table_name,
+            label_timespan='0 days',
+            null_check=False,
+            entity_dates_query=entity_dates_query
+        )
+        feature_names = [
+            feature_name
+            for feature_names in feature_dictionary.values()
+            for feature_name in feature_names
+        ]
+        (row,) = self.engine.execute('SELECT {} FROM ({}) matrix'.format(
+            ', '.join('bool_or("{}" IS NULL)'.format(name) for name in feature_names),
+            query
+        ))
+        return [name for name, is_null in zip(feature_names, row) if is_null]
+
+    def extract_matrix(
+        self,
+        as_of_times,
+        label_name,
+        label_type,
+        feature_dictionary,
+        entity_date_table_name,
+        matrix_uuid,
+        label_timespan
+    ):
+        """ Copy the joined features and labels of a matrix's entities and
+        dates into a CSV. Arguments are those of CSVBuilder.extract_matrix.
+
+        :return: the path of the CSV
+        :rtype: str
+
+        :raises: ValueError if any features are null
+        """
+        if self.matrix_format == 'csv':
+            csv_name = self.csv_matrix_path(matrix_uuid)
+        else:
+            csv_name = os.path.join(self.matrix_directory, '{}-joined.csv'.format(matrix_uuid))
+        query = self._joined_query(
+            label_name,
+            label_type,
+            feature_dictionary,
+            entity_date_table_name,
+            label_timespan
+        )
+        logging.info('Copying joined features and labels for matrix %s to %s',
+                     matrix_uuid, csv_name)
+        try:
+            with open(csv_name, 'w') as matrix_csv:
+                self._copy_joined_query(
+                    query,
+                    'CSV HEADER',
+                    matrix_csv,
+                    feature_dictionary,
+                    entity_date_table_name
+                )
+        except Exception:
+            # don't leave a partial matrix to be mistaken for a built one
+            if os.path.exists(csv_name):
+                os.remove(csv_name)
+            raise
+        return csv_name
+
+    def _copy_joined_query(
+        self,
+        query,
+        copy_options,
+        output,
+        feature_dictionary,
+        entity_date_table_name,
+        entity_dates_query=None
+    ):
+        """ Copy the results of a joined query to a file.
+
+        :param query: a query made by _joined_query
+        :param copy_options: the COPY command's options, e.g. 'CSV HEADER'
+        :param output: a writable file, or object with a write method
+        :type query: str
+        :type copy_options: str
+
+        Other arguments are those of _joined_query.
+
+        :raises: ValueError if any features are null
+        """
+        logging.debug('Copying query %s', query)
+        try:
+            conn = self.engine.raw_connection()
+            try:
+                conn.cursor().copy_expert(
+                    'COPY ({}) TO STDOUT WITH {}'.format(query, copy_options),
+                    output
+                )
+            finally:
+                conn.close()
+        except DataError as error:
+            if error.pgcode != errorcodes.DIVISION_BY_ZERO:
+                raise
+            raise ValueError(
+                "Imputation failed for the following features: %s" %
+                self._null_features(
+                    feature_dictionary,
+                    entity_date_table_name,
+                    entity_dates_query
+                )
+            )
+
+
+class BinaryCopyDecoder(object):
+    """ Decodes the rows of a binary COPY of a query made by
+    JoinedCSVBuilder._joined_query with as_floats, as they are written to
+    it, into preallocated numpy arrays.
+
+    Every row has the same width (a bigint, a timestamp, and doubles, none
+    of them null), so each chunk of complete rows is decoded at once
+    through strided views of it.
+
+    Args:
+        num_rows (int) the number of rows the copy will have
+        num_values (int) the number of features and labels in each row
+    """
+    signature = b'PGCOPY\n\377\r\n\0'
+    # postgres timestamps are microseconds since this time
+    epoch = numpy.datetime64('2000-01-01T00:00:00', 'us')
+
+    def __init__(self, num_rows, num_values):
+        self.num_rows = num_rows
+        self.num_fields = 2 + num_values
+        # a field count, then each field's length and 8 bytes of data
+        self.row_width = 2 + 12 * self.num_fields
+        self.entity_ids = numpy.empty(num_rows, dtype='int64')
+        self.as_of_dates = numpy.empty(num_rows, dtype='int64')
+        self.values = numpy.empty((num_rows, num_values), dtype='float64')
+        self.rows_decoded = 0
+        self._buffer = bytearray()
+        self._header_read = False
+
+    def _read_header(self):
+        # the signature, a flags field, and the length of a header extension
+        if len(self._buffer) < 19:
+            return False
+        if bytes(self._buffer[:11]) != self.signature:
+            raise ValueError('Not a binary COPY')
+        extension_length = int.from_bytes(self._buffer[15:19], 'big')
+        if len(self._buffer) < 19 + extension_length:
+            return False
+        del self._buffer[:19 + extension_length]
+        return True
+
+    def _view(self, chunk, num_rows, dtype, offset, stride):
+        return numpy.ndarray(
+            shape=(num_rows, self.num_fields),
+            dtype=dtype,
+            buffer=chunk,
+            offset=offset,
+            strides=(self.row_width, stride)
+        )
+
+    def write(self, data):
+        self._buffer.extend(data)
+        if not self._header_read:
+            self._header_read = self._read_header()
+            if not self._header_read:
+                return
+        num_rows = len(self._buffer) // self.row_width
+        if num_rows == 0:
+            return
+        if self.rows_decoded + num_rows > self.num_rows:
+            raise ValueError('More rows copied than expected: {}'.format(self.num_rows))
+        chunk = bytes(self._buffer[:num_rows * self.row_width])
+        del self._buffer[:num_rows * self.row_width]
+
+        field_counts = numpy.ndarray(
+            shape=(num_rows,),
+            dtype='>i2',
+            buffer=chunk,
+            strides=(self.row_width,)
+        )
+        lengths = self._view(chunk, num_rows, '>i4', 2, 12)
+        if (field_counts != self.num_fields).any() or (lengths != 8).any():
+            raise ValueError('Unexpected row format in binary COPY')
+        start, stop = self.rows_decoded, self.rows_decoded + num_rows
+        self.entity_ids[start:stop] = self._view(chunk, num_rows, '>i8', 6, 12)[:, 0]
+        self.as_of_dates[start:stop] = self._view(chunk, num_rows, '>i8', 6, 12)[:, 1]
+        self.values[start:stop] = self._view(chunk, num_rows, '>f8', 6, 12)[:, 2:]
+        self.rows_decoded = stop
+
+    def finish(self):
+        """ Check that the whole copy was decoded.
+
+        :raises: ValueError if the copy is missing rows or its trailer
+        """
+        if self.rows_decoded != self.num_rows or bytes(self._buffer) != b'\xff\xff':
+            raise ValueError('Binary COPY ended after {} of {} rows'.format(
+                self.rows_decoded,
+                self.num_rows
+            ))
+
+    def index(self):
+        """ The entity ids and as of dates of the decoded rows
+
+        :rtype: pandas.MultiIndex
+        """
+        return pandas.MultiIndex.from_arrays(
+            [
+                self.entity_ids,
+                self.epoch + self.as_of_dates.astype('timedelta64[us]'),
+            ],
+            names=['entity_id', 'as_of_date']
+        )
+
+
+class BinaryCopyBuilder(JoinedCSVBuilder):
+    """ Extracts a matrix with the same single joined query as
+    JoinedCSVBuilder, but copied in Postgres's binary format and decoded
+    straight into numpy arrays, so no values are written or parsed as text.
+
+    The arrays are preallocated from the number of rows in the entity date
+    table and the columns in the feature dictionary.
+    """
+    # the decoded arrays, and a copy of them made while archiving
+    bytes_per_value_in_memory = 16
+
+    def extract_matrix(
+        self,
+        as_of_times,
+        label_name,
+        label_type,
+        feature_dictionary,
+        entity_date_table_name,
+        matrix_uuid,
+        label_timespan
+    ):
+        """ Copy the joined features and labels of a matrix's entities and
+        dates into a DataFrame. Arguments are those of
+        CSVBuilder.extract_matrix.
+
+        :return: the matrix, indexed by entity id and as of date
+        :rtype: pandas.DataFrame
+
+        :raises: ValueError if any features are null
+        """
+        ((num_rows,),) = self.engine.execute(
+            'SELECT count(*) FROM {}."{}"'.format(
+                self.db_config['features_schema_name'],
+                entity_date_table_name
+            )
+        )
+        feature_names = [
+            feature_name
+            for feature_names in feature_dictionary.values()
+            for feature_name in feature_names
+        ]
+        decoder = BinaryCopyDecoder(num_rows, len(feature_names) + 1)
+        query = self._joined_query(
+            label_name,
+            label_type,
+            feature_dictionary,
+            entity_date_table_name,
+            label_timespan,
+            as_floats=True
+        )
+        logging.info('Copying joined features and labels for matrix %s '
+                     'into arrays of %s rows', matrix_uuid, num_rows)
+        self._copy_joined_query(
+            query,
+            '(FORMAT binary)',
+            decoder,
+            feature_dictionary,
+            entity_date_table_name
+        )
+        decoder.finish()
+
+        matrix = pandas.DataFrame(
+            decoder.values,
+            index=decoder.index(),
+            columns=feature_names + [label_name],
+            copy=False
+        )
+        # train matrices only have labeled rows, so can keep integer labels
+        if not matrix[label_name].isnull().any():
+            matrix[label_name] = matrix[label_name].astype('int64')
+        return matrix
+
+
+class PartitionedCSVBuilder(JoinedCSVBuilder):
+    """ Builds matrices from a store of rows partitioned by as of date, so
+    the rows of each date are copied out of the database once however many
+    matrices include them. Consecutive train matrices with a long training
+    history share most of their dates, so the cost of extracting them grows
+    with the number of distinct dates instead of with the number of
+    matrices times their history.
+
+    Each partition is a CSV of one date's features and labels, copied with
+    the joined query by the first matrix that needs it into the
+    'partitions' subdirectory of the matrix directory, where it is kept
+    until clean_up is called. A matrix is the concatenation of its dates'
+    partitions, so its rows are ordered by as of date, then entity id.
+    """
+    @property
+    def partition_directory(self):
+        return os.path.join(self.matrix_directory, 'partitions')
+
+    def partition_path(
+        self,
+        as_of_time,
+        label_name,
+        label_type,
+        state,
+        matrix_type,
+        feature_dictionary,
+        label_timespan
+    ):
+        """ The path of the partition of one as of date's rows, shared by
+        every matrix with the same rows, features, and label on that date.
+        Arguments are those of make_entity_date_table, for one as of time,
+        and the matrix's feature dictionary.
+
+        :return: path of the partition's CSV
+        :rtype: str
+        """
+        key = json.dumps([
+            self._entity_dates_query(
+                [as_of_time],
+                label_name,
+                label_type,
+                state,
+                matrix_type,
+                label_timespan
+            ),
+            label_name,
+            label_type,
+            label_timespan,
+            self.db_config['features_schema_name'],
+            list(feature_dictionary.items()),
+        ])
+        return os.path.join(
+            self.partition_directory,
+            '{}.csv'.format(hashlib.md5(key.encode('utf-8')).hexdigest())
+        )
+
+    def extract_partition(
+        self,
+        as_of_time,
+        label_name,
+        label_type,
+        state,
+        matrix_type,
+        feature_dictionary,
+        label_timespan
+    ):
+        """ Copy one as of date's joined features and labels into a
+        partition, unless a matrix with the same rows on that date already
+        has. Arguments are those of partition_path.
+
+        :return: path of the partition's CSV
+        :rtype: str
+
+        :raises: ValueError if any features are null
+        """
+        path = self.partition_path(
+            as_of_time,
+            label_name,
+            label_type,
+            state,
+            matrix_type,
+            feature_dictionary,
+            label_timespan
+        )
+        conn = self.engine.connect()
+        try:
+            # matrices sharing the partition may be built at once in other
+            # processes, which wait here for the first to extract it
+            conn.execute('SELECT pg_advisory_lock(hashtext(%(path)s))', path=path)
+            try:
+                if os.path.exists(path):
+                    logging.info('Using partition %s for %s', path, as_of_time)
+                    return path
+                entity_dates_query = self._entity_dates_query(
+                    [as_of_time],
+                    label_name,
+                    label_type,
+                    state,
+                    matrix_type,
+                    label_timespan
+                )
+                query = self._joined_query(
+                    label_name,
+                    label_type,
+                    feature_dictionary,
+                    None,
+                    label_timespan,
+                    entity_dates_query=entity_dates_query
+                )
+                logging.info('Copying joined features and labels for %s to partition %s',
+                             as_of_time, path)
+                os.makedirs(self.partition_directory, exist_ok=True)
+                # written under another name, so a partial partition is
+                # never mistaken for a finished one
+                partial_path = '{}.partial'.format(path)
+                try:
+                    with open(partial_path, 'w') as partition_csv:
+                        self._copy_joined_query(
+                            query,
+                            'CSV HEADER',
+                            partition_csv,
+                            feature_dictionary,
+                            None,
+                            entity_dates_query
+                        )
+                    os.rename(partial_path, path)
+                except Exception:
+                    if os.path.exists(partial_path):
+                        os.remove(partial_path)
+                    raise
+                return path
+            finally:
+                conn.execute('SELECT pg_advisory_unlock(hashtext(%(path)s))', path=path)
+        finally:
+            conn.close()
+
+    def make_matrix_output(
+        self,
+        as_of_times,
+        label_name,
+        label_type,
+        feature_dictionary,
+        matrix_metadata,
+        matrix_uuid,
+        matrix_type
+    ):
+        """ Concatenate the partitions of a matrix's as of dates into a CSV,
+        extracting any that don't exist yet. Arguments are those of
+        build_matrix.
+
+        :return: the path of the CSV
+        :rtype: str
+
+        :raises: ValueError if any features are null
+        """
+        partition_paths = [
+            self.extract_partition(
+                as_of_time,
+                label_name,
+                label_type,
+                matrix_metadata['state'],
+                matrix_type,
+                feature_dictionary,
+                matrix_metadata['label_timespan']
+            )
+            for as_of_time in sorted(set(as_of_times))
+        ]
+        if self.matrix_format == 'csv':
+            csv_name = self.csv_matrix_path(matrix_uuid)
+        else:
+            csv_name = os.path.join(
+                self.matrix_directory,
+                '{}-partitioned.csv'.format(matrix_uuid)
+            )
+        logging.info('Concatenating %s partitions for matrix %s to %s',
+                     len(partition_paths), matrix_uuid, csv_name)
+        try:
+            with open(csv_name, 'w') as matrix_csv:
+                for partition_number, partition_path in enumerate(partition_paths):
+                    with open(partition_path) as partition_csv:
+                        header = partition_csv.readline()
+                        if partition_number == 0:
+                            matrix_csv.write(header)
+                        shutil.copyfileobj(partition_csv, matrix_csv)
+        except Exception:
+            if os.path.exists(csv_name):
+                os.remove(csv_name)
+            raise
+        return csv_name
+
+    def clean_up(self):
+        """ Remove the partitions """
+        if os.path.exists(self.partition_directory):
+            logging.info('Removing matrix partitions in %s', self.partition_directory)
+            shutil.rmtree(self.partition_directory)
+
+
+# the builders an experiment can be configured to use
+MATRIX_BUILDERS = {
+    'high_memory': HighMemoryCSVBuilder,
+    'streaming': StreamingCSVBuilder,
+    'joined': JoinedCSVBuilder,
+    'binary': BinaryCopyBuilder,
+    'partitioned': PartitionedCSVBuilder,
+}
@@ -20,14 +20,16 @@ class BinaryLabelGenerator(object):
         column_should_be_timelike(self.events_table, 'outcome_date', self.db_engine)
         column_should_be_booleanlike(self.events_table, 'outcome', self.db_engine)
 
-    def generate(
-        self,
-        start_date,
-        label_timespan,
-        labels_table,
-    ):
-        query = """insert into {labels_table} (
-            select
+    def label_query(self, start_date, label_timespan):
+        """A query to compute labels for one as of date and label timespan
+
+        Args:
+            start_date (string or datetime) the as of date
+            label_timespan (string) a Postgres interval
+
+        Returns: (string) a select query
+        """
+        return """select
                 {events_table}.entity_id,
                 '{start_date}'::date as as_of_date,
                 '{label_timespan}'::interval as label_timespan,
@@ -37,13 +39,24 @@ class BinaryLabelGenerator(object):
             from {events_table}
             where '{start_date}' <= outcome_date
             and outcome_date < '{start_date}'::timestamp + interval '{label_timespan}'
-            group by 1, 2, 3, 4, 5
-        )""".format(
+            group by 1, 2, 3, 4, 5""".format(
             events_table=self.events_table,
-            labels_table=labels_table,
             start_date=start_date,
             label_timespan=label_timespan,
         )
+
+    def generate(
+        self,
+        start_date,
+        label_timespan,
+        labels_table,
+    ):
+        query = """insert into {labels_table} (
+            {label_query}
+        )""".format(
+            labels_table=labels_table,
+            label_query=self.label_query(start_date, label_timespan),
+        )
         logging.debug('Running label generation query: %s', query)
         self.db_engine.execute(query)
         return labels_table
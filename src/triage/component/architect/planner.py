@@ -1,6 +1,7 @@
 import copy
 import itertools
 import logging
+from collections import OrderedDict
 
 from triage.component import metta
 
@@ -20,7 +21,11 @@ class Planner(object):
         user_metadata,
         engine,
         builder_class=builders.HighMemoryCSVBuilder,
-        replace=True
+        replace=True,
+        matrix_format='csv',
+        matrix_views=False,
+        compact_dtypes=False,
+        share_entity_date_tables=False
     ):
         self.feature_start_time = feature_start_time  # earliest time included in features
         self.label_names = label_names
@@ -31,11 +36,15 @@ class Planner(object):
         self.user_metadata = user_metadata
         self.engine = engine
         self.replace = replace
+        self.matrix_views = matrix_views
         self.builder = builder_class(
             db_config,
             matrix_directory,
             engine,
-            replace
+            replace,
+            matrix_format,
+            compact_dtypes,
+            share_entity_date_tables
         )
 
     def validate(self):
@@ -209,6 +218,9 @@ class Planner(object):
                 matrix_set_clone['test_uuids'] = test_uuids
                 updated_definitions.append(matrix_set_clone)
 
+        if self.matrix_views:
+            self._plan_matrix_views(build_tasks)
+
         logging.info(
             'Planner is finished generating matrix plans. '
             '%s matrix definitions and %s unique build tasks found',
@@ -217,9 +229,104 @@ class Planner(object):
         )
         return updated_definitions, build_tasks
 
+    def _plan_matrix_views(self, build_tasks):
+        """Find matrices with the same rows and labels, differing only in
+        their features (as those of different feature group strategies do),
+        and plan to build only one matrix with all of their features, with
+        the others stored as views of some of its columns.
+
+        If none of the matrices has all of the features, a build task for
+        one that does is added.
+
+        :param build_tasks: build tasks keyed by matrix uuid, updated in place
+                            with the source_matrix_uuid of each view
+        :type build_tasks: dict
+        """
+        row_sets = OrderedDict()
+        for matrix_uuid, build_task in build_tasks.items():
+            row_set = (
+                self.entity_date_table_name(**build_task),
+                build_task['label_name'],
+                build_task['label_type'],
+                build_task['matrix_metadata']['label_timespan'],
+            )
+            row_sets.setdefault(row_set, []).append(matrix_uuid)
+
+        for matrix_uuids in row_sets.values():
+            if len(matrix_uuids) < 2:
+                continue
+            all_features = OrderedDict()
+            for matrix_uuid in matrix_uuids:
+                for table, features in build_tasks[matrix_uuid]['feature_dictionary'].items():
+                    table_features = all_features.setdefault(table, [])
+                    table_features.extend(
+                        feature for feature in features if feature not in table_features
+                    )
+            feature_names = utils.feature_list(all_features)
+            source_uuid = next(
+                (
+                    matrix_uuid for matrix_uuid in matrix_uuids
+                    if build_tasks[matrix_uuid]['matrix_metadata']['feature_names'] ==
+                    feature_names
+                ),
+                None
+            )
+            if source_uuid is None:
+                build_task = build_tasks[matrix_uuids[0]]
+                source_metadata = copy.deepcopy(build_task['matrix_metadata'])
+                source_metadata['feature_names'] = feature_names
+                source_uuid = metta.generate_uuid(source_metadata)
+                build_tasks[source_uuid] = self._generate_build_task(
+                    source_metadata,
+                    source_uuid,
+                    build_task,
+                    dict(all_features)
+                )
+                logging.info('Added matrix %s with all features of %s matrices',
+                             source_uuid, len(matrix_uuids))
+            for matrix_uuid in matrix_uuids:
+                if matrix_uuid != source_uuid:
+                    build_tasks[matrix_uuid]['source_matrix_uuid'] = source_uuid
+            logging.info('Planned %s matrices as views of matrix %s',
+                         len(matrix_uuids) - (source_uuid in matrix_uuids), source_uuid)
+
     def build_all_matrices(self, *args, **kwargs):
         self.builder.build_all_matrices(*args, **kwargs)
 
     def build_matrix(self, *args, **kwargs):
         logging.info('Building matrix with args %s', args)
         self.builder.build_matrix(*args, **kwargs)
+
+    def estimate_matrix_memory(self, *args, **kwargs):
+        return self.builder.estimate_memory(*args, **kwargs)
+
+    def entity_date_table_name(
+        self,
+        as_of_times,
+        label_name,
+        label_type,
+        matrix_metadata,
+        matrix_type,
+        **kwargs
+    ):
+        """ The name of the entity-date table a matrix build task uses,
+        shared by the tasks of every matrix with the same rows. Arguments
+        are those of build_matrix.
+
+        :return: table name
+        :rtype: str
+        """
+        return self.builder.entity_date_table_name(
+            as_of_times,
+            label_name,
+            label_type,
+            matrix_metadata['state'],
+            matrix_type,
+            matrix_metadata['label_timespan']
+        )
+
+    def drop_entity_date_table(self, table_name):
+        self.builder.drop_entity_date_table(table_name)
+
+    def clean_up_builder(self):
+        self.builder.clean_up()
@@ -1,4 +1,5 @@
 import functools
+import json
 import operator
 
 
@@ -18,5 +19,21 @@ def feature_list(feature_dictionary):
     )
 
 
+def explain_row_estimate(db_engine, query):
+    """The number of rows the Postgres planner expects a query to produce,
+    found without running it
+
+    Args:
+        db_engine (sqlalchemy.engine)
+        query (string) a select or create table as query
+
+    Returns: (int)
+    """
+    ((plan,),) = db_engine.execute('explain (format json) {}'.format(query))
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
 def str_in_sql(values):
     return ','.join("'{}'".format(value) for value in values)
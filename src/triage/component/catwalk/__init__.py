@@ -1,10 +1,16 @@
 """Main application"""
-from .model_trainers import ModelTrainer
-from .predictors import Predictor
-from .evaluation import ModelEvaluator
+from triage.util.lazy import lazy_attributes
 
 __all__ = (
     'ModelTrainer',
     'Predictor',
     'ModelEvaluator',
 )
+
+# imported when first used, so the lightweight modules of this package
+# can be imported without sklearn
+lazy_attributes(__name__, {
+    'ModelTrainer': ('.model_trainers', 'ModelTrainer'),
+    'Predictor': ('.predictors', 'Predictor'),
+    'ModelEvaluator': ('.evaluation', 'ModelEvaluator'),
+})
@@ -1,13 +1,43 @@
+from datetime import datetime
+
+import sqlalchemy
 import yaml
 from sqlalchemy import create_engine
+from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.engine.url import URL
 from sqlalchemy.pool import QueuePool
 
-from triage.component.results_schema import Base
+from triage.component.results_schema import Base, SchemaVersion, schema_fingerprint
 
 
 def ensure_db(engine):
+    """Create the results schema, unless it was already created from this
+    version of it
+
+    Checking the recorded schema fingerprint is a single query, so this is
+    cheap to call for every experiment and worker.
+    """
+    fingerprint = schema_fingerprint()
+    schema_versions = SchemaVersion.__table__
+    try:
+        with engine.begin() as conn:
+            current = conn.execute(
+                schema_versions.select()
+                .where(schema_versions.c.schema_fingerprint == fingerprint)
+            ).first()
+    except sqlalchemy.exc.ProgrammingError:
+        # the schema or the versions table doesn't exist yet
+        current = None
+    if current:
+        return
+
     Base.metadata.create_all(engine)
+    with engine.begin() as conn:
+        conn.execute(
+            insert(schema_versions)
+            .values(schema_fingerprint=fingerprint, created_time=datetime.now())
+            .on_conflict_do_nothing()
+        )
 
 
 def connect(poolclass=QueuePool):
@@ -30,6 +30,11 @@ class ModelTrainer(object):
         db_engine (sqlalchemy.engine)
         replace (bool) whether or not to replace existing versions of models
     """
+    # a rough number of bytes of memory that each value of a train matrix
+    # takes up while training on it: the loaded DataFrame, and the copy of
+    # it that classifiers make as a numpy array
+    bytes_per_value_in_memory = 24
+
     def __init__(
         self,
         project_path,
@@ -47,6 +52,31 @@ class ModelTrainer(object):
         self.model_group_keys = model_group_keys
         self.replace = replace
 
+    def estimate_memory(self, matrix_store):
+        """Estimate the peak memory used to train a model on a matrix
+
+        Args:
+            matrix_store (catwalk.storage.MatrixStore) the train matrix
+
+        Returns: (int) estimated bytes of memory, or None if the matrix's
+            size isn't known without reading it
+        """
+        summary = matrix_store.summary
+        if 'rows' in summary and 'columns' in summary:
+            rows = summary['rows']
+            columns = len(summary['columns'])
+        elif 'labels' in matrix_store.label_arrays:
+            # the labels saved apart from the matrix have one value per row
+            rows = len(matrix_store.label_arrays['labels'])
+            columns = len(
+                matrix_store.metadata.get('feature_names') or matrix_store.columns()
+            )
+        else:
+            # matrices built before summaries were written would have to
+            # be read whole just to be sized
+            return None
+        return rows * columns * self.bytes_per_value_in_memory
+
     def unique_parameters(self, parameters):
         return {
             key: parameters[key]
@@ -90,6 +120,9 @@ class ModelTrainer(object):
         """Fit a model to a training set. Works on any modeling class that
         is available in this package's environment and implements .fit
 
+        Sparse matrices are passed to the model as they are, unless it
+        doesn't accept sparse input, when it is given a dense copy.
+
         Args:
             class_path (string) A full classpath to the model class
             parameters (dict) hyperparameters to give to the model constructor
@@ -103,6 +136,16 @@ class ModelTrainer(object):
         instance = cls(**parameters)
         y = matrix_store.labels()
 
+        if matrix_store.sparse:
+            try:
+                return instance.fit(matrix_store.sparse_matrix, y), matrix_store.columns()
+            except TypeError as error:
+                # sklearn estimators needing dense input say so with a TypeError
+                if 'sparse' not in str(error):
+                    raise
+                logging.info('%s does not accept sparse input, training on a dense copy',
+                             class_path)
+                instance = cls(**parameters)
         return instance.fit(matrix_store.matrix, y), matrix_store.matrix.columns
 
     @db_retry
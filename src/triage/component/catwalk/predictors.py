@@ -95,17 +95,17 @@ class Predictor(object):
             .filter(Prediction.as_of_date.in_(self._as_of_dates(matrix_store)))
 
     def _as_of_dates(self, matrix_store):
-        matrix = matrix_store.matrix
-        if 'as_of_date' in matrix.index.names:
-            return matrix.index.levels[
-                matrix.index.names.index('as_of_date')
+        index = matrix_store.index
+        if 'as_of_date' in index.names:
+            return index.levels[
+                index.names.index('as_of_date')
             ].tolist()
         else:
             return [matrix_store.metadata['end_time']]
 
     @db_retry
     def _load_saved_predictions(self, existing_predictions, matrix_store):
-        index = matrix_store.matrix.index
+        index = matrix_store.index
         score_lookup = {}
         for prediction in existing_predictions:
             score_lookup[(
@@ -155,7 +155,7 @@ class Predictor(object):
         test_label_timespan = matrix_store.metadata['label_timespan']
         logging.warning(test_label_timespan)
 
-        if 'as_of_date' in matrix_store.matrix.index.names:
+        if 'as_of_date' in matrix_store.index.names:
             logging.info('as_of_date found as part of matrix index, using '
                          'index for table as_of_dates')
             session.commit()
@@ -163,7 +163,7 @@ class Predictor(object):
             with tempfile.TemporaryFile(mode='w+') as f:
                 writer = csv.writer(f, quoting=csv.QUOTE_MINIMAL)
                 for index, score, label in zip(
-                    matrix_store.matrix.index,
+                    matrix_store.index,
                     predictions,
                     labels
                 ):
@@ -198,7 +198,7 @@ class Predictor(object):
             rankings_abs = temp_df['score'].rank(method='dense', ascending=False)
             rankings_pct = temp_df['score'].rank(method='dense', ascending=False, pct=True)
             for entity_id, score, label, rank_abs, rank_pct in zip(
-                matrix_store.matrix.index,
+                matrix_store.index,
                 predictions,
                 labels,
                 rankings_abs,
@@ -248,7 +248,7 @@ class Predictor(object):
                 model_id,
                 matrix_store
             )
-            index = matrix_store.matrix.index
+            index = matrix_store.index
             if existing_predictions.count() == len(index):
                 logging.info(
                     'Found predictions for model id %s, matrix %s, returning saved versions',
@@ -266,9 +266,22 @@ class Predictor(object):
             raise ModelNotFoundError('Model id {} not found'.format(model_id))
 
         labels = matrix_store.labels()
-        predictions_proba = model.predict_proba(
-            matrix_store.matrix_with_sorted_columns(train_matrix_columns)
-        )
+        predictions_proba = None
+        if matrix_store.sparse:
+            try:
+                predictions_proba = model.predict_proba(
+                    matrix_store.sparse_matrix_with_sorted_columns(train_matrix_columns)
+                )
+            except TypeError as error:
+                # sklearn estimators needing dense input say so with a TypeError
+                if 'sparse' not in str(error):
+                    raise
+                logging.info('Model %s does not accept sparse input, '
+                             'predicting on a dense copy', model_id)
+        if predictions_proba is None:
+            predictions_proba = model.predict_proba(
+                matrix_store.matrix_with_sorted_columns(train_matrix_columns)
+            )
 
         logging.info('Generated predictions for model %s, matrix %s', model_id, matrix_store.uuid)
         self._write_to_db(
@@ -1,8 +1,18 @@
+import io
+import json
 import logging
 import os
 import pickle
-
+import re
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy
 import pandas
+import scipy.sparse
 import smart_open
 import yaml
 
@@ -120,6 +130,14 @@ class InMemoryModelStorageEngine(ModelStorageEngine):
 
 class MatrixStore(object):
     _labels = None
+    # the extension of the matrix's path, after its uuid
+    suffix = None
+    # whether the features can be read as a scipy sparse matrix, with
+    # sparse_matrix and sparse_matrix_with_sorted_columns
+    sparse = False
+    _summary = None
+    _label_arrays = None
+    _stored_index = None
 
     def __init__(self, matrix_path=None, metadata_path=None):
         self.matrix_path = matrix_path
@@ -128,18 +146,75 @@ class MatrixStore(object):
         self._metadata = None
         self._head_of_matrix = None
 
+    @property
+    def _loading(self):
+        # held while the matrix or labels are read, as a matrix may be
+        # prefetched on another thread; made on first use, since stores
+        # are unpickled without one
+        return self.__dict__.setdefault('_loading_lock', threading.RLock())
+
     @property
     def matrix(self):
-        if self._matrix is None:
-            self._load()
+        with self._loading:
+            if self._matrix is None:
+                self._load()
         return self._matrix
 
     @property
     def metadata(self):
+        # the metadata can be read without the matrix
         if self._metadata is None:
-            self._load()
+            self._metadata = self.load_yaml(self.metadata_path)
         return self._metadata
 
+    @property
+    def summary_path(self):
+        # in-memory matrices have no path
+        if getattr(self, 'metadata_path', None) is None:
+            return None
+        return re.sub(r'\.yaml$', '', self.metadata_path) + '.summary.json'
+
+    @property
+    def labels_path(self):
+        if getattr(self, 'metadata_path', None) is None:
+            return None
+        return re.sub(r'\.yaml$', '', self.metadata_path) + '.labels.npz'
+
+    @property
+    def label_arrays(self):
+        """The matrix's index and labels, as numpy arrays written next to
+        it by metta, or an empty dict if they weren't"""
+        if self._label_arrays is None:
+            try:
+                with smart_open.smart_open(self.labels_path, 'rb') as f:
+                    with numpy.load(io.BytesIO(f.read())) as arrays:
+                        self._label_arrays = dict(arrays.items())
+            except Exception:
+                self._label_arrays = {}
+        return self._label_arrays
+
+    def _separate_labels(self):
+        # with the labels stored apart, the loaded matrix keeps to the
+        # features, as it would once labels() had popped them
+        label_name = self.metadata['label_name']
+        if self.label_arrays and label_name in self._matrix.columns:
+            labels = self._matrix.pop(label_name)
+            if self._labels is None:
+                self._labels = labels
+
+    @property
+    def summary(self):
+        """The matrix's number of rows, columns, column types, label
+        counts, and column statistics, as written next to it by metta, or an
+        empty dict if it has no summary"""
+        if self._summary is None:
+            try:
+                with smart_open.smart_open(self.summary_path, 'rb') as f:
+                    self._summary = json.loads(f.read().decode('utf-8'))
+            except Exception:
+                self._summary = {}
+        return self._summary
+
     @property
     def head_of_matrix(self):
         if self._head_of_matrix is None:
@@ -150,11 +225,18 @@ class MatrixStore(object):
     def empty(self):
         if not os.path.isfile(self.matrix_path):
             return True
+        elif 'rows' in self.summary:
+            return self.summary['rows'] == 0
         else:
             head_of_matrix = self.head_of_matrix
             return head_of_matrix.empty
 
     def columns(self, include_label=False):
+        if 'columns' in self.summary:
+            columns = list(self.summary['columns'])
+            if include_label:
+                return columns + [self.metadata['label_name']]
+            return columns
         head_of_matrix = self.head_of_matrix
         columns = head_of_matrix.columns.tolist()
         if include_label:
@@ -166,40 +248,101 @@ class MatrixStore(object):
             ]
 
     def labels(self):
-        if self._labels is not None:
-            logging.debug('using stored labels')
-            return self._labels
-        else:
-            logging.debug('popping labels from matrix')
-            self._labels = self.matrix.pop(self.metadata['label_name'])
-            return self._labels
+        with self._loading:
+            if self._labels is not None:
+                logging.debug('using stored labels')
+                return self._labels
+            elif self._matrix is None and 'labels' in self.label_arrays:
+                logging.debug('reading labels stored apart from the matrix')
+                self._labels = pandas.Series(
+                    self.label_arrays['labels'],
+                    index=self.index,
+                    name=self.metadata['label_name']
+                )
+                return self._labels
+            else:
+                logging.debug('popping labels from matrix')
+                self._labels = self.matrix.pop(self.metadata['label_name'])
+                return self._labels
+
+    def label_counts(self):
+        """The number of rows with each label, from the summary if the
+        matrix has one
+
+        Returns: (dict) label values to numbers of rows
+        """
+        if 'label_counts' in self.summary:
+            return dict((value, count) for value, count in self.summary['label_counts'])
+        return self.labels().value_counts().to_dict()
 
     @property
     def uuid(self):
         return self.metadata['metta-uuid']
 
+    @property
+    def loaded_bytes(self):
+        """The memory taken by the parts of the matrix read so far"""
+        loaded_bytes = 0
+        if self._matrix is not None:
+            loaded_bytes += self._matrix.memory_usage(index=True).sum()
+        if self._labels is not None:
+            loaded_bytes += self._labels.memory_usage(index=True)
+        return int(loaded_bytes)
+
+    @property
+    def index(self):
+        if self._matrix is None and 'labels' in self.label_arrays:
+            if self._stored_index is None:
+                index_names = self.metadata['indices']
+                index_arrays = [
+                    self.label_arrays['index_' + name] for name in index_names
+                ]
+                if len(index_arrays) > 1:
+                    self._stored_index = pandas.MultiIndex.from_arrays(
+                        index_arrays, names=index_names
+                    )
+                else:
+                    self._stored_index = pandas.Index(index_arrays[0], name=index_names[0])
+            return self._stored_index
+        return self.matrix.index
+
     @property
     def as_of_dates(self):
-        if 'as_of_date' in self.matrix.index.names:
-            return sorted(list(set([as_of_date for entity_id, as_of_date in self.matrix.index])))
+        if 'as_of_date' in self.index.names:
+            return sorted(list(set([as_of_date for entity_id, as_of_date in self.index])))
         else:
             return [self.metadata['end_time']]
 
     @property
     def num_entities(self):
-        if self.matrix.index.names == ['entity_id']:
-            return len(self.matrix.index.values)
-        elif 'entity_id' in self.matrix.index.names:
-            return len(self.matrix.index.levels[self.matrix.index.names.index('entity_id')])
+        if self.index.names == ['entity_id']:
+            return len(self.index.values)
+        elif 'entity_id' in self.index.names:
+            return len(self.index.levels[self.index.names.index('entity_id')])
+
+    def read_columns(self, columns):
+        """Some of the features, in the given order, reading as little of
+        the rest of the matrix as the format allows
+
+        Args:
+            columns (list) names of the features
+
+        Returns: (pandas.DataFrame)
+        """
+        return self.matrix[list(columns)]
 
     def matrix_with_sorted_columns(self, columns):
+        self._check_columns(columns)
+        if self.columns() != columns:
+            logging.warning('Column orders not the same, re-ordering')
+        return self.matrix[columns]
+
+    def _check_columns(self, columns):
+        """Raise a ValueError unless the matrix has exactly the given
+        columns, in any order"""
         columnset = set(self.columns())
         desired_columnset = set(columns)
-        if columnset == desired_columnset:
-            if self.columns() != columns:
-                logging.warning('Column orders not the same, re-ordering')
-            return self.matrix[columns]
-        else:
+        if columnset != desired_columnset:
             if columnset.issuperset(desired_columnset):
                 raise ValueError('''
                     Columnset is superset of desired columnset. Extra items: %s
@@ -228,14 +371,22 @@ class MatrixStore(object):
         # when we serialize (say, for multiprocessing),
         # we don't want the cached members to show up
         # as they can be enormous
-        self._matrix = None
-        self._labels = None
-        self._metadata = None
-        self._head_of_matrix = None
-        return self.__dict__.copy()
+        state = self.__dict__.copy()
+        state.update(
+            _matrix=None,
+            _labels=None,
+            _metadata=None,
+            _summary=None,
+            _label_arrays=None,
+            _stored_index=None,
+            _head_of_matrix=None,
+        )
+        state.pop('_loading_lock', None)
+        return state
 
 
 class HDFMatrixStore(MatrixStore):
+    suffix = 'h5'
 
     def _get_head_of_matrix(self):
         try:
@@ -255,6 +406,7 @@ class HDFMatrixStore(MatrixStore):
             self._matrix.set_index(self._metadata['indices'], inplace=True)
         except Exception:
             pass
+        self._separate_labels()
 
     def _read_hdf_from_buffer(self, buffer):
         with pandas.HDFStore(
@@ -290,6 +442,8 @@ class HDFMatrixStore(MatrixStore):
 
 
 class CSVMatrixStore(MatrixStore):
+    suffix = 'csv'
+
     def _get_head_of_matrix(self):
         try:
             head_of_matrix = pandas.read_csv(self.matrix_path, nrows=1)
@@ -299,10 +453,19 @@ class CSVMatrixStore(MatrixStore):
             self._head_of_matrix = None
 
     def _load(self):
-        with smart_open.smart_open(self.matrix_path, "r") as f:
-            self._matrix = pandas.read_csv(f)
         self._metadata = self.load_yaml(self.metadata_path)
+        # a CSV doesn't keep the types its columns were written with, so
+        # read them as those in the summary, or at least the compact types
+        # features were stored as, instead of inferring them
+        dtypes = dict(
+            (column, dtype)
+            for column, dtype in self.summary.get('dtypes', {}).items()
+            if dtype != 'object'
+        ) or self._metadata.get('feature_dtypes')
+        with smart_open.smart_open(self.matrix_path, "r") as f:
+            self._matrix = pandas.read_csv(f, dtype=dtypes)
         self._matrix.set_index(self.metadata['indices'], inplace=True)
+        self._separate_labels()
 
     def save(self, project_path, name):
         with smart_open.smart_open(os.path.join(project_path, name + ".csv"), "w") as f:
@@ -333,3 +496,798 @@ class InMemoryMatrixStore(MatrixStore):
 
     def save(self, project_path, name):
         return None
+
+
+class MemmapMatrixStore(MatrixStore):
+    """A matrix stored as uncompressed numpy arrays in a local directory:
+    one contiguous float array of all of its features, and one array each
+    of its labels, column names, and index columns.
+
+    The arrays are memory-mapped instead of read when the matrix is loaded,
+    so loading takes no time, and all processes loading the same matrix
+    share one copy of it in memory. The features are read-only.
+
+    Args:
+        matrix_path (string) the directory of the arrays
+        metadata_path (string) the path of the matrix's metadata yaml
+    """
+    suffix = 'memmap'
+
+    def _array(self, name):
+        return numpy.load(os.path.join(self.matrix_path, name + '.npy'), mmap_mode='r')
+
+    def _index(self, stop=None):
+        # the index is read into memory; pandas builds its own copy of it
+        index_names = self.metadata['indices']
+        index_arrays = [
+            numpy.array(self._array('index_' + name)[:stop])
+            for name in index_names
+        ]
+        if len(index_arrays) > 1:
+            return pandas.MultiIndex.from_arrays(index_arrays, names=index_names)
+        return pandas.Index(index_arrays[0], name=index_names[0])
+
+    def _get_head_of_matrix(self):
+        self._head_of_matrix = pandas.DataFrame(
+            numpy.array(self._array('features')[:1]),
+            index=self._index(stop=1),
+            columns=self.columns()
+        )
+
+    def _load(self):
+        self._matrix = pandas.DataFrame(
+            self._array('features'),
+            index=self._index(),
+            columns=self.columns(),
+            copy=False
+        )
+
+    @property
+    def empty(self):
+        if not os.path.isdir(self.matrix_path):
+            return True
+        return self._array('features').shape[0] == 0
+
+    def columns(self, include_label=False):
+        columns = [str(column) for column in self._array('columns')]
+        if include_label:
+            return columns + [self.metadata['label_name']]
+        return columns
+
+    def labels(self):
+        if self._labels is None:
+            # like the index, the labels are small enough to read, and pandas
+            # can't count the values of a read-only array
+            self._labels = pandas.Series(
+                numpy.array(self._array('labels')),
+                index=self.index,
+                name=self.metadata['label_name']
+            )
+        return self._labels
+
+    @property
+    def loaded_bytes(self):
+        # the features are mapped from their file, not read into memory
+        if self._labels is None:
+            return 0
+        return int(self._labels.memory_usage(index=True))
+
+    def matrix_with_sorted_columns(self, columns):
+        # the features can't be changed, so when they are already in order
+        # there is no need to copy them
+        if list(columns) == self.columns():
+            return self.matrix
+        return super(MemmapMatrixStore, self).matrix_with_sorted_columns(columns)
+
+    @classmethod
+    def write(cls, matrix, labels, metadata, project_path, name, dtype=None):
+        """Save a matrix's features, labels, and metadata as a memory-mapped
+        matrix
+
+        Args:
+            matrix (pandas.DataFrame) the features, indexed by the
+                metadata's indices
+            labels (pandas.Series)
+            metadata (dict)
+            project_path (string) a local directory
+            name (string) the name to save the matrix under
+            dtype (numpy.dtype, optional) the type to store the features as,
+                e.g. numpy.float32 to halve their size. By default, the
+                smallest type holding all of the metadata's feature_dtypes,
+                if it has them, or else they are kept as they are if floats,
+                and otherwise stored as float64
+
+        Returns: (MemmapMatrixStore) the saved matrix
+        """
+        matrix_path = os.path.join(project_path, '{}.{}'.format(name, cls.suffix))
+        os.makedirs(matrix_path, exist_ok=True)
+
+        def save_array(array_name, values):
+            cls._save_array(matrix_path, array_name, values)
+
+        features = matrix.values
+        if not (numpy.issubdtype(features.dtype, numpy.number) or features.dtype == bool):
+            raise ValueError('Only matrices of numeric features can be memory-mapped')
+        if dtype is None and metadata.get('feature_dtypes'):
+            dtype = numpy.result_type(*metadata['feature_dtypes'].values())
+        if dtype is None and not numpy.issubdtype(features.dtype, numpy.floating):
+            dtype = numpy.float64
+        save_array('features', numpy.ascontiguousarray(features, dtype=dtype))
+        save_array('labels', labels.values)
+        save_array('columns', [str(column) for column in matrix.columns])
+        metadata = dict(
+            metadata,
+            indices=metadata.get('indices') or [
+                index_name or 'index' for index_name in matrix.index.names
+            ]
+        )
+        for level, index_name in enumerate(metadata['indices']):
+            save_array('index_' + index_name, matrix.index.get_level_values(level))
+        store = cls(matrix_path, os.path.join(project_path, name + '.yaml'))
+        store.save_yaml(metadata, project_path, name)
+        return store
+
+    @staticmethod
+    def _save_array(matrix_path, array_name, values):
+        values = numpy.asarray(values)
+        if values.dtype == object:
+            # strings (such as dates read from a CSV) are saved as fixed
+            # width unicode, so no pickling is needed to load them
+            values = values.astype(str)
+        numpy.save(os.path.join(matrix_path, array_name + '.npy'), values)
+
+    def save(self, project_path, name):
+        self.write(self.matrix, self.labels(), self.metadata, project_path, name)
+
+
+class SparseMatrixStore(MemmapMatrixStore):
+    """A matrix whose features are stored as a compressed sparse row (CSR)
+    matrix, for matrices of mostly zeros, such as those with many
+    categorical features, in a local directory laid out like a
+    MemmapMatrixStore's: the features in a scipy .npz file, and numpy arrays
+    of the labels, column names, and index columns.
+
+    ``sparse_matrix`` reads the features as a scipy.sparse.csr_matrix, which
+    estimators that accept sparse input are trained and scored on, while
+    ``matrix`` makes a dense DataFrame of them for everything else.
+
+    Args:
+        matrix_path (string) the directory of the arrays
+        metadata_path (string) the path of the matrix's metadata yaml
+    """
+    suffix = 'sparse'
+    sparse = True
+
+    def __init__(self, *args, **kwargs):
+        super(SparseMatrixStore, self).__init__(*args, **kwargs)
+        self._sparse_matrix = None
+        self._row_index = None
+
+    @property
+    def sparse_matrix(self):
+        if self._sparse_matrix is None:
+            self._sparse_matrix = scipy.sparse.load_npz(
+                os.path.join(self.matrix_path, 'features.npz')
+            )
+        return self._sparse_matrix
+
+    @property
+    def index(self):
+        if self._row_index is None:
+            self._row_index = self._index()
+        return self._row_index
+
+    def _get_head_of_matrix(self):
+        self._head_of_matrix = pandas.DataFrame(
+            self.sparse_matrix[:1].toarray(),
+            index=self._index(stop=1),
+            columns=self.columns()
+        )
+
+    def _load(self):
+        logging.info('Making a dense copy of sparse matrix %s', self.matrix_path)
+        self._matrix = pandas.DataFrame(
+            self.sparse_matrix.toarray(),
+            index=self.index,
+            columns=self.columns()
+        )
+
+    @property
+    def empty(self):
+        if not os.path.isdir(self.matrix_path):
+            return True
+        if 'rows' in self.summary:
+            return self.summary['rows'] == 0
+        return self.sparse_matrix.shape[0] == 0
+
+    @property
+    def loaded_bytes(self):
+        # unlike a memory-mapped matrix, a dense copy is held in memory
+        loaded_bytes = MatrixStore.loaded_bytes.fget(self)
+        if self._sparse_matrix is not None:
+            loaded_bytes += sum(
+                array.nbytes for array in (
+                    self._sparse_matrix.data,
+                    self._sparse_matrix.indices,
+                    self._sparse_matrix.indptr,
+                )
+            )
+        return loaded_bytes
+
+    def sparse_columns(self, columns):
+        """Some of the features, in the given order, as a CSR matrix
+
+        Args:
+            columns (list) names of the features
+
+        Returns: (scipy.sparse.csr_matrix)
+        """
+        if list(columns) == self.columns():
+            return self.sparse_matrix
+        positions = dict((column, position) for position, column in enumerate(self.columns()))
+        return self.sparse_matrix[:, [positions[column] for column in columns]]
+
+    def sparse_matrix_with_sorted_columns(self, columns):
+        self._check_columns(columns)
+        return self.sparse_columns(columns)
+
+    def read_columns(self, columns):
+        if self._matrix is not None:
+            return super(SparseMatrixStore, self).read_columns(columns)
+        # only the requested columns are made dense
+        return pandas.DataFrame(
+            self.sparse_columns(columns).toarray(),
+            index=self.index,
+            columns=list(columns)
+        )
+
+    @classmethod
+    def write(cls, matrix, labels, metadata, project_path, name):
+        """Save a matrix's features, labels, and metadata as a sparse matrix
+
+        Args:
+            matrix (pandas.DataFrame) the features, indexed by the
+                metadata's indices
+            labels (pandas.Series)
+            metadata (dict)
+            project_path (string) a local directory
+            name (string) the name to save the matrix under
+
+        Returns: (SparseMatrixStore) the saved matrix
+        """
+        return cls.write_chunks([(matrix, labels)], metadata, project_path, name)
+
+    @classmethod
+    def write_chunks(cls, chunks, metadata, project_path, name):
+        """Save a matrix given a chunk of rows at a time, so only one chunk
+        is ever held densely in memory
+
+        Args:
+            chunks (iterable) of tuples of the features (pandas.DataFrame,
+                indexed by the metadata's indices) and labels
+                (pandas.Series) of consecutive rows
+            metadata (dict)
+            project_path (string) a local directory
+            name (string) the name to save the matrix under
+
+        Returns: (SparseMatrixStore) the saved matrix
+        """
+        matrix_path = os.path.join(project_path, '{}.{}'.format(name, cls.suffix))
+        os.makedirs(matrix_path, exist_ok=True)
+        features = []
+        labels = []
+        index_values = []
+        for chunk_features, chunk_labels in chunks:
+            values = chunk_features.values
+            if not (numpy.issubdtype(values.dtype, numpy.number) or values.dtype == bool):
+                if len(values):
+                    raise ValueError('Only matrices of numeric features can be stored as sparse')
+                # the columns of an empty CSV have no type
+                values = values.astype(numpy.float64)
+            features.append(scipy.sparse.csr_matrix(values))
+            labels.append(numpy.asarray(chunk_labels.values))
+            index_values.append([
+                numpy.asarray(chunk_features.index.get_level_values(level))
+                for level in range(chunk_features.index.nlevels)
+            ])
+            columns = [str(column) for column in chunk_features.columns]
+            index_names = chunk_features.index.names
+        scipy.sparse.save_npz(
+            os.path.join(matrix_path, 'features.npz'),
+            scipy.sparse.vstack(features, format='csr')
+        )
+        cls._save_array(matrix_path, 'labels', numpy.concatenate(labels))
+        cls._save_array(matrix_path, 'columns', columns)
+        metadata = dict(
+            metadata,
+            indices=metadata.get('indices') or [
+                index_name or 'index' for index_name in index_names
+            ]
+        )
+        for level, index_name in enumerate(metadata['indices']):
+            cls._save_array(
+                matrix_path,
+                'index_' + index_name,
+                numpy.concatenate([chunk_index[level] for chunk_index in index_values])
+            )
+        store = cls(matrix_path, os.path.join(project_path, name + '.yaml'))
+        store.save_yaml(metadata, project_path, name)
+        return store
+
+    def __getstate__(self):
+        state = super(SparseMatrixStore, self).__getstate__()
+        state.update(_sparse_matrix=None, _row_index=None)
+        return state
+
+
+class ParquetMatrixStore(MatrixStore):
+    """A matrix stored as a Parquet file, compressed column by column
+
+    Columns can be read without the rest of the file, so the column names,
+    the labels, and a subset of the features (with
+    ``matrix_with_sorted_columns``) are each read on their own, and
+    ``matrix`` holds only the features.
+
+    Requires pyarrow.
+
+    Args:
+        matrix_path (string) the path of the Parquet file
+        metadata_path (string) the path of the matrix's metadata yaml
+    """
+    suffix = 'parquet'
+    _file_metadata = None
+
+    def _parquet_file(self):
+        import pyarrow.parquet
+        if os.path.exists(self.matrix_path):
+            return pyarrow.parquet.ParquetFile(self.matrix_path)
+        # remote files are read whole, as their columns can't be sought
+        with smart_open.smart_open(self.matrix_path, 'rb') as f:
+            return pyarrow.parquet.ParquetFile(io.BytesIO(f.read()))
+
+    def _parquet_metadata(self):
+        """The row count and schema of the Parquet file, read from its
+        footer once and kept"""
+        if self._file_metadata is None:
+            self._file_metadata = self._parquet_file().metadata
+        return self._file_metadata
+
+    def _read(self, columns):
+        """Read the index and the given columns of the matrix"""
+        df = self._parquet_file().read(columns=columns).to_pandas()
+        indices = self.metadata['indices']
+        if set(indices) <= set(df.columns):
+            df.set_index(indices, inplace=True)
+        return df
+
+    def _get_head_of_matrix(self):
+        head_of_matrix = self._parquet_file().read_row_group(0).to_pandas().head(n=1)
+        indices = self.metadata['indices']
+        if set(indices) <= set(head_of_matrix.columns):
+            head_of_matrix.set_index(indices, inplace=True)
+        self._head_of_matrix = head_of_matrix
+
+    def _load(self):
+        self._matrix = self._read(self.metadata['indices'] + self.columns())
+
+    @property
+    def empty(self):
+        if not os.path.exists(self.matrix_path):
+            return True
+        elif 'rows' in self.summary:
+            return self.summary['rows'] == 0
+        return self._parquet_metadata().num_rows == 0
+
+    def columns(self, include_label=False):
+        if 'columns' in self.summary:
+            return super(ParquetMatrixStore, self).columns(include_label)
+        index_and_label = set(self.metadata['indices'] + [self.metadata['label_name']])
+        columns = [
+            name for name in self._parquet_metadata().schema.names
+            # pandas stores unnamed indexes as columns like __index_level_0__
+            if name not in index_and_label and not name.startswith('__index_level_')
+        ]
+        if include_label:
+            return columns + [self.metadata['label_name']]
+        return columns
+
+    def labels(self):
+        if self._labels is None:
+            label_name = self.metadata['label_name']
+            self._labels = self._read(self.metadata['indices'] + [label_name])[label_name]
+        return self._labels
+
+    def read_columns(self, columns):
+        if self._matrix is not None:
+            return super(ParquetMatrixStore, self).read_columns(columns)
+        return self._read(self.metadata['indices'] + list(columns))[list(columns)]
+
+    def matrix_with_sorted_columns(self, columns):
+        if self._matrix is not None:
+            return super(ParquetMatrixStore, self).matrix_with_sorted_columns(columns)
+        # read only the requested columns, in order
+        self._check_columns(columns)
+        return self.read_columns(columns)
+
+    @classmethod
+    def write(cls, matrix, labels, metadata, project_path, name, compression='zstd'):
+        """Save a matrix's features, labels, and metadata as a Parquet matrix
+
+        Args:
+            matrix (pandas.DataFrame) the features, indexed by the
+                metadata's indices
+            labels (pandas.Series)
+            metadata (dict)
+            project_path (string) a local directory
+            name (string) the name to save the matrix under
+            compression (string or dict) the codec to compress all columns
+                with, or a dict of column names to codecs
+
+        Returns: (ParquetMatrixStore) the saved matrix
+        """
+        import pyarrow
+        import pyarrow.parquet
+        df = matrix.copy()
+        df[metadata['label_name']] = labels
+        matrix_path = os.path.join(project_path, '{}.{}'.format(name, cls.suffix))
+        pyarrow.parquet.write_table(
+            pyarrow.Table.from_pandas(df),
+            matrix_path,
+            compression=compression
+        )
+        store = cls(matrix_path, os.path.join(project_path, name + '.yaml'))
+        store.save_yaml(metadata, project_path, name)
+        return store
+
+    def save(self, project_path, name):
+        self.write(self.matrix, self.labels(), self.metadata, project_path, name)
+
+    def __getstate__(self):
+        state = super(ParquetMatrixStore, self).__getstate__()
+        state.pop('_file_metadata', None)
+        return state
+
+
+class MatrixView(MatrixStore):
+    """A matrix stored as only its metadata, made of some of the columns
+    of another matrix with the same rows and labels.
+
+    The other matrix is only read when this one's columns or values are
+    needed, and only the view's own columns are taken from it.
+
+    Args:
+        source (MatrixStore) the matrix with all of the columns
+        metadata_path (string) the path of the view's metadata yaml, with
+            the names of its features
+    """
+    def __init__(self, source, metadata_path):
+        super(MatrixView, self).__init__(metadata_path=metadata_path)
+        self.source = source
+
+    def _get_head_of_matrix(self):
+        self._head_of_matrix = self.source.head_of_matrix[self.columns()]
+
+    def _load(self):
+        self._matrix = self.source.read_columns(self.columns())
+
+    @property
+    def empty(self):
+        return self.source.empty
+
+    @property
+    def index(self):
+        return self.source.index
+
+    @property
+    def sparse(self):
+        return self.source.sparse
+
+    @property
+    def sparse_matrix(self):
+        return self.source.sparse_columns(self.columns())
+
+    def columns(self, include_label=False):
+        # in the order of the source's columns
+        feature_names = set(self.metadata['feature_names'])
+        columns = [column for column in self.source.columns() if column in feature_names]
+        if include_label:
+            return columns + [self.metadata['label_name']]
+        return columns
+
+    def labels(self):
+        return self.source.labels()
+
+    def label_counts(self):
+        return self.source.label_counts()
+
+    def matrix_with_sorted_columns(self, columns):
+        self._check_columns(columns)
+        return self.source.read_columns(columns)
+
+    def sparse_matrix_with_sorted_columns(self, columns):
+        self._check_columns(columns)
+        return self.source.sparse_columns(columns)
+
+
+# the matrix store class that reads each format metta can archive a matrix in
+MATRIX_STORE_CLASSES = {
+    'csv': CSVMatrixStore,
+    'hd5': HDFMatrixStore,
+    'memmap': MemmapMatrixStore,
+    'parquet': ParquetMatrixStore,
+    'sparse': SparseMatrixStore,
+}
+
+
+class MatrixBroker(object):
+    """Copies matrices into memory-mapped stores in a local directory, so
+    that worker processes given the copies map the same memory instead of
+    each reading and parsing the matrix again
+
+    Each matrix is copied once, however many times it is shared. The copy
+    of one matrix is removed by ``release``, and those of all by ``close``.
+
+    Args:
+        directory (string, optional) where to put the copies. By default,
+            a new temporary directory
+    """
+    def __init__(self, directory=None):
+        self.directory = directory or tempfile.mkdtemp(prefix='triage-matrices-')
+        self._stores = {}
+
+    def share(self, matrix_store):
+        """A memory-mapped copy of a matrix
+
+        Matrices that can't be memory-mapped (for instance, because they
+        have non-numeric columns), and sparse matrices, are returned as they
+        are.
+
+        Args:
+            matrix_store (MatrixStore)
+
+        Returns: (MatrixStore)
+        """
+        if isinstance(matrix_store, MemmapMatrixStore) or matrix_store.sparse:
+            # sparse matrices would take far more memory copied densely
+            return matrix_store
+        uuid = matrix_store.uuid
+        if uuid not in self._stores:
+            # the labels come out of the matrix, so take them first
+            labels = matrix_store.labels()
+            try:
+                self._stores[uuid] = MemmapMatrixStore.write(
+                    matrix_store.matrix,
+                    labels,
+                    matrix_store.metadata,
+                    self.directory,
+                    uuid
+                )
+                logging.info('Shared matrix %s in %s', uuid, self.directory)
+            except ValueError as error:
+                logging.warning('Not sharing matrix %s: %s', uuid, error)
+                self._stores[uuid] = matrix_store
+        return self._stores[uuid]
+
+    def release(self, uuid):
+        """Remove the copy of one shared matrix, once no more tasks will be
+        given it
+
+        Args:
+            uuid (string) the matrix's uuid
+        """
+        matrix_store = self._stores.pop(uuid, None)
+        if not isinstance(matrix_store, MemmapMatrixStore):
+            # never shared, or shared as it was rather than copied
+            return
+        shutil.rmtree(matrix_store.matrix_path, ignore_errors=True)
+        try:
+            os.remove(matrix_store.metadata_path)
+        except FileNotFoundError:
+            pass
+        logging.info('Released shared matrix %s', uuid)
+
+    def close(self):
+        """Remove the copies of all shared matrices"""
+        shutil.rmtree(self.directory, ignore_errors=True)
+        self._stores = {}
+
+
+class MatrixCache(object):
+    """Matrix stores kept in memory between uses, so a matrix used again,
+    such as a test matrix shared by several splits, isn't read again
+
+    Stores are kept by key (the matrix's uuid, say) until the memory taken
+    by what they have loaded is over the budget, when the least recently
+    used are dropped. A store whose metadata file has changed since it was
+    cached, because the matrix was built again, is replaced.
+
+    Args:
+        max_bytes (int) the budget for the loaded matrices, in bytes
+    """
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._stores = OrderedDict()
+        # making a view's store gets the store of its source
+        self._lock = threading.RLock()
+
+    @staticmethod
+    def _modified_time(matrix_store):
+        try:
+            return os.path.getmtime(matrix_store.metadata_path)
+        except (OSError, TypeError):
+            return None
+
+    def get(self, key, make_store):
+        """The cached store for a key, or a new one made and cached
+
+        Args:
+            key (hashable) identifies the matrix
+            make_store (callable) returns a new MatrixStore for the matrix
+
+        Returns: (MatrixStore)
+        """
+        with self._lock:
+            if key in self._stores:
+                matrix_store, modified_time = self._stores.pop(key)
+                if self._modified_time(matrix_store) == modified_time:
+                    self._stores[key] = (matrix_store, modified_time)
+                    self.hits += 1
+                    logging.debug('Matrix cache hit for %s (%s hits, %s misses)',
+                                  key, self.hits, self.misses)
+                    self._evict()
+                    return matrix_store
+            self.misses += 1
+            logging.debug('Matrix cache miss for %s (%s hits, %s misses)',
+                          key, self.hits, self.misses)
+            matrix_store = make_store()
+            self._stores[key] = (matrix_store, self._modified_time(matrix_store))
+            self._evict()
+            return matrix_store
+
+    @staticmethod
+    def _loaded_bytes(matrix_store):
+        # a store being read on another thread (by a prefetcher, say) is
+        # sized once it's read, rather than waited on or sized half-read
+        if not matrix_store._loading.acquire(blocking=False):
+            return 0
+        try:
+            return matrix_store.loaded_bytes
+        finally:
+            matrix_store._loading.release()
+
+    def _evict(self):
+        # stores load lazily, so their sizes are only known now
+        sizes = OrderedDict(
+            (key, self._loaded_bytes(matrix_store))
+            for key, (matrix_store, _) in self._stores.items()
+        )
+        total = sum(sizes.values())
+        # never the store just asked for, which is last
+        for key, size in list(sizes.items())[:-1]:
+            if total <= self.max_bytes:
+                break
+            # only this cache's reference is dropped, so a store in use
+            # elsewhere lives on until it isn't
+            del self._stores[key]
+            total -= size
+            self.evictions += 1
+            logging.info('Dropped matrix %s (%s bytes) from the matrix cache', key, size)
+
+    def clear(self):
+        """Drop all cached stores"""
+        with self._lock:
+            self._stores = OrderedDict()
+
+    def log_stats(self):
+        logging.info(
+            'Matrix cache: %s hits, %s misses, %s evictions, %s matrices cached',
+            self.hits,
+            self.misses,
+            self.evictions,
+            len(self._stores)
+        )
+
+
+class MatrixPrefetcher(object):
+    """Loads matrices on a background thread ahead of their use, so reading
+    the next one overlaps training or testing on the current one
+
+    The caller says which matrices it will use next, in order, with
+    ``prefetch``, and takes each with ``get``, which waits for it to finish
+    loading if it is still being read. Only the first few matrices are
+    loaded ahead, so at most ``max_prefetched`` are held on top of those in
+    use; matrices no longer among them are let go.
+
+    Args:
+        make_store (callable) returns the MatrixStore for a key, such as a
+            matrix uuid
+        max_prefetched (int) the most matrices loaded ahead at once. If 0,
+            none are
+    """
+    def __init__(self, make_store, max_prefetched=2):
+        self.make_store = make_store
+        self.max_prefetched = max_prefetched
+        self._prefetched = OrderedDict()
+        self._taken = set()
+        self._executor = None
+
+    @staticmethod
+    def _load(matrix_store):
+        try:
+            matrix_store.labels()
+            if matrix_store.sparse:
+                matrix_store.sparse_matrix
+            else:
+                matrix_store.matrix
+        except Exception:
+            # whatever went wrong will happen again when the matrix is used
+            logging.warning('Could not prefetch matrix %s', matrix_store.matrix_path,
+                            exc_info=True)
+
+    def prefetch(self, keys):
+        """Start loading the first matrices that will be used next
+
+        Matrices already taken with ``get`` aren't loaded again, as they
+        may be in use.
+
+        Args:
+            keys (list) the keys of the matrices that will be used next,
+                in order
+        """
+        upcoming = []
+        for key in keys:
+            if len(upcoming) == self.max_prefetched:
+                break
+            if key not in self._taken and key not in upcoming:
+                upcoming.append(key)
+        for key in list(self._prefetched.keys()):
+            if key not in upcoming:
+                future, _ = self._prefetched.pop(key)
+                # one already loading is let finish, so it isn't still being
+                # read if taken later
+                if not future.cancel():
+                    future.result()
+        for key in upcoming:
+            if key not in self._prefetched:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=1)
+                matrix_store = self.make_store(key)
+                logging.debug('Prefetching matrix %s', key)
+                self._prefetched[key] = (
+                    self._executor.submit(self._load, matrix_store),
+                    matrix_store
+                )
+
+    def get(self, key):
+        """The store of a matrix, loaded if it was prefetched
+
+        Args:
+            key (hashable) identifies the matrix
+
+        Returns: (MatrixStore)
+        """
+        self._taken.add(key)
+        if key in self._prefetched:
+            future, matrix_store = self._prefetched.pop(key)
+            if not future.done():
+                logging.info('Waiting for matrix %s to finish loading', key)
+            future.result()
+            return matrix_store
+        return self.make_store(key)
+
+    def close(self):
+        """Stop loading matrices, and let go of those loaded"""
+        for future, _ in self._prefetched.values():
+            future.cancel()
+        self._prefetched = OrderedDict()
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+
+# the budget of an experiment's matrix cache, unless it is given one
+# (see ExperimentBase's matrix_cache_bytes)
+DEFAULT_MATRIX_CACHE_BYTES = 2 * 1024 ** 3
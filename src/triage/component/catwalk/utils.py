@@ -6,9 +6,6 @@ import pickle
 import random
 import tempfile
 
-import botocore
-import pandas
-import postgres_copy
 import sqlalchemy
 import yaml
 from retrying import retry
@@ -16,6 +13,9 @@ from sqlalchemy.orm import sessionmaker
 
 from triage.component.results_schema import Experiment, Model
 
+# botocore, pandas, and postgres_copy are imported by the functions using
+# them, so that the rest of these helpers are quick to import
+
 
 def split_s3_path(path):
     """
@@ -63,6 +63,7 @@ def model_cache_key(project_path, model_id, s3_conn):
 
 
 def key_exists(key):
+    import botocore
     try:
         key.load()
     except botocore.exceptions.ClientError as e:
@@ -80,6 +81,7 @@ def get_matrix_and_metadata(matrix_path, metadata_path):
 
     Returns: (tuple) matrix, metadata
     """
+    import pandas
     matrix = pandas.read_hdf(matrix_path)
     with open(metadata_path) as f:
         metadata = yaml.load(f)
@@ -184,6 +186,27 @@ def retrieve_model_id_from_hash(db_engine, model_hash):
         session.close()
 
 
+@db_retry
+def retrieve_model_ids_from_hashes(db_engine, model_hashes):
+    """Retrieves the model ids from the database that match the given hashes
+
+    Args:
+        db_engine (sqlalchemy.engine) A database engine
+        model_hashes (list) The model hashes to lookup
+
+    Returns: (dict) model hashes found in the DB and their model ids
+    """
+    session = sessionmaker(bind=db_engine)()
+    try:
+        return dict(
+            session.query(Model.model_hash, Model.model_id)
+            .filter(Model.model_hash.in_(list(model_hashes)))
+            .all()
+        )
+    finally:
+        session.close()
+
+
 @db_retry
 def save_db_objects(db_engine, db_objects):
     """Saves a collection of SQLAlchemy model objects to the database using a COPY command
@@ -192,6 +215,7 @@ def save_db_objects(db_engine, db_objects):
         db_engine (sqlalchemy.engine)
         db_objects (list) SQLAlchemy model objects, corresponding to a valid table
     """
+    import postgres_copy
     with tempfile.TemporaryFile(mode='w+') as f:
         writer = csv.writer(f, quoting=csv.QUOTE_MINIMAL)
         for db_object in db_objects:
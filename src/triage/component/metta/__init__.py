@@ -1,12 +1,16 @@
 from .metta_io import (
+    MATRIX_SUFFIXES,
     archive_matrix,
+    archive_matrix_view,
     generate_uuid,
     archive_train_test,
 )
 from .upload_s3 import upload_to_s3
 
 __all__ = (
+    'MATRIX_SUFFIXES',
     'archive_matrix',
+    'archive_matrix_view',
     'archive_train_test',
     'generate_uuid',
     'upload_to_s3',
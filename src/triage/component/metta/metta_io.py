@@ -9,9 +9,12 @@ import os
 import datetime
 import json
 import hashlib
+import io
 import shutil
+from collections import Counter, OrderedDict
 import pandas as pd
 import numpy as np
+from pandas.api.types import is_numeric_dtype
 
 
 def archive_train_test(train_config,
@@ -39,6 +42,8 @@ def archive_train_test(train_config,
         format to save files in
         - hd5: HDF5
         - csv: Comma Separated Values
+        - memmap: a directory of numpy arrays
+        - parquet: Parquet
     overwrite: bool
         If true then identical matrices
         will be overridden.
@@ -81,6 +86,7 @@ def archive_matrix(
         directory='.',
         format='hd5',
         train_uuid=None,
+        compact_dtypes=False,
 ):
     """Store a design matrix.
 
@@ -98,7 +104,13 @@ def archive_matrix(
         format to save files in
         - hd5: HDF5
         - csv: Comma Separated Values
+        - memmap: a directory of numpy arrays
+        - parquet: Parquet
     train_uuid (optional): uuid of train set to associate with as a test set
+    compact_dtypes: bool
+        If true, store each feature as the smallest type that holds all of
+        its values (see infer_compact_dtypes), recorded in the metadata's
+        feature_dtypes
 
     Returns
     -------
@@ -139,12 +151,284 @@ def archive_matrix(
     write_matrix = (overwrite) or not(os.path.isfile(fname + format))
     if write_matrix:
         _store_matrix(matrix_config, df_matrix, matrix_uuid, abs_path_dir,
-                      format=format)
+                      format=format, compact_dtypes=compact_dtypes)
 
     return matrix_uuid
 
 
-def _store_matrix(metadata, df_data, title, directory, format='hd5'):
+def archive_matrix_view(matrix_config, source_uuid, directory='.'):
+    """Store a design matrix made of some of the columns of another
+    stored matrix, as only its metadata, naming the other matrix.
+
+    Parameters
+    ----------
+    matrix_config: dict
+        dict to be yamled
+    source_uuid: str
+        uuid of the stored matrix with the same rows and all the columns
+    directory: str
+        Relative path to where the metadata will be stored
+
+    Returns
+    -------
+    uuid: str
+        uuid for the stored set
+
+    """
+    abs_path_dir = os.path.abspath(directory)
+    if not os.path.exists(abs_path_dir):
+        os.makedirs(abs_path_dir)
+
+    check_config_types(matrix_config)
+
+    matrix_uuid = generate_uuid(matrix_config)
+
+    matrix_config = copy.deepcopy(matrix_config)
+    matrix_config['metta-uuid'] = matrix_uuid
+    matrix_config['source_matrix_uuid'] = source_uuid
+
+    with open(os.path.join(abs_path_dir, matrix_uuid + '.yaml'), 'w') as stream:
+        yaml.dump(matrix_config, stream)
+
+    return matrix_uuid
+
+
+# the integer types a feature of whole numbers can be stored as, smallest first
+COMPACT_INTEGER_DTYPES = ('int8', 'int16', 'int32')
+
+# the number of rows of a CSV read at once, when it is read in chunks
+CSV_CHUNK_ROWS = 100000
+
+
+def _observe_values(df_data, observed):
+    """Update the observed range, sum, nulls, and precision of each column
+    of a chunk of a matrix"""
+    for column in df_data.columns:
+        values = df_data[column].values.astype(np.float64)
+        non_null = values[~np.isnan(values)]
+        column_observed = observed.setdefault(column, {
+            'nulls': 0,
+            'count': 0,
+            'sum': 0.0,
+            'min': np.inf,
+            'max': -np.inf,
+            'integral': True,
+            'float32': True,
+        })
+        column_observed['nulls'] += len(values) - len(non_null)
+        if len(non_null):
+            column_observed['count'] += len(non_null)
+            column_observed['sum'] += non_null.sum()
+            column_observed['min'] = min(column_observed['min'], non_null.min())
+            column_observed['max'] = max(column_observed['max'], non_null.max())
+            column_observed['integral'] &= bool((non_null == np.floor(non_null)).all())
+            with np.errstate(over='ignore'):
+                column_observed['float32'] &= bool(
+                    (non_null.astype(np.float32) == non_null).all()
+                )
+
+
+def _compact_dtypes(observed, feature_names):
+    """The smallest types features can be stored as, from their observed
+    values (see infer_compact_dtypes)"""
+    dtypes = {}
+    for feature_name in feature_names:
+        feature_observed = observed.get(feature_name)
+        if feature_observed is None or not feature_observed['count']:
+            # no values to go on
+            dtypes[feature_name] = 'float32'
+            continue
+        dtypes[feature_name] = 'float32' if feature_observed['float32'] else 'float64'
+        if feature_observed['integral'] and not feature_observed['nulls']:
+            for dtype in COMPACT_INTEGER_DTYPES:
+                if np.iinfo(dtype).min <= feature_observed['min'] and \
+                        feature_observed['max'] <= np.iinfo(dtype).max:
+                    dtypes[feature_name] = dtype
+                    break
+    return dtypes
+
+
+def infer_compact_dtypes(df_data, feature_names, chunksize=CSV_CHUNK_ROWS):
+    """The smallest type each feature of a matrix can be stored as without
+    changing any of its values
+
+    Whole-numbered features without nulls, such as imputation flags and
+    categorical indicators, are stored as the smallest integer type that
+    holds their range, and other features as float32 if every value
+    survives the conversion, or float64 if not.
+
+    Parameters
+    ----------
+    df_data: DataFrame or str
+        the matrix, or the path to a CSV of it, which is read a chunk of
+        rows at a time
+    feature_names: list
+        the names of the features
+    chunksize: int
+        the number of rows of a CSV to read at once
+
+    Returns
+    -------
+    dtypes: dict
+        feature names to the names of their types
+    """
+    observed = {}
+    if isinstance(df_data, pd.DataFrame):
+        _observe_values(df_data[feature_names], observed)
+    else:
+        for chunk in pd.read_csv(df_data, usecols=feature_names, chunksize=chunksize):
+            _observe_values(chunk, observed)
+    return _compact_dtypes(observed, feature_names)
+
+
+def _label_columns(metadata):
+    """The names of the arrays a matrix's index and labels are saved as,
+    to the columns they come from"""
+    return OrderedDict(
+        [('index_' + name, name) for name in metadata.get('indices', [])] +
+        [('labels', metadata['label_name'])]
+    )
+
+
+def _column_values(df_data, column):
+    """The values of a column of a matrix, or of a level of its index, or
+    None if it has neither"""
+    if column in df_data.columns:
+        return df_data[column].values
+    if column in df_data.index.names:
+        return df_data.index.get_level_values(column).values
+    return None
+
+
+def _observe_matrix(df_data, metadata):
+    """Observe the values of every column of a matrix, a chunk of rows at a
+    time if it is a CSV
+
+    Returns
+    -------
+    rows: int
+        the number of rows
+    dtypes: OrderedDict
+        column names to the names of their types
+    observed: dict
+        numeric column names to their observed values, as kept by
+        _observe_values
+    label_counts: Counter
+        label values to the number of rows with each
+    label_arrays: OrderedDict
+        'index_' and the name of each of the metadata's indices, and
+        'labels', to lists of the values of those columns in each chunk,
+        if the matrix has them all
+    """
+    if isinstance(df_data, pd.DataFrame):
+        chunks = [df_data]
+    else:
+        chunks = pd.read_csv(df_data, chunksize=CSV_CHUNK_ROWS)
+    rows = 0
+    dtypes = OrderedDict()
+    observed = {}
+    label_counts = Counter()
+    label_columns = _label_columns(metadata)
+    label_arrays = OrderedDict((key, []) for key in label_columns)
+    for chunk in chunks:
+        rows += len(chunk)
+        for column in chunk.columns:
+            dtype = chunk[column].dtype
+            if column in dtypes and dtypes[column] != dtype:
+                # say, integers in one chunk and floats or nulls in another
+                if is_numeric_dtype(dtypes[column]) and is_numeric_dtype(dtype):
+                    dtype = np.result_type(dtypes[column], dtype)
+                else:
+                    dtype = np.dtype(object)
+            dtypes[column] = dtype
+        _observe_values(
+            chunk[[
+                column for column in chunk.columns
+                if is_numeric_dtype(chunk[column].dtype)
+                and column not in metadata.get('indices', [])
+            ]],
+            observed
+        )
+        if metadata['label_name'] in chunk.columns:
+            label_counts.update(chunk[metadata['label_name']].dropna().tolist())
+        chunk_arrays = OrderedDict(
+            (key, _column_values(chunk, column)) for key, column in label_columns.items()
+        )
+        if label_arrays and metadata.get('indices') and all(
+            values is not None for values in chunk_arrays.values()
+        ):
+            for key, values in chunk_arrays.items():
+                label_arrays[key].append(values)
+        else:
+            label_arrays = OrderedDict()
+    return (
+        rows,
+        OrderedDict((c, str(dtype)) for c, dtype in dtypes.items()),
+        observed,
+        label_counts,
+        label_arrays,
+    )
+
+
+def _write_label_arrays(label_arrays, directory, title):
+    """Save the index and labels of a matrix as numpy arrays in
+    title.labels.npz, so they can be read without its features"""
+    arrays = {}
+    for key, chunk_arrays in label_arrays.items():
+        values = np.concatenate(chunk_arrays)
+        if values.dtype == object:
+            # strings, like dates read from a CSV, as fixed-width strings,
+            # which numpy can load without unpickling
+            values = values.astype(str)
+        arrays[key] = values
+    np.savez(directory + '/' + title + '.labels.npz', **arrays)
+
+
+def _csv_dates(values):
+    """Dates as the strings a CSV of them is read back as"""
+    # whether pandas writes the times, and to what precision, depends on
+    # the whole column and the pandas version, so have it write them
+    written = pd.DataFrame({'date': values}).to_csv(index=False)
+    return np.asarray(pd.read_csv(io.StringIO(written), dtype=str)['date'], dtype=object)
+
+
+def _csv_label_arrays(label_arrays):
+    """The index and labels of a matrix as they are read back from its
+    CSV, which keeps dates as strings in the format pandas writes them in"""
+    csv_label_arrays = OrderedDict()
+    for key, chunk_arrays in label_arrays.items():
+        values = np.concatenate(chunk_arrays)
+        if np.issubdtype(values.dtype, np.datetime64):
+            values = _csv_dates(values)
+        csv_label_arrays[key] = [values]
+    return csv_label_arrays
+
+
+def _matrix_summary(rows, feature_names, dtypes, observed, label_counts):
+    """A summary of a matrix, written next to it so questions about its
+    size, columns, and labels can be answered without reading it"""
+    def stat(value):
+        return None if value is None or np.isinf(value) else float(value)
+
+    return {
+        'rows': rows,
+        'columns': feature_names,
+        'dtypes': dtypes,
+        'label_counts': sorted(label_counts.items()),
+        'column_stats': dict(
+            (column, {
+                'min': stat(column_observed['min']),
+                'max': stat(column_observed['max']),
+                'mean': stat(column_observed['sum'] / column_observed['count'])
+                if column_observed['count'] else None,
+                'nulls': int(column_observed['nulls']),
+            })
+            for column, column_observed in observed.items()
+        ),
+    }
+
+
+def _store_matrix(metadata, df_data, title, directory, format='hd5', compact_dtypes=False):
     """Store matrix and associated meta-data
 
     Parameters
@@ -161,11 +445,30 @@ def _store_matrix(metadata, df_data, title, directory, format='hd5'):
         format to save files in
         - hd5: HDF5 (default) compressoin level 5, complib zlib
         - csv: Comma Separated Values
+        - memmap: a directory of numpy arrays, read by
+          catwalk.storage.MemmapMatrixStore
+        - parquet: Parquet, with each column compressed with zstd, read
+          by catwalk.storage.ParquetMatrixStore
+        - sparse: a directory of a scipy CSR matrix of the features and
+          numpy arrays of the rest, read by catwalk.storage.SparseMatrixStore
+    compact_dtypes: bool
+        If true, find the smallest type each feature can be stored as, and
+        record them in the metadata's feature_dtypes. Formats that keep
+        types store the features as them; CSVs are read as them.
 
     Returns
     -------
     metadata: file
         Writes out to YAML file title.yaml
+    labels: file
+        For hd5 and csv matrices with indices, writes out the index and
+        labels as numpy arrays to title.labels.npz (the other formats
+        already store them apart from the features)
+    summary: file
+        Writes out the number of rows, the feature names, the types of
+        the columns, the number of rows with each label, and each numeric
+        column's min, max, mean, and number of nulls, to JSON file
+        title.summary.json
     data_file: file
         CSV of dataframe feature set title.csv
 
@@ -189,18 +492,57 @@ def _store_matrix(metadata, df_data, title, directory, format='hd5'):
     if not (metadata['label_name'] == last_col):
         raise IOError('label_name is not last column')
 
+    if isinstance(df_data, pd.DataFrame):
+        columns = df_data.columns.tolist()
+    else:
+        columns = headers.columns.tolist()
+    feature_names = [
+        column for column in columns
+        if column not in metadata.get('indices', []) and column != metadata['label_name']
+    ]
+    rows, dtypes, observed, label_counts, label_arrays = _observe_matrix(df_data, metadata)
+    feature_dtypes = {}
+    if compact_dtypes:
+        feature_dtypes = _compact_dtypes(observed, feature_names)
+        metadata = dict(metadata, feature_dtypes=feature_dtypes)
+        dtypes.update(feature_dtypes)
+    with open(directory + '/' + title + '.summary.json', 'w') as stream:
+        json.dump(
+            _matrix_summary(rows, feature_names, dtypes, observed, label_counts),
+            stream
+        )
+
     yaml_fname = directory + '/' + title + '.yaml'
 
     with open(yaml_fname, 'w') as stream:
         yaml.dump(metadata, stream)
 
     if format == 'hd5':
+        if isinstance(df_data, str):
+            df_data = pd.read_csv(abs_path_file)
+            # as the builders' DataFrames are, so the index isn't converted
+            # to floats below
+            indices = metadata.get('indices')
+            if indices and set(indices) <= set(df_data.columns):
+                df_data = df_data.set_index(indices)
 
         for col in df_data.columns:
             if (df_data[col].dtype == np.dtype('datetime64[ns]')):
                 df_data[col] = df_data[col].map(lambda x: x.timestamp())
             elif isinstance(df_data[col].dtype, object):
                 df_data[col] = df_data[col].astype(float)
+        if feature_dtypes:
+            df_data = df_data.astype(feature_dtypes)
+        if label_arrays:
+            # as converted above
+            _write_label_arrays(
+                OrderedDict(
+                    (key, [_column_values(df_data, column)])
+                    for key, column in _label_columns(metadata).items()
+                ),
+                directory,
+                title
+            )
 
         hdf = pd.HDFStore(directory + '/' + title + '.h5',
                           mode='w',
@@ -218,8 +560,63 @@ def _store_matrix(metadata, df_data, title, directory, format='hd5'):
             else:
                 df_data.to_csv(fpath)
         elif type(df_data) == str:
-            if abs_path_file[-3:] == 'csv':
+            # a CSV may already have been written to the matrix's path
+            if abs_path_file[-3:] == 'csv' and abs_path_file != os.path.abspath(fpath):
                 shutil.copyfile(abs_path_file, fpath)
+        if label_arrays:
+            _write_label_arrays(_csv_label_arrays(label_arrays), directory, title)
+    elif format in ('memmap', 'parquet'):
+        from triage.component.catwalk.storage import MATRIX_STORE_CLASSES
+        if isinstance(df_data, str):
+            df_data = pd.read_csv(abs_path_file, dtype=feature_dtypes or None)
+        elif feature_dtypes:
+            df_data = df_data.astype(feature_dtypes)
+        indices = metadata.get('indices')
+        if indices and set(indices) <= set(df_data.columns):
+            df_data = df_data.set_index(indices)
+        MATRIX_STORE_CLASSES[format].write(
+            df_data.drop(metadata['label_name'], axis=1),
+            df_data[metadata['label_name']],
+            metadata,
+            directory,
+            title
+        )
+    elif format == 'sparse':
+        from triage.component.catwalk.storage import SparseMatrixStore
+        if isinstance(df_data, str):
+            # only a chunk of the CSV is held densely at once
+            chunks = pd.read_csv(
+                abs_path_file,
+                dtype=feature_dtypes or None,
+                chunksize=CSV_CHUNK_ROWS
+            )
+        elif feature_dtypes:
+            chunks = [df_data.astype(feature_dtypes)]
+        else:
+            chunks = [df_data]
+
+        def split_labels(chunk):
+            indices = metadata.get('indices')
+            if indices and set(indices) <= set(chunk.columns):
+                chunk = chunk.set_index(indices)
+            return chunk.drop(metadata['label_name'], axis=1), chunk[metadata['label_name']]
+
+        SparseMatrixStore.write_chunks(
+            (split_labels(chunk) for chunk in chunks),
+            metadata,
+            directory,
+            title
+        )
+
+
+# the extension of a matrix's file (or directory) in each format
+MATRIX_SUFFIXES = {
+    'hd5': 'h5',
+    'csv': 'csv',
+    'memmap': 'memmap',
+    'parquet': 'parquet',
+    'sparse': 'sparse',
+}
 
 
 def check_config_types(dict_config):
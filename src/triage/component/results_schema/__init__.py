@@ -1,9 +1,8 @@
 import os.path
 
-import alembic.config
-
 from .schema import (
     Base,
+    CompletedTask,
     Evaluation,
     Experiment,
     FeatureImportance,
@@ -12,11 +11,16 @@ from .schema import (
     Model,
     ModelGroup,
     Prediction,
+    QueuedTask,
+    SchemaVersion,
+    TaskTelemetry,
+    schema_fingerprint,
 )
 
 
 __all__ = (
     'Base',
+    'CompletedTask',
     'Evaluation',
     'Experiment',
     'FeatureImportance',
@@ -25,7 +29,11 @@ __all__ = (
     'Model',
     'ModelGroup',
     'Prediction',
+    'QueuedTask',
+    'SchemaVersion',
+    'TaskTelemetry',
     'mark_db_as_upgraded',
+    'schema_fingerprint',
     'upgrade_db',
 )
 
@@ -41,11 +49,17 @@ def _base_alembic_args(db_config_filename=None):
     return base
 
 
+def _run_alembic(args):
+    # alembic is only needed to migrate, so isn't imported along with the schema
+    import alembic.config
+    alembic.config.main(argv=args)
+
+
 def upgrade_db(db_config_filename=None):
     args = _base_alembic_args(db_config_filename) + ['--raiseerr', 'upgrade', 'head']
-    alembic.config.main(argv=args)
+    _run_alembic(args)
 
 
 def mark_db_as_upgraded(db_config_filename=None):
     args = _base_alembic_args(db_config_filename) + ['--raiseerr', 'stamp', 'head']
-    alembic.config.main(argv=args)
+    _run_alembic(args)
@@ -0,0 +1,60 @@
+"""add task queue table
+
+Revision ID: 3ce027594a5c
+Revises: 7d57d1cf3429
+Create Date: 2018-01-08 10:12:45.319817
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3ce027594a5c'
+down_revision = '7d57d1cf3429'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'task_queue',
+        sa.Column('task_id', sa.Integer(), nullable=False),
+        sa.Column('experiment_hash', sa.String(), nullable=True),
+        sa.Column('pool', sa.String(), nullable=True),
+        sa.Column('function_name', sa.Text(), nullable=True),
+        sa.Column('payload', sa.LargeBinary(), nullable=True),
+        sa.Column('status', sa.String(), nullable=True),
+        sa.Column('result', sa.LargeBinary(), nullable=True),
+        sa.Column('error', sa.Text(), nullable=True),
+        sa.Column('worker', sa.Text(), nullable=True),
+        sa.Column('created_time', sa.DateTime(), nullable=True),
+        sa.Column('finished_time', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['experiment_hash'], ['results.experiments.experiment_hash'], ),
+        sa.PrimaryKeyConstraint('task_id'),
+        schema='results'
+    )
+    op.create_index(
+        op.f('ix_results_task_queue_experiment_hash'),
+        'task_queue',
+        ['experiment_hash'],
+        unique=False,
+        schema='results'
+    )
+    op.create_index(
+        op.f('ix_results_task_queue_status'),
+        'task_queue',
+        ['status'],
+        unique=False,
+        schema='results'
+    )
+
+
+def downgrade():
+    op.drop_index(op.f('ix_results_task_queue_status'), table_name='task_queue', schema='results')
+    op.drop_index(
+        op.f('ix_results_task_queue_experiment_hash'),
+        table_name='task_queue',
+        schema='results'
+    )
+    op.drop_table('task_queue', schema='results')
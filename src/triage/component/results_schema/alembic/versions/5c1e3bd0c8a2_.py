@@ -0,0 +1,30 @@
+"""add schema versions table
+
+Revision ID: 5c1e3bd0c8a2
+Revises: e4b7d9c1a0f3
+Create Date: 2018-01-29 09:47:12.118734
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5c1e3bd0c8a2'
+down_revision = 'e4b7d9c1a0f3'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'schema_versions',
+        sa.Column('schema_fingerprint', sa.String(), nullable=False),
+        sa.Column('created_time', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('schema_fingerprint'),
+        schema='results'
+    )
+
+
+def downgrade():
+    op.drop_table('schema_versions', schema='results')
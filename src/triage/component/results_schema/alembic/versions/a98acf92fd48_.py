@@ -0,0 +1,34 @@
+"""add completed tasks table
+
+Revision ID: a98acf92fd48
+Revises: 3ce027594a5c
+Create Date: 2018-01-15 16:40:02.871204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a98acf92fd48'
+down_revision = '3ce027594a5c'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'completed_tasks',
+        sa.Column('task_type', sa.String(), nullable=False),
+        sa.Column('task_key', sa.Text(), nullable=False),
+        sa.Column('fingerprint', sa.String(), nullable=True),
+        sa.Column('experiment_hash', sa.String(), nullable=True),
+        sa.Column('completed_time', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['experiment_hash'], ['results.experiments.experiment_hash'], ),
+        sa.PrimaryKeyConstraint('task_type', 'task_key'),
+        schema='results'
+    )
+
+
+def downgrade():
+    op.drop_table('completed_tasks', schema='results')
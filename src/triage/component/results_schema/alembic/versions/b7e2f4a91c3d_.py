@@ -0,0 +1,58 @@
+"""scope completed tasks to their experiment
+
+Revision ID: b7e2f4a91c3d
+Revises: 5c1e3bd0c8a2
+Create Date: 2018-02-05 11:20:41.503127
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b7e2f4a91c3d'
+down_revision = '5c1e3bd0c8a2'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # tasks recorded without an experiment can't be told apart, so are run again
+    op.execute('delete from results.completed_tasks where experiment_hash is null')
+    op.drop_constraint('completed_tasks_pkey', 'completed_tasks', schema='results')
+    op.alter_column(
+        'completed_tasks',
+        'experiment_hash',
+        existing_type=sa.String(),
+        nullable=False,
+        schema='results'
+    )
+    op.create_primary_key(
+        'completed_tasks_pkey',
+        'completed_tasks',
+        ['experiment_hash', 'task_type', 'task_key'],
+        schema='results'
+    )
+
+
+def downgrade():
+    # keep the latest record of each task
+    op.execute(
+        'delete from results.completed_tasks a using results.completed_tasks b '
+        'where a.task_type = b.task_type and a.task_key = b.task_key '
+        'and a.completed_time < b.completed_time'
+    )
+    op.drop_constraint('completed_tasks_pkey', 'completed_tasks', schema='results')
+    op.alter_column(
+        'completed_tasks',
+        'experiment_hash',
+        existing_type=sa.String(),
+        nullable=True,
+        schema='results'
+    )
+    op.create_primary_key(
+        'completed_tasks_pkey',
+        'completed_tasks',
+        ['task_type', 'task_key'],
+        schema='results'
+    )
@@ -0,0 +1,52 @@
+"""add task telemetry table
+
+Revision ID: e4b7d9c1a0f3
+Revises: a98acf92fd48
+Create Date: 2018-01-22 11:05:37.602415
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e4b7d9c1a0f3'
+down_revision = 'a98acf92fd48'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'task_telemetry',
+        sa.Column('task_telemetry_id', sa.Integer(), nullable=False),
+        sa.Column('experiment_hash', sa.String(), nullable=True),
+        sa.Column('task_type', sa.String(), nullable=True),
+        sa.Column('task_key', sa.Text(), nullable=True),
+        sa.Column('worker', sa.Text(), nullable=True),
+        sa.Column('start_time', sa.DateTime(), nullable=True),
+        sa.Column('wall_time', sa.Float(), nullable=True),
+        sa.Column('cpu_time', sa.Float(), nullable=True),
+        sa.Column('peak_rss', sa.BigInteger(), nullable=True),
+        sa.Column('rows', sa.BigInteger(), nullable=True),
+        sa.Column('bytes_written', sa.BigInteger(), nullable=True),
+        sa.ForeignKeyConstraint(['experiment_hash'], ['results.experiments.experiment_hash'], ),
+        sa.PrimaryKeyConstraint('task_telemetry_id'),
+        schema='results'
+    )
+    op.create_index(
+        op.f('ix_results_task_telemetry_experiment_hash'),
+        'task_telemetry',
+        ['experiment_hash'],
+        unique=False,
+        schema='results'
+    )
+
+
+def downgrade():
+    op.drop_index(
+        op.f('ix_results_task_telemetry_experiment_hash'),
+        table_name='task_telemetry',
+        schema='results'
+    )
+    op.drop_table('task_telemetry', schema='results')
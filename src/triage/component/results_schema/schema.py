@@ -1,3 +1,4 @@
+import hashlib
 import os.path
 
 from sqlalchemy import (
@@ -12,6 +13,7 @@ from sqlalchemy import (
     JSON,
     Float,
     Text,
+    LargeBinary,
     ForeignKey,
     MetaData,
     DDL,
@@ -179,3 +181,80 @@ class Evaluation(Base):
     sort_seed = Column(Integer)
 
     model_rel = relationship('Model')
+
+
+class QueuedTask(Base):
+
+    __tablename__ = 'task_queue'
+
+    task_id = Column(Integer, primary_key=True)
+    experiment_hash = Column(String, ForeignKey('experiments.experiment_hash'), index=True)
+    pool = Column(String)
+    function_name = Column(Text)
+    payload = Column(LargeBinary)
+    status = Column(String, index=True)
+    result = Column(LargeBinary)
+    error = Column(Text)
+    worker = Column(Text)
+    created_time = Column(DateTime)
+    finished_time = Column(DateTime)
+
+    experiment_rel = relationship('Experiment')
+
+
+class CompletedTask(Base):
+
+    __tablename__ = 'completed_tasks'
+
+    experiment_hash = Column(
+        String,
+        ForeignKey('experiments.experiment_hash'),
+        primary_key=True
+    )
+    task_type = Column(String, primary_key=True)
+    task_key = Column(Text, primary_key=True)
+    fingerprint = Column(String)
+    completed_time = Column(DateTime)
+
+    experiment_rel = relationship('Experiment')
+
+
+class TaskTelemetry(Base):
+
+    __tablename__ = 'task_telemetry'
+
+    task_telemetry_id = Column(Integer, primary_key=True)
+    experiment_hash = Column(String, ForeignKey('experiments.experiment_hash'), index=True)
+    task_type = Column(String)
+    task_key = Column(Text)
+    worker = Column(Text)
+    start_time = Column(DateTime)
+    wall_time = Column(Float)
+    cpu_time = Column(Float)
+    peak_rss = Column(BigInteger)
+    rows = Column(BigInteger)
+    bytes_written = Column(BigInteger)
+
+    experiment_rel = relationship('Experiment')
+
+
+class SchemaVersion(Base):
+
+    __tablename__ = 'schema_versions'
+
+    schema_fingerprint = Column(String, primary_key=True)
+    created_time = Column(DateTime)
+
+
+def schema_fingerprint():
+    """A hash of the tables and stored procedures defined here, to cheaply
+    tell whether a database's results schema was created from this version
+
+    Returns: (string)
+    """
+    definition = [stmt] + [
+        '{} {} {} {}'.format(table.name, column.name, repr(column.type), column.primary_key)
+        for table in sorted(Base.metadata.tables.values(), key=lambda table: table.name)
+        for column in table.columns
+    ]
+    return hashlib.md5('\n'.join(definition).encode('utf-8')).hexdigest()
@@ -4,8 +4,10 @@ CONFIG_VERSION = 'v3'  # noqa: E402
 from .base import ExperimentBase
 from .multicore import MultiCoreExperiment
 from .singlethreaded import SingleThreadedExperiment
+from .distributed import DistributedExperiment
 
 __all__ = (
+    'DistributedExperiment',
     'ExperimentBase',
     'MultiCoreExperiment',
     'SingleThreadedExperiment',
@@ -1,31 +1,19 @@
 import logging
 import os
 from abc import ABCMeta, abstractmethod
+from collections import OrderedDict
 from datetime import datetime
 from functools import partial
 
 from descriptors import cachedproperty
 from timeout import timeout
 
-from triage.component.architect.label_generators import BinaryLabelGenerator
-from triage.component.architect.features import (
-    FeatureGenerator,
-    FeatureDictionaryCreator,
-    FeatureGroupCreator,
-    FeatureGroupMixer,
-)
-from triage.component.architect.planner import Planner
-from triage.component.architect.state_table_generators import StateTableGenerator
-from triage.component.timechop import Timechop
 from triage.component.catwalk.db import ensure_db
-from triage.component.catwalk.model_trainers import ModelTrainer
-from triage.component.catwalk.predictors import Predictor
-from triage.component.catwalk.individual_importance import IndividualImportanceCalculator
-from triage.component.catwalk.evaluation import ModelEvaluator
 from triage.component.catwalk.utils import save_experiment_and_get_hash
-from triage.component.catwalk.storage import CSVMatrixStore
 
 from triage.experiments import CONFIG_VERSION
+from triage.experiments.estimate import ExperimentCostEstimator
+from triage.experiments.telemetry import log_slowest_tasks, task_telemetry
 from triage.experiments.validate import ExperimentValidator
 
 
@@ -46,6 +34,12 @@ class ExperimentBase(object, metaclass=ABCMeta):
         project_path=None,
         replace=True,
         cleanup_timeout=None,
+        matrix_format='csv',
+        matrix_builder='high_memory',
+        matrix_views=False,
+        compact_dtypes=False,
+        matrix_cache_bytes=None,
+        max_prefetched_matrices=2,
     ):
         self._check_config_version(config)
         self.config = config
@@ -54,9 +48,17 @@ class ExperimentBase(object, metaclass=ABCMeta):
         if model_storage_class:
             self.model_storage_engine = model_storage_class(
                 project_path=project_path)
-        self.matrix_store_class = CSVMatrixStore  # can't be configurable until Architect obeys
         self.project_path = project_path
         self.replace = replace
+        self.matrix_format = matrix_format
+        self.matrix_builder = matrix_builder
+        self.matrix_views = matrix_views
+        self.compact_dtypes = compact_dtypes
+        from triage.component.catwalk.storage import DEFAULT_MATRIX_CACHE_BYTES, MatrixCache
+        self.matrix_cache = MatrixCache(
+            DEFAULT_MATRIX_CACHE_BYTES if matrix_cache_bytes is None else matrix_cache_bytes
+        )
+        self.max_prefetched_matrices = max_prefetched_matrices
         ensure_db(self.db_engine)
 
         self.labels_table_name = 'labels'
@@ -68,8 +70,6 @@ class ExperimentBase(object, metaclass=ABCMeta):
 
         self.experiment_hash = save_experiment_and_get_hash(self.config,
                                                             self.db_engine)
-        self.initialize_factories()
-        self.initialize_components()
 
         self.cleanup_timeout = (self.cleanup_timeout if cleanup_timeout is None
                                 else cleanup_timeout)
@@ -89,10 +89,22 @@ class ExperimentBase(object, metaclass=ABCMeta):
                 .format(config_version, CONFIG_VERSION)
             )
 
-    def initialize_factories(self):
-        split_config = self.config['temporal_config']
+    # The components, and the factories that create them in worker
+    # processes, are made when first used, so that the libraries they need
+    # (like sklearn and pandas) aren't imported by experiments that are only
+    # validated or estimated, or by processes that don't use them.
 
-        self.chopper_factory = partial(
+    @cachedproperty
+    def matrix_store_class(self):
+        # the class that reads matrices in the format the planner writes them
+        from triage.component.catwalk.storage import MATRIX_STORE_CLASSES
+        return MATRIX_STORE_CLASSES[self.matrix_format]
+
+    @cachedproperty
+    def chopper_factory(self):
+        from triage.component.timechop import Timechop
+        split_config = self.config['temporal_config']
+        return partial(
             Timechop,
             feature_start_time=dt_from_str(split_config['feature_start_time']),
             feature_end_time=dt_from_str(split_config['feature_end_time']),
@@ -107,7 +119,10 @@ class ExperimentBase(object, metaclass=ABCMeta):
             test_durations=split_config['test_durations'],
         )
 
-        self.state_table_generator_factory = partial(
+    @cachedproperty
+    def state_table_generator_factory(self):
+        from triage.component.architect.state_table_generators import StateTableGenerator
+        return partial(
             StateTableGenerator,
             experiment_hash=self.experiment_hash,
             dense_state_table=self.config.get('state_config', {})
@@ -115,36 +130,58 @@ class ExperimentBase(object, metaclass=ABCMeta):
             events_table=self.config['events_table']
         )
 
-        self.label_generator_factory = partial(
+    @cachedproperty
+    def label_generator_factory(self):
+        from triage.component.architect.label_generators import BinaryLabelGenerator
+        return partial(
             BinaryLabelGenerator,
             events_table=self.config['events_table'],
         )
 
-        self.feature_dictionary_creator_factory = partial(
+    @cachedproperty
+    def feature_dictionary_creator_factory(self):
+        from triage.component.architect.features import FeatureDictionaryCreator
+        return partial(
             FeatureDictionaryCreator,
             features_schema_name=self.features_schema_name,
         )
 
-        self.feature_generator_factory = partial(
+    @cachedproperty
+    def feature_generator_factory(self):
+        from triage.component.architect.features import FeatureGenerator
+        return partial(
             FeatureGenerator,
             features_schema_name=self.features_schema_name,
             replace=self.replace,
-            feature_start_time=split_config['feature_start_time']
+            feature_start_time=self.config['temporal_config']['feature_start_time']
         )
 
-        self.feature_group_creator_factory = partial(
+    @cachedproperty
+    def feature_group_creator_factory(self):
+        from triage.component.architect.features import FeatureGroupCreator
+        return partial(
             FeatureGroupCreator,
             self.config.get('feature_group_definition', {'all': [True]})
         )
 
-        self.feature_group_mixer_factory = partial(
+    @cachedproperty
+    def feature_group_mixer_factory(self):
+        from triage.component.architect.features import FeatureGroupMixer
+        return partial(
             FeatureGroupMixer,
             self.config.get('feature_group_strategies', ['all'])
         )
 
-        self.planner_factory = partial(
+    @cachedproperty
+    def planner_factory(self):
+        from triage.component.architect.builders import MATRIX_BUILDERS
+        from triage.component.architect.planner import Planner
+        return partial(
             Planner,
-            feature_start_time=dt_from_str(split_config['feature_start_time']),
+            builder_class=MATRIX_BUILDERS[self.matrix_builder],
+            feature_start_time=dt_from_str(
+                self.config['temporal_config']['feature_start_time']
+            ),
             label_names=['outcome'],
             label_types=['binary'],
             db_config={
@@ -160,10 +197,19 @@ class ExperimentBase(object, metaclass=ABCMeta):
             matrix_directory=self.matrices_directory,
             states=self.config.get('state_config', {}).get('state_filters', []),
             user_metadata=self.config.get('user_metadata', {}),
-            replace=self.replace
+            replace=self.replace,
+            matrix_format=self.matrix_format,
+            matrix_views=self.matrix_views,
+            compact_dtypes=self.compact_dtypes,
+            # leftovers from earlier runs are dropped when matrix builds
+            # are planned, so matrices with the same rows can share a table
+            share_entity_date_tables=True
         )
 
-        self.trainer_factory = partial(
+    @cachedproperty
+    def trainer_factory(self):
+        from triage.component.catwalk.model_trainers import ModelTrainer
+        return partial(
             ModelTrainer,
             project_path=self.project_path,
             experiment_hash=self.experiment_hash,
@@ -172,41 +218,84 @@ class ExperimentBase(object, metaclass=ABCMeta):
             replace=self.replace
         )
 
-        self.predictor_factory = partial(
+    @cachedproperty
+    def predictor_factory(self):
+        from triage.component.catwalk.predictors import Predictor
+        return partial(
             Predictor,
             model_storage_engine=self.model_storage_engine,
             project_path=self.project_path,
             replace=self.replace
         )
 
-        self.indiv_importance_factory = partial(
+    @cachedproperty
+    def indiv_importance_factory(self):
+        from triage.component.catwalk.individual_importance import (
+            IndividualImportanceCalculator
+        )
+        return partial(
             IndividualImportanceCalculator,
             n_ranks=self.config.get('individual_importance', {}).get('n_ranks', 5),
             methods=self.config.get('individual_importance', {}).get('methods', ['uniform']),
             replace=self.replace
         )
 
-        self.evaluator_factory = partial(
+    @cachedproperty
+    def evaluator_factory(self):
+        from triage.component.catwalk.evaluation import ModelEvaluator
+        return partial(
             ModelEvaluator,
             sort_seed=self.config['scoring'].get('sort_seed', None),
             metric_groups=self.config['scoring']['metric_groups'],
         )
 
-    def initialize_components(self):
-        self.chopper = self.chopper_factory()
-        self.label_generator = self.label_generator_factory(db_engine=self.db_engine)
-        self.state_table_generator = self.state_table_generator_factory(db_engine=self.db_engine)
-        self.feature_generator = self.feature_generator_factory(db_engine=self.db_engine)
-        self.feature_dictionary_creator = self.feature_dictionary_creator_factory(
-            db_engine=self.db_engine)
-        self.feature_group_creator = self.feature_group_creator_factory()
-        self.feature_group_mixer = self.feature_group_mixer_factory()
-        self.planner = self.planner_factory(engine=self.db_engine)
-        self.trainer = self.trainer_factory(db_engine=self.db_engine)
-        self.predictor = self.predictor_factory(db_engine=self.db_engine)
-        self.individual_importance_calculator = self.indiv_importance_factory(
-            db_engine=self.db_engine)
-        self.evaluator = self.evaluator_factory(db_engine=self.db_engine)
+    @cachedproperty
+    def chopper(self):
+        return self.chopper_factory()
+
+    @cachedproperty
+    def label_generator(self):
+        return self.label_generator_factory(db_engine=self.db_engine)
+
+    @cachedproperty
+    def state_table_generator(self):
+        return self.state_table_generator_factory(db_engine=self.db_engine)
+
+    @cachedproperty
+    def feature_generator(self):
+        return self.feature_generator_factory(db_engine=self.db_engine)
+
+    @cachedproperty
+    def feature_dictionary_creator(self):
+        return self.feature_dictionary_creator_factory(db_engine=self.db_engine)
+
+    @cachedproperty
+    def feature_group_creator(self):
+        return self.feature_group_creator_factory()
+
+    @cachedproperty
+    def feature_group_mixer(self):
+        return self.feature_group_mixer_factory()
+
+    @cachedproperty
+    def planner(self):
+        return self.planner_factory(engine=self.db_engine)
+
+    @cachedproperty
+    def trainer(self):
+        return self.trainer_factory(db_engine=self.db_engine)
+
+    @cachedproperty
+    def predictor(self):
+        return self.predictor_factory(db_engine=self.db_engine)
+
+    @cachedproperty
+    def individual_importance_calculator(self):
+        return self.indiv_importance_factory(db_engine=self.db_engine)
+
+    @cachedproperty
+    def evaluator(self):
+        return self.evaluator_factory(db_engine=self.db_engine)
 
     @cachedproperty
     def split_definitions(self):
@@ -264,6 +353,44 @@ class ExperimentBase(object, metaclass=ABCMeta):
         print('For more detailed information on your time splits, '
               'inspect the experiment `split_definitions` property')
 
+    def estimate_costs(self):
+        """Estimate the work each stage of the experiment will do, without
+        doing it
+
+        Returns: (dict) see ``ExperimentCostEstimator.estimate``
+        """
+        return ExperimentCostEstimator(self).estimate()
+
+    def print_cost_estimate(self):
+        estimate = self.estimate_costs()
+        print('\n----COST ESTIMATE----\n')
+        print('Feature tables: {} ({} INSERT queries)'.format(
+            len(estimate['feature_inserts']),
+            sum(estimate['feature_inserts'].values())
+        ))
+        print('Sparse state rows: {}'.format(estimate['sparse_state_rows']))
+        print('Label rows: {}'.format(estimate['label_rows']))
+        print('Matrices: {} ({} bytes)'.format(
+            len(estimate['matrices']),
+            estimate['total_matrix_bytes']
+        ))
+        for matrix_uuid, matrix in estimate['matrices'].items():
+            print('    {} ({}): {} rows x {} columns, {} bytes'.format(
+                matrix_uuid,
+                matrix['matrix_type'],
+                matrix['rows'],
+                matrix['columns'],
+                matrix['bytes']
+            ))
+        print('Models: {}'.format(estimate['total_models']))
+        for split_num, split in enumerate(estimate['splits']):
+            print('    Split {}: {} models, {} prediction rows'.format(
+                split_num,
+                split['models'],
+                split['prediction_rows']
+            ))
+        print('Prediction rows: {}'.format(estimate['total_prediction_rows']))
+
     @cachedproperty
     def all_as_of_times(self):
         """All 'as of times' in experiment config
@@ -397,6 +524,27 @@ class ExperimentBase(object, metaclass=ABCMeta):
         self.full_matrix_definitions = updated_split_definitions
         return matrix_build_tasks
 
+    def entity_date_tables(self, matrix_uuids):
+        """The entity-date tables the given matrices will be built from,
+        each shared by all matrices with the same rows
+
+        Args:
+            matrix_uuids (list) uuids of matrices to be built
+
+        Returns: (OrderedDict) table names to lists of the uuids of the
+            matrices that use them
+        """
+        tables = OrderedDict()
+        for matrix_uuid in matrix_uuids:
+            if self.matrix_build_tasks[matrix_uuid].get('source_matrix_uuid'):
+                # views are made from other matrices
+                continue
+            table_name = self.planner.entity_date_table_name(
+                **self.matrix_build_tasks[matrix_uuid]
+            )
+            tables.setdefault(table_name, []).append(matrix_uuid)
+        return tables
+
     @cachedproperty
     def full_matrix_definitions(self):
         """Full matrix definitions
@@ -452,15 +600,43 @@ class ExperimentBase(object, metaclass=ABCMeta):
         )
 
     def matrix_store(self, matrix_uuid):
+        """The matrix store for a given matrix uuid, kept in the Experiment's
+        #matrix_cache so a matrix used again is only read once
+
+        Args:
+            matrix_uuid (string) A uuid for a matrix
+        """
+        return self.matrix_cache.get(
+            matrix_uuid,
+            partial(self._new_matrix_store, matrix_uuid)
+        )
+
+    def _new_matrix_store(self, matrix_uuid):
         """Construct a matrix store for a given matrix uuid, using the Experiment's #matrix_store_class
 
+        Matrices planned as views of other matrices get a MatrixView of the
+        other matrix's store.
+
         Args:
             matrix_uuid (string) A uuid for a matrix
         """
+        if self.matrix_views:
+            source_matrix_uuid = self.matrix_build_tasks.get(matrix_uuid, {}).get(
+                'source_matrix_uuid'
+            )
+            if source_matrix_uuid:
+                from triage.component.catwalk.storage import MatrixView
+                return MatrixView(
+                    self.matrix_store(source_matrix_uuid),
+                    metadata_path=os.path.join(
+                        self.matrices_directory,
+                        '{}.yaml'.format(matrix_uuid)
+                    )
+                )
         matrix_store = self.matrix_store_class(
             matrix_path=os.path.join(
                 self.matrices_directory,
-                '{}.csv'.format(matrix_uuid)
+                '{}.{}'.format(matrix_uuid, self.matrix_store_class.suffix)
             ),
             metadata_path=os.path.join(
                 self.matrices_directory,
@@ -469,6 +645,25 @@ class ExperimentBase(object, metaclass=ABCMeta):
         )
         return matrix_store
 
+    def matrix_prefetcher(self):
+        """A prefetcher that loads matrices by uuid on a background thread,
+        up to the Experiment's #max_prefetched_matrices ahead of their use
+
+        Returns: (catwalk.storage.MatrixPrefetcher)
+        """
+        from triage.component.catwalk.storage import MatrixPrefetcher
+        return MatrixPrefetcher(self.matrix_store, self.max_prefetched_matrices)
+
+    def task_telemetry(self, task_type, task_key):
+        """Record the time and memory taken by the code run inside in
+        results.task_telemetry. See ``telemetry.task_telemetry``
+
+        Args:
+            task_type (string) the kind of task, e.g. 'matrix'
+            task_key (string) identifies the task among those of its type
+        """
+        return task_telemetry(self.db_engine, self.experiment_hash, task_type, task_key)
+
     @abstractmethod
     def build_matrices(self):
         """Generate labels, features, and matrices"""
@@ -495,10 +690,16 @@ class ExperimentBase(object, metaclass=ABCMeta):
         self.catwalk()
 
     def run(self):
+        run_start_time = datetime.now()
         try:
             self._run()
         except Exception:
             logging.exception('Run interrupted by uncaught exception')
             raise
+        finally:
+            log_slowest_tasks(self.db_engine, self.experiment_hash, since=run_start_time)
+            self.matrix_cache.log_stats()
+            # the matrices aren't held onto once the experiment is done
+            self.matrix_cache.clear()
 
     __call__ = run
@@ -0,0 +1,315 @@
+import argparse
+import logging
+import multiprocessing
+import os
+import pickle
+import socket
+import threading
+import time
+import traceback
+from datetime import datetime
+
+from sqlalchemy import select
+
+from triage.component.results_schema import QueuedTask
+
+from triage.experiments.multicore import MultiCoreExperiment, worker_db_engine
+
+
+task_queue_table = QueuedTask.__table__
+
+
+def _function_name(func):
+    # unwrap partials (and anything else exposing the function it wraps)
+    while hasattr(func, 'func'):
+        func = func.func
+    return getattr(func, '__name__', None)
+
+
+class DatabaseTaskQueue(object):
+    """A stand-in for a multiprocessing.Pool that, instead of running tasks
+    in local processes, writes them into the results.task_queue table for
+    worker processes (see ``run_worker``) on any machine to pick up.
+
+    Finished tasks are collected by a thread that polls the table, which
+    calls the callbacks given to ``apply_async`` and removes the rows.
+
+    Args:
+        db_engine (sqlalchemy.engine)
+        experiment_hash (string) the experiment the tasks belong to
+        pool (string) the name of the pool, so workers can choose which
+            kinds of tasks to run
+        poll_interval (float) seconds between checks for finished tasks
+    """
+    def __init__(self, db_engine, experiment_hash, pool, poll_interval=1):
+        self.db_engine = db_engine
+        self.experiment_hash = experiment_hash
+        self.pool = pool
+        self.poll_interval = poll_interval
+        self._callbacks = {}
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._poller = threading.Thread(target=self._poll)
+        self._poller.daemon = True
+        self._poller.start()
+
+    def apply_async(self, func, args=(), kwds=None, callback=None, error_callback=None):
+        """Queue a task to be run by a worker
+
+        Args:
+            func (callable) a picklable function
+            args (tuple) positional arguments to call the function with
+            kwds (dict, optional) keyword arguments to call the function with
+            callback (callable, optional) called with the result of the function
+            error_callback (callable, optional) called with an exception if the
+                function raised one
+        """
+        payload = pickle.dumps((func, tuple(args), kwds or {}))
+        with self.db_engine.begin() as conn:
+            task_id = conn.execute(
+                task_queue_table.insert().values(
+                    experiment_hash=self.experiment_hash,
+                    pool=self.pool,
+                    function_name=_function_name(func),
+                    payload=payload,
+                    status='pending',
+                    created_time=datetime.now(),
+                ).returning(task_queue_table.c.task_id)
+            ).scalar()
+        with self._lock:
+            self._callbacks[task_id] = (callback, error_callback)
+
+    def _poll(self):
+        while not self._stopped.wait(self.poll_interval):
+            try:
+                self._collect_finished()
+            except Exception:
+                logging.error('Error checking task queue: %s', traceback.format_exc())
+
+    def _collect_finished(self):
+        with self._lock:
+            task_ids = list(self._callbacks.keys())
+        if not task_ids:
+            return
+        with self.db_engine.begin() as conn:
+            rows = conn.execute(
+                select([
+                    task_queue_table.c.task_id,
+                    task_queue_table.c.status,
+                    task_queue_table.c.result,
+                    task_queue_table.c.error,
+                    task_queue_table.c.worker,
+                ])
+                .where(task_queue_table.c.task_id.in_(task_ids))
+                .where(task_queue_table.c.status.in_(['done', 'failed']))
+            ).fetchall()
+            if rows:
+                conn.execute(
+                    task_queue_table.delete()
+                    .where(task_queue_table.c.task_id.in_([row.task_id for row in rows]))
+                )
+        for row in rows:
+            with self._lock:
+                callback, error_callback = self._callbacks.pop(row.task_id)
+            if row.status == 'done':
+                try:
+                    result = pickle.loads(row.result)
+                except Exception as error:
+                    if error_callback:
+                        error_callback(error)
+                    continue
+                if callback:
+                    callback(result)
+            else:
+                logging.error('Task %s failed on %s: %s', row.task_id, row.worker, row.error)
+                if error_callback:
+                    error_callback(RuntimeError(
+                        'Task {} failed on {}'.format(row.task_id, row.worker)
+                    ))
+
+    def terminate(self):
+        """Stop collecting results and remove any tasks not yet claimed by
+        a worker from the queue
+
+        Tasks being run are locked by their workers until they finish, so
+        they are skipped rather than waited for.
+        """
+        self._stopped.set()
+        with self._lock:
+            task_ids = list(self._callbacks.keys())
+            self._callbacks = {}
+        if task_ids:
+            unclaimed_task_ids = (
+                select([task_queue_table.c.task_id])
+                .where(task_queue_table.c.task_id.in_(task_ids))
+                .where(task_queue_table.c.status == 'pending')
+                .with_for_update(skip_locked=True)
+            )
+            with self.db_engine.begin() as conn:
+                conn.execute(
+                    task_queue_table.delete()
+                    .where(task_queue_table.c.task_id.in_(unclaimed_task_ids))
+                )
+
+    def join(self):
+        self._poller.join()
+
+
+def run_next_task(db_engine, experiment_hash=None, pools=None):
+    """Claim the oldest pending task from the queue and run it
+
+    The task's row stays locked (``FOR UPDATE``) in an open transaction
+    while it runs, so other workers skip it, and if this worker dies
+    before finishing, the lock is released and another worker runs it.
+
+    Args:
+        db_engine (sqlalchemy.engine)
+        experiment_hash (string, optional) only run tasks of this experiment
+        pools (list, optional) only run tasks queued in these pools
+
+    Returns: (bool) whether a task was found to run
+    """
+    query = (
+        select([task_queue_table.c.task_id, task_queue_table.c.payload])
+        .where(task_queue_table.c.status == 'pending')
+        .order_by(task_queue_table.c.task_id)
+        .limit(1)
+        .with_for_update(skip_locked=True)
+    )
+    if experiment_hash:
+        query = query.where(task_queue_table.c.experiment_hash == experiment_hash)
+    if pools:
+        query = query.where(task_queue_table.c.pool.in_(list(pools)))
+
+    with db_engine.begin() as conn:
+        row = conn.execute(query).first()
+        if row is None:
+            return False
+        logging.info('Running queued task %s', row.task_id)
+        values = {'worker': '{}:{}'.format(socket.gethostname(), os.getpid())}
+        try:
+            func, args, kwds = pickle.loads(row.payload)
+            values['result'] = pickle.dumps(func(*args, **kwds))
+            values['status'] = 'done'
+        except Exception:
+            logging.error('Child error: %s', traceback.format_exc())
+            values['error'] = traceback.format_exc()
+            values['status'] = 'failed'
+        values['finished_time'] = datetime.now()
+        conn.execute(
+            task_queue_table.update()
+            .where(task_queue_table.c.task_id == row.task_id)
+            .values(**values)
+        )
+    return True
+
+
+def run_worker(
+    db_connection_string,
+    experiment_hash=None,
+    pools=None,
+    poll_interval=5,
+    max_idle_time=None,
+):
+    """Run tasks from the queue, one at a time, until stopped
+
+    Args:
+        db_connection_string (string or sqlalchemy.engine.url.URL)
+        experiment_hash (string, optional) only run tasks of this experiment
+        pools (list, optional) only run tasks queued in these pools
+        poll_interval (float) seconds to wait before checking again when
+            no tasks are pending
+        max_idle_time (float, optional) if given, stop after this many
+            seconds without a task to run
+    """
+    db_engine = worker_db_engine(db_connection_string)
+    last_task_time = time.time()
+    while True:
+        if run_next_task(db_engine, experiment_hash, pools):
+            last_task_time = time.time()
+            continue
+        if max_idle_time is not None and time.time() - last_task_time > max_idle_time:
+            logging.info('No tasks for %s seconds, stopping worker', max_idle_time)
+            return
+        time.sleep(poll_interval)
+
+
+def run_workers(n_processes, db_connection_string, **kwargs):
+    """Start several worker processes on this machine and wait for them
+    to stop. Keyword arguments are passed to ``run_worker``
+    """
+    workers = [
+        multiprocessing.Process(
+            target=run_worker,
+            args=(db_connection_string,),
+            kwargs=kwargs
+        )
+        for _ in range(n_processes)
+    ]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+
+class DistributedExperiment(MultiCoreExperiment):
+    """An experiment that runs its tasks on worker processes on any number
+    of machines, connected only by the results database.
+
+    Tasks are planned in this process as in ``MultiCoreExperiment``, and
+    instead of being sent to local pools are written to the
+    results.task_queue table, from which workers started with
+    ``run_worker`` (or ``python -m triage.experiments.distributed``)
+    claim them. Workers need access to the same project path (for
+    instance, an S3 bucket or a shared filesystem) as the experiment.
+
+    n_processes and n_db_processes bound the number of matrix building and
+    training tasks, and feature and testing tasks, that are queued at once,
+    so are best set to the total number of workers across all machines.
+    """
+
+    def __init__(self, *args, poll_interval=1, **kwargs):
+        # workers on other machines can't map matrices copied to a local
+        # directory, so they read them from the project path
+        kwargs.setdefault('share_matrices', False)
+        super(DistributedExperiment, self).__init__(*args, **kwargs)
+        self.poll_interval = poll_interval
+
+    @property
+    def pools(self):
+        """Task queues, keyed by the kind of task they run
+
+        Returns: (dict) of 'cpu' and 'db' DatabaseTaskQueues
+        """
+        if self._pools is None:
+            logging.info('Queueing tasks in results.task_queue')
+            self._pools = {
+                pool: DatabaseTaskQueue(
+                    self.db_engine,
+                    self.experiment_hash,
+                    pool,
+                    poll_interval=self.poll_interval
+                )
+                for pool in ('cpu', 'db')
+            }
+        return self._pools
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description='Run queued triage experiment tasks')
+    parser.add_argument('db_connection_string')
+    parser.add_argument('--processes', type=int, default=1)
+    parser.add_argument('--experiment-hash')
+    parser.add_argument('--pool', action='append', dest='pools')
+    parser.add_argument('--poll-interval', type=float, default=5)
+    parser.add_argument('--max-idle-time', type=float)
+    arguments = parser.parse_args()
+    run_workers(
+        arguments.processes,
+        arguments.db_connection_string,
+        experiment_hash=arguments.experiment_hash,
+        pools=arguments.pools,
+        poll_interval=arguments.poll_interval,
+        max_idle_time=arguments.max_idle_time,
+    )
@@ -0,0 +1,197 @@
+import logging
+from collections import OrderedDict
+
+from descriptors import cachedproperty
+
+from triage.component.architect.utils import explain_row_estimate
+
+
+# a rough average of the characters taken up by one value in a CSV matrix,
+# including the delimiter
+ESTIMATED_BYTES_PER_VALUE = 10
+
+
+class ExperimentCostEstimator(object):
+    """Estimates the amount of work each stage of an experiment will do,
+    without doing it
+
+    Row counts come from the Postgres planner's estimates for the state and
+    label queries, and feature columns from the aggregation configuration,
+    so no feature tables need to be built. Since features created by
+    imputation are not known until the feature tables are, matrix uuids and
+    column counts are those of matrices without imputation flag columns.
+
+    Args:
+        experiment (triage.experiments.ExperimentBase)
+    """
+    def __init__(self, experiment):
+        self.experiment = experiment
+
+    @property
+    def feature_inserts(self):
+        """Number of INSERT queries run to populate each feature table
+
+        Returns: (OrderedDict) feature table names to numbers of queries
+        """
+        feature_generator = self.experiment.feature_generator
+        inserts = OrderedDict()
+        for aggregation in self.experiment.collate_aggregations:
+            for group in aggregation.groups:
+                table_name = feature_generator._clean_table_name(
+                    aggregation.get_table_name(group=group)
+                )
+                inserts[table_name] = len(aggregation.dates)
+        return inserts
+
+    @cachedproperty
+    def feature_dictionary(self):
+        """The feature tables and columns the experiment's aggregations will
+        create, found from their configuration
+
+        Returns: (dict) imputed feature table names to lists of feature names
+        """
+        feature_generator = self.experiment.feature_generator
+        return dict(
+            (
+                feature_generator._clean_table_name(
+                    aggregation.get_table_name(imputed=True)
+                ),
+                sorted(aggregation.get_imputation_rules().keys())
+            )
+            for aggregation in self.experiment.collate_aggregations
+        )
+
+    @cachedproperty
+    def sparse_state_rows(self):
+        """Estimated number of rows in the sparse state table"""
+        return explain_row_estimate(
+            self.experiment.db_engine,
+            self.experiment.state_table_generator.sparse_table_query_func(
+                self.experiment.all_as_of_times
+            )
+        )
+
+    @cachedproperty
+    def label_rows(self):
+        """Estimated number of label rows for each as of time and timespan
+
+        Returns: (dict) (as of time, label timespan) tuples to row counts
+        """
+        return dict(
+            (
+                (as_of_time, label_timespan),
+                explain_row_estimate(
+                    self.experiment.db_engine,
+                    self.experiment.label_generator.label_query(as_of_time, label_timespan)
+                )
+            )
+            for as_of_time in self.experiment.all_as_of_times
+            for label_timespan in self.experiment.all_label_timespans
+        )
+
+    @cachedproperty
+    def matrix_plans(self):
+        """Matrix definitions and build tasks planned with the estimated
+        feature dictionary
+
+        Returns: (tuple) of split definitions and matrix build tasks
+        """
+        feature_dicts = self.experiment.feature_group_mixer.generate(
+            self.experiment.feature_group_creator.subsets(self.feature_dictionary)
+        )
+        return self.experiment.planner.generate_plans(
+            self.experiment.split_definitions,
+            feature_dicts
+        )
+
+    @cachedproperty
+    def matrices(self):
+        """Estimated size of each matrix
+
+        Training matrices have a row for each labeled entity as of each of
+        their as of times, and testing matrices a row for each entity in the
+        state table. Matrices stored as views of others take no bytes.
+
+        Returns: (OrderedDict) matrix uuids to dicts with the matrix type and
+            its estimated rows, columns, and bytes on disk
+        """
+        state_rows_per_as_of_time = (
+            float(self.sparse_state_rows) / max(len(self.experiment.all_as_of_times), 1)
+        )
+        _, build_tasks = self.matrix_plans
+        matrices = OrderedDict()
+        for matrix_uuid, build_task in sorted(build_tasks.items()):
+            metadata = build_task['matrix_metadata']
+            if build_task['matrix_type'] == 'train':
+                rows = sum(
+                    self.label_rows.get((as_of_time, metadata['label_timespan']), 0)
+                    for as_of_time in build_task['as_of_times']
+                )
+            else:
+                rows = int(state_rows_per_as_of_time * len(build_task['as_of_times']))
+            # entity_id and as_of_date, the features, and the label
+            columns = 2 + len(metadata['feature_names']) + 1
+            matrices[matrix_uuid] = {
+                'matrix_type': build_task['matrix_type'],
+                'rows': rows,
+                'columns': columns,
+                'bytes': 0 if build_task.get('source_matrix_uuid')
+                else rows * columns * ESTIMATED_BYTES_PER_VALUE,
+            }
+        return matrices
+
+    @property
+    def models_per_train_matrix(self):
+        """Number of models trained on each train matrix, from the grid config"""
+        from sklearn.model_selection import ParameterGrid
+        return sum(
+            len(ParameterGrid(parameter_config))
+            for parameter_config in self.experiment.config['grid_config'].values()
+        )
+
+    @property
+    def splits(self):
+        """Estimated models and prediction rows for each matrix set
+
+        Returns: (list) of dicts with the train matrix uuid and the number of
+            models and prediction rows
+        """
+        split_definitions, _ = self.matrix_plans
+        return [
+            {
+                'train_uuid': split['train_uuid'],
+                'models': self.models_per_train_matrix,
+                'prediction_rows': self.models_per_train_matrix * sum(
+                    self.matrices[test_uuid]['rows'] for test_uuid in split['test_uuids']
+                ),
+            }
+            for split in split_definitions
+        ]
+
+    def estimate(self):
+        """Estimate the cost of each stage of the experiment
+
+        Returns: (dict) with keys:
+            'feature_inserts' (dict) feature table names to INSERT queries
+            'sparse_state_rows' (int)
+            'label_rows' (int)
+            'matrices' (dict) matrix uuids to estimated sizes
+            'splits' (list) estimated models and predictions per matrix set
+            'total_matrix_bytes' (int)
+            'total_models' (int)
+            'total_prediction_rows' (int)
+        """
+        logging.info('Estimating experiment costs')
+        splits = self.splits
+        return {
+            'feature_inserts': self.feature_inserts,
+            'sparse_state_rows': self.sparse_state_rows,
+            'label_rows': sum(self.label_rows.values()),
+            'matrices': self.matrices,
+            'splits': splits,
+            'total_matrix_bytes': sum(
+                matrix['bytes'] for matrix in self.matrices.values()
+            ),
+            'total_models': sum(split['models'] for split in splits),
+            'total_prediction_rows': sum(split['prediction_rows'] for split in splits),
+        }
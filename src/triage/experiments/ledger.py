@@ -0,0 +1,88 @@
+import logging
+from datetime import datetime
+
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert
+
+from triage.component.results_schema import CompletedTask
+
+
+completed_tasks_table = CompletedTask.__table__
+
+
+class CompletionLedger(object):
+    """A record of the experiment tasks (feature tables, matrices, models,
+    and evaluations) that have completed, in the results.completed_tasks
+    table, so a restarted experiment can skip them all at once instead of
+    checking for each one's output
+
+    Tasks are recorded for the experiment that ran them, and only count as
+    completed for that experiment. Each is recorded with a fingerprint of
+    its inputs, and only counts as completed if the fingerprint matches.
+
+    Args:
+        db_engine (sqlalchemy.engine)
+        experiment_hash (string) the experiment recording the tasks
+    """
+    def __init__(self, db_engine, experiment_hash):
+        self.db_engine = db_engine
+        self.experiment_hash = experiment_hash
+        self._completed = None
+
+    def load(self):
+        """Read all recorded tasks in one query"""
+        with self.db_engine.begin() as conn:
+            rows = conn.execute(
+                select([
+                    completed_tasks_table.c.task_type,
+                    completed_tasks_table.c.task_key,
+                    completed_tasks_table.c.fingerprint,
+                ])
+                .where(completed_tasks_table.c.experiment_hash == self.experiment_hash)
+            ).fetchall()
+        self._completed = dict(
+            ((row.task_type, row.task_key), row.fingerprint)
+            for row in rows
+        )
+        logging.info('Found %s completed tasks in ledger', len(self._completed))
+
+    def is_complete(self, task_type, task_key, fingerprint):
+        """Whether a task has been recorded as completed with the same inputs
+
+        Args:
+            task_type (string) the kind of task, e.g. 'matrix'
+            task_key (string) identifies the task among those of its type
+            fingerprint (string) a hash of the task's inputs
+
+        Returns: (bool)
+        """
+        if self._completed is None:
+            self.load()
+        return self._completed.get((task_type, str(task_key))) == fingerprint
+
+    def record(self, task_type, task_key, fingerprint):
+        """Record a task as completed, replacing any earlier record of it
+
+        Args:
+            task_type (string) the kind of task, e.g. 'matrix'
+            task_key (string) identifies the task among those of its type
+            fingerprint (string) a hash of the task's inputs
+        """
+        statement = insert(completed_tasks_table).values(
+            task_type=task_type,
+            task_key=str(task_key),
+            fingerprint=fingerprint,
+            experiment_hash=self.experiment_hash,
+            completed_time=datetime.now(),
+        )
+        statement = statement.on_conflict_do_update(
+            index_elements=['experiment_hash', 'task_type', 'task_key'],
+            set_={
+                'fingerprint': statement.excluded.fingerprint,
+                'completed_time': statement.excluded.completed_time,
+            }
+        )
+        with self.db_engine.begin() as conn:
+            conn.execute(statement)
+        if self._completed is not None:
+            self._completed[(task_type, str(task_key))] = fingerprint
@@ -1,166 +1,488 @@
 import logging
+import os
+import threading
 import traceback
+from collections import OrderedDict, defaultdict
 from functools import partial
 from multiprocessing import Pool
+from multiprocessing.pool import ThreadPool
 
 from sqlalchemy import create_engine
+from sqlalchemy.pool import QueuePool
+from timeout import timeout
 
-from triage.component.catwalk.utils import Batch
-from triage.component.catwalk.storage import InMemoryModelStorageEngine
+from triage.component.catwalk.utils import (
+    Batch,
+    filename_friendly_hash,
+    retrieve_model_ids_from_hashes,
+)
 
 from triage.experiments import ExperimentBase
+from triage.experiments.ledger import CompletionLedger
+from triage.experiments.task_graph import TaskGraph
+from triage.experiments.telemetry import file_output, table_output, task_telemetry
 
 
 class MultiCoreExperiment(ExperimentBase):
+    """An experiment that runs its tasks in parallel, each as soon as the
+    tasks it depends on are done.
 
-    def __init__(self, n_processes=1, n_db_processes=1, *args, **kwargs):
+    Label generation overlaps with feature generation, and each split's
+    models are trained and tested as soon as its matrices are built, while
+    the matrices for later splits are still building.
+
+    Database-bound tasks (feature queries and testing) use n_db_processes,
+    and the rest (matrix building and training) use n_processes. The worker
+    pools are started on first use and reused for every phase of the
+    experiment until ``close_pools`` is called (which ``run`` does when
+    finished).
+
+    If db_threads is True, the database-bound tasks are run in threads of
+    this process instead, sharing one engine whose connection pool has a
+    connection for each thread. Since these tasks mostly wait on Postgres,
+    this makes dozens of them cheap to run at once, without a process (and
+    its own imports and connections) for each.
+
+    Unless share_matrices is False, each split's train and test matrices
+    are read once in this process and copied into memory-mapped files in
+    a temporary directory, which the training and testing workers map
+    instead of each reading and parsing the matrix, so all of them share
+    one copy of it in memory. The copies of a split's matrices are removed
+    once its models are tested, unless another split still uses them.
+    While this process copies one split's
+    matrices, those of the splits after it that are already built are read
+    in the background, up to max_prefetched_matrices at a time.
+
+    If a memory_budget (in bytes) is given, matrix building and training
+    tasks are started only while the estimated memory of those running
+    adds up to less than it, estimated from each matrix's number of rows
+    and columns. So fewer of these tasks run at once when matrices are
+    large, up to n_processes when they are small.
+
+    Completed feature tables, matrices, models, and evaluations are
+    recorded in a ledger (results.completed_tasks), and if replace is False,
+    ones already recorded with the same inputs are skipped without
+    checking the database or filesystem for each one, so an interrupted
+    experiment can be restarted where it left off.
+    """
+
+    def __init__(
+        self,
+        n_processes=1,
+        n_db_processes=1,
+        *args,
+        memory_budget=None,
+        db_threads=False,
+        share_matrices=True,
+        **kwargs
+    ):
         super(MultiCoreExperiment, self).__init__(*args, **kwargs)
         self.n_processes = n_processes
         self.n_db_processes = n_db_processes
+        self.memory_budget = memory_budget
+        self.db_threads = db_threads
+        self.share_matrices = share_matrices
+        self._pools = None
+        self._matrix_broker = None
+        self._matrix_prefetcher = None
+        # the splits yet to finish with each shared matrix, and the testing
+        # tasks of each split, for removing the copies once they're unused
+        self._splits_using_matrix = defaultdict(set)
+        self._split_test_keys = defaultdict(list)
+        self.ledger = CompletionLedger(self.db_engine, self.experiment_hash)
+        from triage.component.catwalk.storage import InMemoryModelStorageEngine
         if kwargs['model_storage_class'] == InMemoryModelStorageEngine:
             raise ValueError('''
                 InMemoryModelStorageEngine not compatible with MultiCoreExperiment
             ''')
 
-    def catwalk(self):
-        for split_num, split in enumerate(self.full_matrix_definitions):
-            self.log_split(split_num, split)
-            train_store = self.matrix_store(split['train_uuid'])
-            logging.info('Checking out train matrix')
-            if train_store.empty:
-                logging.warning('''Train matrix for split %s was empty,
-                no point in training this model. Skipping
-                ''', split['train_uuid'])
-                continue
-            logging.info('Checking out train labels')
-            if len(train_store.labels().unique()) == 1:
-                logging.warning('''Train Matrix for split %s had only one
-                unique value, no point in training this model. Skipping
-                ''', split['train_uuid'])
+    @property
+    def pools(self):
+        """Worker pools, keyed by the kind of task they run
+
+        Returns: (dict) of 'cpu' and 'db' multiprocessing.Pools (the 'db'
+            one a ThreadPool if db_threads is set)
+        """
+        if self._pools is None:
+            logging.info(
+                'Starting worker pools with %s processes and %s database %s',
+                self.n_processes,
+                self.n_db_processes,
+                'threads' if self.db_threads else 'processes'
+            )
+            self._pools = {'cpu': Pool(self.n_processes)}
+            if self.db_threads:
+                # create the engine the threads share, with enough
+                # connections for all of them
+                worker_db_engine(self.db_engine.url, pool_size=self.n_db_processes)
+                self._pools['db'] = ThreadPool(self.n_db_processes)
+            else:
+                self._pools['db'] = Pool(self.n_db_processes)
+        return self._pools
+
+    def close_pools(self):
+        """Shut down the worker pools, if any have been started"""
+        if self._pools is None:
+            return
+        logging.info('Shutting down worker pools')
+        for pool in self._pools.values():
+            pool.terminate()
+        for pool in self._pools.values():
+            pool.join()
+        self._pools = None
+
+    @property
+    def matrix_broker(self):
+        """The broker that copies matrices to share with workers, created
+        on first use and removed with its copies once the tasks using them
+        are run"""
+        if self._matrix_broker is None:
+            from triage.component.catwalk.storage import MatrixBroker
+            self._matrix_broker = MatrixBroker()
+        return self._matrix_broker
+
+    @property
+    def split_matrix_prefetcher(self):
+        """The prefetcher that reads the matrices of the next splits while
+        this process shares those of the current one, created on first use
+        and closed once the tasks using them are run"""
+        if self._matrix_prefetcher is None:
+            self._matrix_prefetcher = self.matrix_prefetcher()
+        return self._matrix_prefetcher
+
+    def _prefetch_matrices(self, task_graph, split_num, matrix_uuids):
+        """Start reading the given matrices of a split, then those of the
+        splits after it, skipping any not built yet"""
+        from triage.component.catwalk.storage import MemmapMatrixStore
+        if not self.share_matrices or issubclass(self.matrix_store_class, MemmapMatrixStore):
+            # workers read the matrices themselves, or map them as they are
+            return
+        matrix_uuids = list(matrix_uuids) + [
+            matrix_uuid
+            for split in self.full_matrix_definitions[split_num + 1:]
+            for matrix_uuid in [split['train_uuid']] + split['test_uuids']
+        ]
+        self.split_matrix_prefetcher.prefetch([
+            matrix_uuid for matrix_uuid in matrix_uuids
+            if ('matrix', matrix_uuid) not in task_graph
+            or ('matrix', matrix_uuid) in task_graph.finished
+        ])
+
+    def shared_matrix_store(self, matrix_store):
+        """The matrix store to give to workers in place of the given one"""
+        if not self.share_matrices:
+            return matrix_store
+        return self.matrix_broker.share(matrix_store)
+
+    def run_task_graph(self, task_graph):
+        logging.info('Running %s planned tasks', len(task_graph))
+        try:
+            # keep each pool busy while holding the rest of the ready tasks in
+            # the graph, rather than queueing all of them up in the pool at once
+            task_graph.run(
+                self.pools,
+                max_in_flight={
+                    'cpu': 2 * self.n_processes,
+                    'db': 2 * self.n_db_processes,
+                },
+                wrap_task=self._with_telemetry,
+                memory_budget={'cpu': self.memory_budget} if self.memory_budget else None
+            )
+        finally:
+            if self._matrix_prefetcher is not None:
+                self._matrix_prefetcher.close()
+                self._matrix_prefetcher = None
+            if self._matrix_broker is not None:
+                self._matrix_broker.close()
+                self._matrix_broker = None
+
+    def _with_telemetry(self, task):
+        """Wrap a task's function to record its telemetry where it runs"""
+        if isinstance(task.key, tuple):
+            task_key = '/'.join(str(part) for part in task.key[1:])
+        else:
+            task_key = task.key
+        return TelemetryTask(
+            task.function,
+            task.task_type,
+            task_key,
+            self.experiment_hash,
+            self.db_engine.url,
+            measure=self._telemetry_measure(task)
+        )
+
+    def _telemetry_measure(self, task):
+        """A function to find the rows and bytes written by a task, if known"""
+        if task.key == 'sparse_states':
+            return partial(table_output, table_name=self.state_table_generator.sparse_table_name)
+        if task.key == 'labels':
+            return partial(table_output, table_name=self.labels_table_name)
+        if task.task_type in ('feature_finalize', 'imputation'):
+            table_name = task.key[1]
+            if task.task_type == 'imputation':
+                # the imputed table of an aggregation is named after it
+                table_name += '_imputed'
+            return partial(
+                table_output,
+                table_name='{}."{}"'.format(self.features_schema_name, table_name)
+            )
+        if task.task_type == 'matrix':
+            return partial(
+                file_output,
+                path=self.matrix_store(task.key[1]).matrix_path
+            )
+
+    def _is_completed(self, task_type, task_key, fingerprint):
+        """Whether a task can be skipped because the ledger shows it was
+        completed with the same inputs"""
+        return not self.replace and self.ledger.is_complete(task_type, task_key, fingerprint)
+
+    def _matrix_fingerprint(self, matrix_uuid):
+        """A hash of what a matrix is built from, and where it is stored"""
+        return filename_friendly_hash({
+            'build_task': self.matrix_build_tasks[matrix_uuid],
+            'matrices_directory': self.matrices_directory,
+            'matrix_format': self.matrix_format,
+            'compact_dtypes': self.compact_dtypes,
+        })
+
+    def _matrix_is_completed(self, matrix_uuid):
+        """Whether a matrix can be skipped because the ledger shows it was
+        built from the same inputs, and its files are still there"""
+        if not self._is_completed('matrix', matrix_uuid, self._matrix_fingerprint(matrix_uuid)):
+            return False
+        matrix_store = self.matrix_store(matrix_uuid)
+        return all(
+            os.path.exists(path)
+            for path in (matrix_store.metadata_path, matrix_store.matrix_path)
+            # views have no matrix file of their own
+            if path is not None
+        )
+
+    def _model_fingerprint(self, trainer_task):
+        """A hash of what a model is trained from, and where it is stored"""
+        return filename_friendly_hash({
+            'class_path': trainer_task['class_path'],
+            'parameters': trainer_task['parameters'],
+            'train_matrix': self._matrix_fingerprint(trainer_task['matrix_store'].uuid),
+            'project_path': self.project_path,
+        })
+
+    def _model_is_completed(self, trainer_task):
+        """Whether a model can be skipped because the ledger shows it was
+        trained from the same inputs, and it is still stored"""
+        return self._is_completed(
+            'model',
+            trainer_task['model_hash'],
+            self._model_fingerprint(trainer_task)
+        ) and self.model_storage_engine.get_store(trainer_task['model_hash']).exists()
+
+    def _record_result(self, task_type, task_key, fingerprint, result):
+        """Record a task in the ledger if it succeeded"""
+        if result:
+            self.ledger.record(task_type, task_key, fingerprint)
+
+    def _record_if_all_succeeded(self, task_graph, task_type, task_key, fingerprint, keys):
+        """Record a group of tasks in the ledger if none of them failed"""
+        if not any(key in task_graph.failed for key in keys):
+            self.ledger.record(task_type, task_key, fingerprint)
+
+    def build_matrices(self, task_graph=None):
+        """Generate labels, features, and matrices
+
+        Args:
+            task_graph (TaskGraph, optional) a graph to add the tasks to, to be
+                run later alongside others. If not given, they are run now.
+        """
+        run_now = task_graph is None
+        if run_now:
+            task_graph = TaskGraph()
+
+        task_graph.add_task(
+            'sparse_states',
+            generate_sparse_states,
+            args=(
+                self.all_as_of_times,
+                self.state_table_generator_factory,
+                self.db_engine.url,
+            ),
+            pool='db'
+        )
+        task_graph.add_task(
+            'labels',
+            generate_labels,
+            args=(
+                self.labels_table_name,
+                self.all_as_of_times,
+                self.all_label_timespans,
+                self.label_generator_factory,
+                self.db_engine.url,
+            ),
+            pool='db'
+        )
+
+        imputation_keys = []
+        imputation_table_tasks = OrderedDict()
+        for aggregation_config, aggregation in zip(
+            self.config['feature_aggregations'],
+            self.collate_aggregations
+        ):
+            aggregation_table_name = self.feature_generator._clean_table_name(
+                aggregation.get_table_name()
+            )
+            imputed_table_name = self.feature_generator._clean_table_name(
+                aggregation.get_table_name(imputed=True)
+            )
+            imputation_keys.append(('imputation', aggregation_table_name))
+            fingerprint = filename_friendly_hash({
+                'aggregation': aggregation_config,
+                'as_of_times': sorted(self.all_as_of_times),
+            })
+            if self._is_completed('features', imputed_table_name, fingerprint):
+                logging.info('Skipping completed feature tables for %s', imputed_table_name)
+                imputation_table_tasks[aggregation_table_name] = OrderedDict([
+                    (imputed_table_name, {})
+                ])
+                task_graph.add_task(('imputation', aggregation_table_name))
                 continue
 
-            logging.info('Training models')
-            trainer_tasks = self.trainer.generate_train_tasks(
-                grid_config=self.config['grid_config'],
-                misc_db_parameters=dict(
-                    test=False,
-                    model_comment=self.config.get('model_comment', None),
+            table_tasks = self.feature_generator.generate_all_table_tasks(
+                [aggregation],
+                task_type='aggregation'
+            )
+            # the group tables come first, followed by the
+            # aggregation table that joins them together
+            group_table_names = list(table_tasks.keys())[:-1]
+            feature_keys = []
+            for table_name in group_table_names:
+                feature_keys += self._add_feature_table_tasks(
+                    task_graph,
+                    table_name,
+                    table_tasks[table_name],
+                    dependencies=['sparse_states']
+                )
+            feature_keys += self._add_feature_table_tasks(
+                task_graph,
+                aggregation_table_name,
+                table_tasks[aggregation_table_name],
+                dependencies=['sparse_states'] + [
+                    ('feature_finalize', table_name) for table_name in group_table_names
+                ]
+            )
+            task_graph.add_task(
+                ('imputation_plan', aggregation_table_name),
+                partial(
+                    self._add_imputation_tasks,
+                    task_graph,
+                    aggregation,
+                    aggregation_table_name,
+                    imputation_table_tasks
                 ),
-                matrix_store=train_store
+                dependencies=[('feature_finalize', aggregation_table_name)]
             )
-            partial_train_models = partial(
-                train_model,
-                trainer_factory=self.trainer_factory,
-                db_connection_string=self.db_engine.url
+            imputation_table_tasks[aggregation_table_name] = OrderedDict()
+            feature_keys.append(('imputation', aggregation_table_name))
+            task_graph.add_task(
+                ('features_done', aggregation_table_name),
+                partial(
+                    self._record_if_all_succeeded,
+                    task_graph,
+                    'features',
+                    imputed_table_name,
+                    fingerprint,
+                    feature_keys
+                ),
+                dependencies=feature_keys
             )
-            logging.info(
-                'Starting parallel training: %s tasks, %s processes',
-                len(trainer_tasks),
-                self.n_processes
+
+        task_graph.add_task(
+            'matrix_plan',
+            partial(self._add_matrix_build_tasks, task_graph, imputation_table_tasks),
+            # estimating the size of matrices needs the labels
+            dependencies=imputation_keys + (['labels'] if self.memory_budget else [])
+        )
+
+        if run_now:
+            self.run_task_graph(task_graph)
+
+    def _add_feature_table_tasks(self, task_graph, table_name, tasks, dependencies):
+        """Add the prepare, insert, and finalize steps of one feature table
+
+        Returns: (list) keys of the added tasks
+        """
+        partial_insert = partial(
+            insert_into_table,
+            feature_generator_factory=self.feature_generator_factory,
+            db_connection_string=self.db_engine.url
+        )
+        prepare_key = ('feature_prepare', table_name)
+        task_graph.add_task(
+            prepare_key,
+            partial_insert if tasks.get('prepare') else None,
+            args=(tasks.get('prepare', []),),
+            dependencies=dependencies,
+            pool='db' if tasks.get('prepare') else None
+        )
+        insert_keys = []
+        for batch_num, insert_batch in enumerate(Batch(tasks.get('inserts', []), 25)):
+            insert_key = ('feature_insert', table_name, batch_num)
+            task_graph.add_task(
+                insert_key,
+                partial_insert,
+                args=(list(insert_batch),),
+                dependencies=[prepare_key],
+                pool='db'
             )
-            model_ids = []
-            for batch_model_ids in self.parallelize(
-                partial_train_models,
-                trainer_tasks,
-                self.n_processes
-            ):
-                model_ids += batch_model_ids
-            logging.info('Done training models')
-
-            for split_def, test_uuid in zip(
-                split['test_matrices'],
-                split['test_uuids']
-            ):
-                as_of_times = split_def['as_of_times']
-                logging.info(
-                    'Testing and scoring as_of_times min: %s max: %s num: %s',
-                    min(as_of_times),
-                    max(as_of_times),
-                    len(as_of_times)
-                )
-                test_store = self.matrix_store(test_uuid)
-                if test_store.empty:
-                    logging.warning('''Test matrix for train uuid %s
-                    was empty, no point in training this model. Skipping
-                    ''', split['train_uuid'])
-                    continue
-                partial_test_and_evaluate = partial(
-                    test_and_evaluate,
-                    predictor_factory=self.predictor_factory,
-                    evaluator_factory=self.evaluator_factory,
-                    indiv_importance_factory=self.indiv_importance_factory,
-                    test_store=test_store,
-                    db_connection_string=self.db_engine.url,
-                    split_def=split_def,
-                    train_matrix_columns=train_store.columns(),
-                    config=self.config
-                )
-                logging.info(
-                    'Starting parallel testing with %s processes',
-                    self.n_db_processes
-                )
-                self.parallelize_with_success_count(
-                    partial_test_and_evaluate,
-                    model_ids,
-                    self.n_db_processes
-                )
-                logging.info('Cleaned up concurrent pool')
-            logging.info('Done with test matrix')
-        logging.info('Done with split')
+            insert_keys.append(insert_key)
+        finalize_key = ('feature_finalize', table_name)
+        task_graph.add_task(
+            finalize_key,
+            partial_insert if tasks.get('finalize') else None,
+            args=(tasks.get('finalize', []),),
+            dependencies=[prepare_key] + insert_keys,
+            pool='db' if tasks.get('finalize') else None
+        )
+        return [prepare_key] + insert_keys + [finalize_key]
 
-    def parallelize_with_success_count(
+    def _add_imputation_tasks(
         self,
-        partially_bound_function,
-        tasks,
-        n_processes,
-        chunksize=1
+        task_graph,
+        aggregation,
+        aggregation_table_name,
+        imputation_table_tasks
     ):
-        num_successes = 0
-        num_failures = 0
-        for successful in self.parallelize(
-            partially_bound_function,
-            tasks,
-            n_processes,
-            chunksize
-        ):
-            if successful:
-                num_successes += 1
-            else:
-                num_failures += 1
-        logging.info(
-            'Done. successes: %s, failures: %s',
-            num_successes,
-            num_failures
-        )
-
-    def build_matrices(self):
-        logging.info('Creating sparse states')
-        self.generate_sparse_states()
-        logging.info('Creating labels')
-        self.generate_labels()
-        logging.info(
-            'Creating feature tables with %s processes',
-            self.n_db_processes
+        """Once an aggregation's tables are built, find its null columns
+        and add a task to build its imputation table"""
+        logging.info('Planning feature imputation for %s', aggregation_table_name)
+        table_tasks = self.feature_generator.generate_all_table_tasks(
+            [aggregation],
+            task_type='imputation'
         )
-        for table_name, tasks in self.feature_aggregation_table_tasks.items():
-            logging.info('Processing features for %s', table_name)
-            self.feature_generator.run_commands(tasks.get('prepare', []))
-            partial_insert = partial(
+        imputation_table_tasks[aggregation_table_name] = table_tasks
+        commands = [
+            command
+            for tasks in table_tasks.values()
+            for stage in ('prepare', 'inserts', 'finalize')
+            for command in tasks.get(stage, [])
+        ]
+        task_graph.add_task(
+            ('imputation', aggregation_table_name),
+            partial(
                 insert_into_table,
                 feature_generator_factory=self.feature_generator_factory,
                 db_connection_string=self.db_engine.url
-            )
-            self.parallelize_with_success_count(
-                partial_insert,
-                tasks.get('inserts', []),
-                n_processes=self.n_db_processes,
-                chunksize=25
-            )
-            self.feature_generator.run_commands(tasks.get('finalize', []))
-            logging.info('%s completed', table_name)
+            ) if commands else None,
+            args=(commands,),
+            pool='db' if commands else None
+        )
 
-        logging.info('Creating feature imputation tables')
-        self.feature_generator.process_table_tasks(self.feature_imputation_table_tasks)
+    def _add_matrix_build_tasks(self, task_graph, imputation_table_tasks):
+        """Once all feature tables are built, plan the matrices and add a
+        task to build each one"""
+        feature_imputation_table_tasks = OrderedDict()
+        for table_tasks in imputation_table_tasks.values():
+            feature_imputation_table_tasks.update(table_tasks)
+        self.feature_imputation_table_tasks = feature_imputation_table_tasks
 
         partial_build_matrix = partial(
             build_matrix,
@@ -168,29 +490,429 @@ class MultiCoreExperiment(ExperimentBase):
             db_connection_string=self.db_engine.url
         )
         logging.info(
-            'Starting parallel matrix building: %s matrices, %s processes',
-            len(self.matrix_build_tasks.keys()),
-            self.n_processes
+            'Adding matrix building tasks: %s matrices',
+            len(self.matrix_build_tasks.keys())
+        )
+        matrix_uuids = []
+        for matrix_uuid in self.matrix_build_tasks.keys():
+            if self._matrix_is_completed(matrix_uuid):
+                logging.info('Skipping completed matrix %s', matrix_uuid)
+                continue
+            matrix_uuids.append(matrix_uuid)
+        for matrix_uuid in matrix_uuids:
+            build_task = self.matrix_build_tasks[matrix_uuid]
+            dependencies = ['sparse_states', 'labels']
+            # a view of another matrix is ready once the other matrix is
+            if build_task.get('source_matrix_uuid') in matrix_uuids:
+                dependencies.append(('matrix', build_task['source_matrix_uuid']))
+            task_graph.add_task(
+                ('matrix', matrix_uuid),
+                partial_build_matrix,
+                args=([build_task],),
+                dependencies=dependencies,
+                pool='cpu',
+                callback=partial(
+                    self._record_result,
+                    'matrix',
+                    matrix_uuid,
+                    self._matrix_fingerprint(matrix_uuid)
+                ),
+                memory=self.planner.estimate_matrix_memory(**build_task)
+                if self.memory_budget else None
+            )
+
+        # matrices with the same rows share an entity-date table, made by
+        # whichever is built first and dropped once all of them are built
+        for table_name, table_matrix_uuids in self.entity_date_tables(matrix_uuids).items():
+            # one left by an earlier run may be out of date
+            self.planner.drop_entity_date_table(table_name)
+            task_graph.add_task(
+                ('entity_dates_cleanup', table_name),
+                partial(self.planner.drop_entity_date_table, table_name),
+                dependencies=[('matrix', matrix_uuid) for matrix_uuid in table_matrix_uuids]
+            )
+
+        # anything the builder keeps between matrices, such as the
+        # partitions of the partitioned builder, is removed once all are built
+        if self.replace:
+            # what it kept from an earlier run may be out of date
+            self.planner.clean_up_builder()
+        task_graph.add_task(
+            'builder_cleanup',
+            self.planner.clean_up_builder,
+            dependencies=[('matrix', matrix_uuid) for matrix_uuid in matrix_uuids]
         )
-        self.parallelize_with_success_count(
-            partial_build_matrix,
-            self.matrix_build_tasks.values(),
-            self.n_processes
+
+    def catwalk(self, task_graph=None):
+        """Train, test, and evaluate models
+
+        Args:
+            task_graph (TaskGraph, optional) a graph to add the tasks to, to be
+                run later alongside others. If it contains matrix building
+                tasks, each split waits only for its own matrices.
+                If not given, the tasks are run now.
+        """
+        run_now = task_graph is None
+        if run_now:
+            task_graph = TaskGraph()
+
+        if 'matrix_plan' in task_graph:
+            task_graph.add_task(
+                'model_plan',
+                partial(self._add_split_tasks, task_graph),
+                dependencies=['matrix_plan']
+            )
+        else:
+            self._add_split_tasks(task_graph)
+
+        if run_now:
+            self.run_task_graph(task_graph)
+
+    def _add_split_tasks(self, task_graph):
+        for split_num, split in enumerate(self.full_matrix_definitions):
+            for matrix_uuid in [split['train_uuid']] + split['test_uuids']:
+                self._splits_using_matrix[matrix_uuid].add(split_num)
+        for split_num, split in enumerate(self.full_matrix_definitions):
+            task_graph.add_task(
+                ('split', split_num),
+                partial(self._add_train_tasks, task_graph, split_num, split),
+                dependencies=[
+                    ('matrix', matrix_uuid)
+                    for matrix_uuid in [split['train_uuid']] + split['test_uuids']
+                    if ('matrix', matrix_uuid) in task_graph
+                ]
+            )
+
+    def _add_train_tasks(self, task_graph, split_num, split):
+        """Once a split's matrices are built, add a task to train each model"""
+        self.log_split(split_num, split)
+        train_store = self.split_matrix_prefetcher.get(split['train_uuid'])
+        self._prefetch_matrices(task_graph, split_num, split['test_uuids'])
+        logging.info('Checking out train matrix')
+        if train_store.empty:
+            logging.warning('''Train matrix for split %s was empty,
+            no point in training this model. Skipping
+            ''', split['train_uuid'])
+            self._release_split_matrices(split_num, split)
+            return
+        logging.info('Checking out train labels')
+        if len(train_store.label_counts()) == 1:
+            logging.warning('''Train Matrix for split %s had only one
+            unique value, no point in training this model. Skipping
+            ''', split['train_uuid'])
+            self._release_split_matrices(split_num, split)
+            return
+        # sized from the summary next to the built matrix, which the shared
+        # copy doesn't have
+        train_memory = self.trainer.estimate_memory(train_store) \
+            if self.memory_budget else None
+        train_store = self.shared_matrix_store(train_store)
+
+        test_stores = []
+        for test_num, (split_def, test_uuid) in enumerate(zip(
+            split['test_matrices'],
+            split['test_uuids']
+        )):
+            test_store = self.split_matrix_prefetcher.get(test_uuid)
+            self._prefetch_matrices(task_graph, split_num, split['test_uuids'][test_num + 1:])
+            if test_store.empty:
+                logging.warning('''Test matrix for train uuid %s
+                was empty, no point in training this model. Skipping
+                ''', split['train_uuid'])
+                continue
+            test_stores.append((split_def, test_uuid, self.shared_matrix_store(test_store)))
+
+        trainer_tasks = self.trainer.generate_train_tasks(
+            grid_config=self.config['grid_config'],
+            misc_db_parameters=dict(
+                test=False,
+                model_comment=self.config.get('model_comment', None),
+            ),
+            matrix_store=train_store
+        )
+        completed_model_hashes = [
+            trainer_task['model_hash'] for trainer_task in trainer_tasks
+            if self._model_is_completed(trainer_task)
+        ]
+        completed_model_ids = retrieve_model_ids_from_hashes(
+            self.db_engine,
+            completed_model_hashes
+        ) if completed_model_hashes else {}
+        trainer_tasks = [
+            trainer_task for trainer_task in trainer_tasks
+            if trainer_task['model_hash'] not in completed_model_ids
+        ]
+        partial_train_models = partial(
+            train_model,
+            trainer_factory=self.trainer_factory,
+            db_connection_string=self.db_engine.url
+        )
+        logging.info(
+            'Adding training tasks for split %s: %s tasks, %s already completed',
+            split_num,
+            len(trainer_tasks),
+            len(completed_model_ids)
+        )
+        train_matrix_columns = train_store.columns()
+        train_keys = []
+        for trainer_task in trainer_tasks:
+            train_key = ('train', split_num, trainer_task['model_hash'])
+            train_keys.append(train_key)
+            task_graph.add_task(
+                train_key,
+                partial_train_models,
+                args=([trainer_task],),
+                pool='cpu',
+                callback=partial(
+                    self._record_training,
+                    task_graph,
+                    split_num,
+                    test_stores,
+                    train_matrix_columns,
+                    trainer_task['model_hash'],
+                    self._model_fingerprint(trainer_task)
+                ),
+                memory=train_memory
+            )
+        if completed_model_ids:
+            self._add_test_tasks(
+                task_graph,
+                split_num,
+                test_stores,
+                train_matrix_columns,
+                list(completed_model_ids.values())
+            )
+        # the testing tasks are added as the models are trained
+        task_graph.add_task(
+            ('split_tests_planned', split_num),
+            partial(self._add_split_cleanup_task, task_graph, split_num, split),
+            dependencies=train_keys
+        )
+
+    def _add_split_cleanup_task(self, task_graph, split_num, split):
+        """Once a split's models are trained, add a task to remove the
+        shared copies of its matrices after they are tested"""
+        task_graph.add_task(
+            ('split_cleanup', split_num),
+            partial(self._release_split_matrices, split_num, split),
+            dependencies=self._split_test_keys.pop(split_num, [])
+        )
+
+    def _release_split_matrices(self, split_num, split):
+        """Remove the shared copies of a split's matrices, except those
+        that another split still has to use"""
+        for matrix_uuid in [split['train_uuid']] + split['test_uuids']:
+            splits = self._splits_using_matrix[matrix_uuid]
+            splits.discard(split_num)
+            if not splits and self._matrix_broker is not None:
+                self._matrix_broker.release(matrix_uuid)
+
+    def _record_training(
+        self,
+        task_graph,
+        split_num,
+        test_stores,
+        train_matrix_columns,
+        model_hash,
+        model_fingerprint,
+        model_ids
+    ):
+        """Once a model is trained, record it and add its testing tasks"""
+        self._record_result('model', model_hash, model_fingerprint, model_ids)
+        self._add_test_tasks(
+            task_graph,
+            split_num,
+            test_stores,
+            train_matrix_columns,
+            model_ids
         )
 
-    def parallelize(
+    def _add_test_tasks(
+        self,
+        task_graph,
+        split_num,
+        test_stores,
+        train_matrix_columns,
+        model_ids
+    ):
+        """Once models are trained, add a task to test each one on each
+        of the split's test matrices"""
+        evaluation_fingerprint = filename_friendly_hash({
+            'scoring': self.config.get('scoring'),
+            'individual_importance': self.config.get('individual_importance'),
+        })
+        for split_def, test_uuid, test_store in test_stores:
+            as_of_times = split_def['as_of_times']
+            logging.info(
+                'Adding testing tasks for as_of_times min: %s max: %s num: %s',
+                min(as_of_times),
+                max(as_of_times),
+                len(as_of_times)
+            )
+            partial_test_and_evaluate = partial(
+                test_and_evaluate,
+                predictor_factory=self.predictor_factory,
+                evaluator_factory=self.evaluator_factory,
+                indiv_importance_factory=self.indiv_importance_factory,
+                test_store=test_store,
+                db_connection_string=self.db_engine.url,
+                split_def=split_def,
+                train_matrix_columns=train_matrix_columns,
+                config=self.config
+            )
+            for model_id in model_ids:
+                evaluation_key = '{}/{}'.format(model_id, test_uuid)
+                if self._is_completed('evaluation', evaluation_key, evaluation_fingerprint):
+                    logging.info('Skipping completed evaluation %s', evaluation_key)
+                    continue
+                test_key = ('test', split_num, test_uuid, model_id)
+                self._split_test_keys[split_num].append(test_key)
+                task_graph.add_task(
+                    test_key,
+                    partial_test_and_evaluate,
+                    args=([model_id],),
+                    pool='db',
+                    callback=partial(
+                        self._record_result,
+                        'evaluation',
+                        evaluation_key,
+                        evaluation_fingerprint
+                    )
+                )
+
+    def _run(self):
+        task_graph = TaskGraph()
+        try:
+            logging.info('Planning matrix building and model training tasks')
+            self.build_matrices(task_graph)
+            self.catwalk(task_graph)
+            self.run_task_graph(task_graph)
+        finally:
+            self.close_pools()
+            logging.info('Cleaning up state table')
+            with timeout(self.cleanup_timeout):
+                self.state_table_generator.clean_up()
+
+
+class TelemetryTask(object):
+    """A picklable wrapper around a task's function that records the task's
+    telemetry in whichever process runs it
+
+    Args:
+        func (callable) the task's function
+        task_type (string)
+        task_key (string)
+        experiment_hash (string)
+        db_connection_string (string or sqlalchemy.engine.url.URL)
+        measure (callable, optional) called with a database engine after a
+            successful task to find the rows and bytes it wrote
+    """
+    def __init__(
         self,
-        partially_bound_function,
-        tasks,
-        n_processes,
-        chunksize=1,
+        func,
+        task_type,
+        task_key,
+        experiment_hash,
+        db_connection_string,
+        measure=None
     ):
-        with Pool(n_processes) as pool:
-            for result in pool.map(
-                partially_bound_function,
-                [list(task_batch) for task_batch in Batch(tasks, chunksize)]
-            ):
-                yield result
+        self.func = func
+        self.task_type = task_type
+        self.task_key = task_key
+        self.experiment_hash = experiment_hash
+        self.db_connection_string = db_connection_string
+        self.measure = measure
+
+    def __call__(self, *args):
+        db_engine = worker_db_engine(self.db_connection_string)
+        with task_telemetry(
+            db_engine,
+            self.experiment_hash,
+            self.task_type,
+            self.task_key
+        ) as measurements:
+            result = self.func(*args)
+            if result and self.measure:
+                try:
+                    measurements['rows'], measurements['bytes_written'] = \
+                        self.measure(db_engine)
+                except Exception:
+                    logging.warning(
+                        'Could not measure output of %s %s: %s',
+                        self.task_type,
+                        self.task_key,
+                        traceback.format_exc()
+                    )
+        return result
+
+
+_db_engines = {}
+_db_engines_lock = threading.Lock()
+
+
+def worker_db_engine(db_connection_string, pool_size=None):
+    """Create a database engine for this worker process, or reuse the one
+    it created for a previous task so its connections are kept open
+
+    The engine is shared by all threads of the process.
+
+    Args:
+        db_connection_string (string or sqlalchemy.engine.url.URL)
+        pool_size (int, optional) the number of connections the engine
+            should keep open, if more than the default, for instance one
+            for each thread that will use it
+
+    Returns: (sqlalchemy.engine)
+    """
+    key = (os.getpid(), db_connection_string)
+    with _db_engines_lock:
+        db_engine = _db_engines.get(key)
+        if db_engine is not None and pool_size and not (
+            isinstance(db_engine.pool, QueuePool) and db_engine.pool.size() >= pool_size
+        ):
+            # too few connections for the threads that will share it
+            db_engine.dispose()
+            db_engine = None
+        if db_engine is None:
+            kwargs = {'poolclass': QueuePool, 'pool_size': pool_size} if pool_size else {}
+            db_engine = _db_engines[key] = create_engine(db_connection_string, **kwargs)
+        return db_engine
+
+
+def generate_sparse_states(
+    as_of_dates,
+    state_table_generator_factory,
+    db_connection_string
+):
+    try:
+        db_engine = worker_db_engine(db_connection_string)
+        state_table_generator = state_table_generator_factory(db_engine=db_engine)
+        state_table_generator.generate_sparse_table(as_of_dates=as_of_dates)
+        return True
+    except Exception:
+        logging.error('Child error: %s', traceback.format_exc())
+        raise
+
+
+def generate_labels(
+    labels_table_name,
+    as_of_dates,
+    label_timespans,
+    label_generator_factory,
+    db_connection_string
+):
+    try:
+        db_engine = worker_db_engine(db_connection_string)
+        label_generator = label_generator_factory(db_engine=db_engine)
+        label_generator.generate_all_labels(
+            labels_table_name,
+            as_of_dates,
+            label_timespans
+        )
+        return True
+    except Exception:
+        logging.error('Child error: %s', traceback.format_exc())
+        raise
 
 
 def insert_into_table(
@@ -200,7 +922,7 @@ def insert_into_table(
 ):
     try:
         logging.info('Beginning insert batch')
-        db_engine = create_engine(db_connection_string)
+        db_engine = worker_db_engine(db_connection_string)
         feature_generator = feature_generator_factory(db_engine)
         feature_generator.run_commands(insert_statements)
         return True
@@ -215,7 +937,7 @@ def build_matrix(
     db_connection_string,
 ):
     try:
-        db_engine = create_engine(db_connection_string)
+        db_engine = worker_db_engine(db_connection_string)
         planner = planner_factory(engine=db_engine)
         for build_task in build_tasks:
             planner.build_matrix(**build_task)
@@ -231,7 +953,7 @@ def train_model(
     db_connection_string,
 ):
     try:
-        db_engine = create_engine(db_connection_string)
+        db_engine = worker_db_engine(db_connection_string)
         trainer = trainer_factory(db_engine=db_engine)
         return [
             trainer.process_train_task(**train_task)
@@ -254,7 +976,7 @@ def test_and_evaluate(
     config
 ):
     try:
-        db_engine = create_engine(db_connection_string)
+        db_engine = worker_db_engine(db_connection_string)
         for model_id in model_ids:
             logging.info('Generating predictions for model id %s', model_id)
             predictor = predictor_factory(db_engine=db_engine)
@@ -1,85 +1,149 @@
 import logging
 
 from triage.experiments import ExperimentBase
+from triage.experiments.telemetry import file_output, table_output
 
 
 class SingleThreadedExperiment(ExperimentBase):
     def build_matrices(self):
         logging.info('Creating sparse states')
-        self.generate_sparse_states()
+        with self.task_telemetry('sparse_states', 'sparse_states') as measurements:
+            self.generate_sparse_states()
+            measurements['rows'], measurements['bytes_written'] = table_output(
+                self.db_engine,
+                self.state_table_generator.sparse_table_name
+            )
         logging.info('Creating labels')
-        self.generate_labels()
+        with self.task_telemetry('labels', 'labels') as measurements:
+            self.generate_labels()
+            measurements['rows'], measurements['bytes_written'] = table_output(
+                self.db_engine,
+                self.labels_table_name
+            )
         logging.info('Creating feature aggregation tables')
-        self.feature_generator.process_table_tasks(self.feature_aggregation_table_tasks)
+        self._process_feature_table_tasks('feature_table', self.feature_aggregation_table_tasks)
         logging.info('Creating feature imputation tables')
-        self.feature_generator.process_table_tasks(self.feature_imputation_table_tasks)
+        self._process_feature_table_tasks('imputation', self.feature_imputation_table_tasks)
         logging.info('Building all matrices')
-        self.planner.build_all_matrices(self.matrix_build_tasks)
+        entity_date_tables = self.entity_date_tables(self.matrix_build_tasks.keys())
+        last_matrix_using = {}
+        for table_name, matrix_uuids in entity_date_tables.items():
+            # one left by an earlier run may be out of date
+            self.planner.drop_entity_date_table(table_name)
+            last_matrix_using[matrix_uuids[-1]] = table_name
+        if self.replace:
+            # rows the builder kept from an earlier run may be out of date
+            self.planner.clean_up_builder()
+        for matrix_uuid, build_task in self.matrix_build_tasks.items():
+            with self.task_telemetry('matrix', matrix_uuid) as measurements:
+                self.planner.build_matrix(**build_task)
+                measurements['rows'], measurements['bytes_written'] = file_output(
+                    self.db_engine,
+                    self.matrix_store(matrix_uuid).matrix_path
+                )
+            if matrix_uuid in last_matrix_using:
+                self.planner.drop_entity_date_table(last_matrix_using[matrix_uuid])
+        self.planner.clean_up_builder()
+
+    def _process_feature_table_tasks(self, task_type, table_tasks):
+        for table_name, tasks in table_tasks.items():
+            with self.task_telemetry(task_type, table_name) as measurements:
+                self.feature_generator.process_table_tasks({table_name: tasks})
+                if tasks:
+                    measurements['rows'], measurements['bytes_written'] = table_output(
+                        self.db_engine,
+                        '{}."{}"'.format(self.features_schema_name, table_name)
+                    )
 
     def catwalk(self):
-        for split_num, split in enumerate(self.full_matrix_definitions):
-            self.log_split(split_num, split)
-            train_store = self.matrix_store(split['train_uuid'])
-            if train_store.empty:
-                logging.warning('''Train matrix for split %s was empty,
-                no point in training this model. Skipping
-                ''', split['train_uuid'])
-                continue
-            if len(train_store.labels().unique()) == 1:
-                logging.warning('''Train Matrix for split %s had only one
-                unique value, no point in training this model. Skipping
-                ''', split['train_uuid'])
-                continue
+        # the matrices are used in this order, each loaded while the ones
+        # before it are in use
+        matrix_uuids = [
+            matrix_uuid
+            for split in self.full_matrix_definitions
+            for matrix_uuid in [split['train_uuid']] + split['test_uuids']
+        ]
+        prefetcher = self.matrix_prefetcher()
+        split_start = 0
+        try:
+            for split_num, split in enumerate(self.full_matrix_definitions):
+                self.log_split(split_num, split)
+                train_store = prefetcher.get(split['train_uuid'])
+                test_start = split_start + 1
+                split_start = test_start + len(split['test_uuids'])
+                # the test matrices load while the models train
+                prefetcher.prefetch(matrix_uuids[test_start:])
+                if train_store.empty:
+                    logging.warning('''Train matrix for split %s was empty,
+                    no point in training this model. Skipping
+                    ''', split['train_uuid'])
+                    continue
+                if len(train_store.label_counts()) == 1:
+                    logging.warning('''Train Matrix for split %s had only one
+                    unique value, no point in training this model. Skipping
+                    ''', split['train_uuid'])
+                    continue
 
-            logging.info('Training models')
-            model_ids = self.trainer.train_models(
-                grid_config=self.config['grid_config'],
-                misc_db_parameters=dict(
-                    test=False,
-                    model_comment=self.config.get('model_comment', None),
-                ),
-                matrix_store=train_store
-            )
-            logging.info('Done training models')
+                logging.info('Training models')
+                model_ids = []
+                for train_task in self.trainer.generate_train_tasks(
+                    grid_config=self.config['grid_config'],
+                    misc_db_parameters=dict(
+                        test=False,
+                        model_comment=self.config.get('model_comment', None),
+                    ),
+                    matrix_store=train_store
+                ):
+                    with self.task_telemetry('train', train_task['model_hash']):
+                        model_ids.append(self.trainer.process_train_task(**train_task))
+                logging.info('Done training models')
 
-            for split_def, test_uuid in zip(
-                split['test_matrices'],
-                split['test_uuids']
-            ):
-                as_of_times = split_def['as_of_times']
-                logging.info(
-                    'Testing and scoring as_of_times min: %s max: %s num: %s',
-                    min(as_of_times),
-                    max(as_of_times),
-                    len(as_of_times)
-                )
-                test_store = self.matrix_store(test_uuid)
-                if test_store.empty:
-                    logging.warning('''Test matrix for uuid %s
-                    was empty, no point in generating predictions. Skipping.
-                    ''', test_uuid)
-                    continue
-                for model_id in model_ids:
-                    logging.info('Testing model id %s', model_id)
-                    predictions_proba = self.predictor.predict(
-                        model_id,
-                        test_store,
-                        misc_db_parameters=dict(),
-                        train_matrix_columns=train_store.columns(),
+                for test_num, (split_def, test_uuid) in enumerate(zip(
+                    split['test_matrices'],
+                    split['test_uuids']
+                )):
+                    as_of_times = split_def['as_of_times']
+                    logging.info(
+                        'Testing and scoring as_of_times min: %s max: %s num: %s',
+                        min(as_of_times),
+                        max(as_of_times),
+                        len(as_of_times)
                     )
+                    test_store = prefetcher.get(test_uuid)
+                    prefetcher.prefetch(matrix_uuids[test_start + test_num + 1:])
+                    if test_store.empty:
+                        logging.warning('''Test matrix for uuid %s
+                        was empty, no point in generating predictions. Skipping.
+                        ''', test_uuid)
+                        continue
+                    for model_id in model_ids:
+                        logging.info('Testing model id %s', model_id)
+                        with self.task_telemetry(
+                            'test',
+                            '{}/{}'.format(test_uuid, model_id)
+                        ) as measurements:
+                            predictions_proba = self.predictor.predict(
+                                model_id,
+                                test_store,
+                                misc_db_parameters=dict(),
+                                train_matrix_columns=train_store.columns(),
+                            )
+                            measurements['rows'] = len(predictions_proba)
 
-                    self.individual_importance_calculator\
-                        .calculate_and_save_all_methods_and_dates(
-                            model_id,
-                            test_store
-                        )
+                            self.individual_importance_calculator\
+                                .calculate_and_save_all_methods_and_dates(
+                                    model_id,
+                                    test_store
+                                )
 
-                    self.evaluator.evaluate(
-                        predictions_proba=predictions_proba,
-                        labels=test_store.labels(),
-                        model_id=model_id,
-                        # for evaluation range, using first to last as of time:
-                        evaluation_start_time=split_def['first_as_of_time'],
-                        evaluation_end_time=split_def['last_as_of_time'],
-                        as_of_date_frequency=split_def['test_as_of_date_frequency']
-                    )
+                            self.evaluator.evaluate(
+                                predictions_proba=predictions_proba,
+                                labels=test_store.labels(),
+                                model_id=model_id,
+                                # for evaluation range, using first to last as of time:
+                                evaluation_start_time=split_def['first_as_of_time'],
+                                evaluation_end_time=split_def['last_as_of_time'],
+                                as_of_date_frequency=split_def['test_as_of_date_frequency']
+                            )
+        finally:
+            prefetcher.close()
@@ -0,0 +1,236 @@
+import logging
+import queue
+import time
+from collections import Counter, OrderedDict, defaultdict, deque
+
+
+class Task(object):
+    """A unit of work in a ``TaskGraph``
+
+    Args:
+        key (hashable) a unique identifier for the task. If a tuple, its first
+            element is treated as the type of the task for logging purposes
+        function (callable, optional) the work to run. If the task is
+            assigned to a pool this must be picklable. If None, the task
+            is a no-op that only groups its dependencies
+        args (tuple) positional arguments to call the function with
+        dependencies (iterable) keys of tasks that must finish first
+        pool (string, optional) the name of the pool to run the function in.
+            If None, the function is run in the parent process, where it may
+            add more tasks to the graph
+        callback (callable, optional) called in the parent process with the
+            result of the function, before any dependents are started
+        memory (int, optional) the estimated peak memory use of the
+            function, in bytes, for admitting it against a memory budget
+    """
+    def __init__(
+        self,
+        key,
+        function=None,
+        args=(),
+        dependencies=(),
+        pool=None,
+        callback=None,
+        memory=None,
+    ):
+        self.key = key
+        self.function = function
+        self.args = tuple(args)
+        self.dependencies = list(dependencies)
+        self.pool = pool
+        self.callback = callback
+        self.memory = memory
+
+    @property
+    def task_type(self):
+        if isinstance(self.key, tuple):
+            return self.key[0]
+        return self.key
+
+
+class TaskGraph(object):
+    """A set of tasks with dependencies between them, run as soon as the
+    tasks they depend on are finished.
+
+    Dependencies may refer to tasks that have not been added yet (for
+    instance, ones that a parent-process task will add once it runs);
+    the dependent task waits until they have been added and finished.
+
+    A task finishing unsuccessfully (returning a falsy result, as the
+    multicore worker functions do when they catch an error) still releases
+    its dependents, and its key is added to ``failed``; a task raising an
+    exception stops the graph.
+
+    Results are handled as each task finishes, in whatever order they
+    finish, and are not kept afterwards.
+
+    Args:
+        progress_interval (int) minimum number of seconds between progress
+            log messages while running
+    """
+    def __init__(self, progress_interval=60):
+        self.tasks = OrderedDict()
+        self.finished = set()
+        self.failed = set()
+        self.progress_interval = progress_interval
+        self._waiting_on = {}
+        self._dependents = defaultdict(list)
+        self._ready = defaultdict(deque)
+        self._successes = Counter()
+        self._failures = Counter()
+
+    def __contains__(self, key):
+        return key in self.tasks
+
+    def __len__(self):
+        return len(self.tasks)
+
+    def add_task(self, key, *args, **kwargs):
+        """Add a task to the graph. Arguments are those of ``Task``
+
+        Returns: (Task) the added task
+        """
+        if key in self.tasks:
+            raise ValueError('Task {} already in task graph'.format(key))
+        task = Task(key, *args, **kwargs)
+        self.tasks[key] = task
+        self._waiting_on[key] = set(
+            dependency for dependency in task.dependencies
+            if dependency not in self.finished
+        )
+        for dependency in self._waiting_on[key]:
+            self._dependents[dependency].append(key)
+        if not self._waiting_on[key]:
+            self._ready[task.pool].append(key)
+        return task
+
+    def _finish(self, task, result):
+        if task.pool is not None:
+            if result:
+                self._successes[task.task_type] += 1
+            else:
+                self._failures[task.task_type] += 1
+                self.failed.add(task.key)
+        if task.callback:
+            task.callback(result)
+        # the arguments may be large, and are no longer needed
+        task.function = task.args = task.callback = None
+        self.finished.add(task.key)
+        for dependent in self._dependents.pop(task.key, []):
+            self._waiting_on[dependent].discard(task.key)
+            if not self._waiting_on[dependent]:
+                self._ready[self.tasks[dependent].pool].append(dependent)
+
+    def _log_progress(self, in_flight):
+        logging.info(
+            'Progress: %s of %s tasks done, %s running, %s waiting to run',
+            len(self.finished),
+            len(self.tasks),
+            sum(in_flight.values()),
+            sum(len(ready) for ready in self._ready.values())
+        )
+
+    def _fits_in_memory(self, task, memory_budget, in_flight, memory_in_flight):
+        """Whether a task can be submitted to its pool without the estimated
+        memory of the pool's submitted tasks going over budget
+
+        A task that would be over budget on its own is let through once
+        nothing else is submitted to its pool, so it runs alone.
+        """
+        budget = memory_budget.get(task.pool)
+        if budget is None or not task.memory or not in_flight[task.pool]:
+            if budget is not None and task.memory and task.memory > budget:
+                logging.warning(
+                    'Task %s is estimated to need %s MB, over the memory '
+                    'budget of %s MB, so is running alone',
+                    task.key,
+                    task.memory // (1024 * 1024),
+                    budget // (1024 * 1024)
+                )
+            return True
+        return memory_in_flight[task.pool] + task.memory <= budget
+
+    def run(self, pools, max_in_flight=None, wrap_task=None, memory_budget=None):
+        """Run all tasks, each one once its dependencies are finished
+
+        Args:
+            pools (dict) pool names to ``multiprocessing.pool.Pool`` objects
+                (or anything else implementing ``apply_async``)
+            max_in_flight (dict, optional) pool names to the maximum number
+                of tasks to have submitted to that pool at once. Tasks beyond
+                this wait in the parent process, so only a bounded amount
+                of work is ever queued up in a pool.
+            wrap_task (callable, optional) called with each task sent to a
+                pool, returning the picklable function to run in its place
+            memory_budget (dict, optional) pool names to the most memory, in
+                bytes, that the estimated memory use of the tasks submitted
+                to that pool at once may add up to. Tasks are submitted in
+                the order they become ready, so a large task waits until
+                enough others have finished, and many small ones run at once.
+        """
+        max_in_flight = max_in_flight or {}
+        memory_budget = memory_budget or {}
+        results = queue.Queue()
+        in_flight = Counter()
+        memory_in_flight = Counter()
+        last_progress_time = time.time()
+        while True:
+            while self._ready[None]:
+                task = self.tasks[self._ready[None].popleft()]
+                result = task.function(*task.args) if task.function else None
+                self._finish(task, result)
+            for pool_name, ready in self._ready.items():
+                if pool_name is None:
+                    continue
+                limit = max_in_flight.get(pool_name)
+                while ready and (limit is None or in_flight[pool_name] < max(limit, 1)):
+                    task = self.tasks[ready[0]]
+                    if not self._fits_in_memory(
+                        task,
+                        memory_budget,
+                        in_flight,
+                        memory_in_flight
+                    ):
+                        break
+                    ready.popleft()
+                    logging.debug('Submitting task %s to %s pool', task.key, task.pool)
+                    pools[task.pool].apply_async(
+                        wrap_task(task) if wrap_task else task.function,
+                        task.args,
+                        callback=lambda result, key=task.key: results.put(
+                            (key, result, None)
+                        ),
+                        error_callback=lambda error, key=task.key: results.put(
+                            (key, None, error)
+                        ),
+                    )
+                    in_flight[pool_name] += 1
+                    memory_in_flight[pool_name] += task.memory or 0
+            if not sum(in_flight.values()):
+                break
+
+            key, result, error = results.get()
+            task = self.tasks[key]
+            in_flight[task.pool] -= 1
+            memory_in_flight[task.pool] -= task.memory or 0
+            if error is not None:
+                logging.error('Task %s raised an exception, stopping', key)
+                raise error
+            self._finish(task, result)
+            if time.time() - last_progress_time >= self.progress_interval:
+                self._log_progress(in_flight)
+                last_progress_time = time.time()
+
+        unfinished = [key for key in self.tasks if key not in self.finished]
+        if unfinished:
+            raise ValueError(
+                'Tasks could not be run because their dependencies were never '
+                'added: {}'.format(unfinished)
+            )
+        for task_type in sorted(set(self._successes) | set(self._failures), key=str):
+            logging.info(
+                'Done with %s tasks. successes: %s, failures: %s',
+                task_type,
+                self._successes[task_type],
+                self._failures[task_type]
+            )
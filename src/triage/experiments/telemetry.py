@@ -0,0 +1,184 @@
+import logging
+import os
+import resource
+import socket
+import sys
+import threading
+import time
+import traceback
+from contextlib import contextmanager
+from datetime import datetime
+
+from sqlalchemy import select
+
+from triage.component.results_schema import TaskTelemetry
+
+
+task_telemetry_table = TaskTelemetry.__table__
+
+
+def _reset_peak_rss():
+    """Reset the process's peak memory use, where the OS allows it, so it
+    can be measured for each task a long-lived worker runs"""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except (IOError, OSError):
+        pass
+
+
+def _peak_rss():
+    """The peak resident set size of this process, in bytes, since it
+    started or since _reset_peak_rss was last called"""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except (IOError, OSError):
+        pass
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # reported in bytes on OS X, kilobytes elsewhere
+    return max_rss if sys.platform == 'darwin' else max_rss * 1024
+
+
+def _in_main_thread():
+    return threading.current_thread() is threading.main_thread()
+
+
+def _cpu_time():
+    """The CPU time used by this thread, if it runs alongside others
+    (and the OS can tell), otherwise by this process"""
+    if not _in_main_thread() and hasattr(resource, 'RUSAGE_THREAD'):
+        usage = resource.getrusage(resource.RUSAGE_THREAD)
+        return usage.ru_utime + usage.ru_stime
+    return time.process_time()
+
+
+def table_output(db_engine, table_name):
+    """Analyze a table written by a task and look up its size
+
+    Args:
+        db_engine (sqlalchemy.engine)
+        table_name (string) a table name, optionally schema-qualified
+
+    Returns: (tuple) the table's estimated number of rows and its bytes on disk
+    """
+    with db_engine.begin() as conn:
+        conn.execute('analyze {}'.format(table_name))
+        ((rows, size),) = conn.execute(
+            "select reltuples::bigint, pg_total_relation_size(%(table)s::regclass) "
+            "from pg_class where oid = %(table)s::regclass",
+            table=table_name
+        )
+    return max(rows, 0), size
+
+
+def file_output(db_engine, path):
+    """Look up the size of a file written by a task
+
+    Args:
+        db_engine (sqlalchemy.engine) unused, for symmetry with table_output
+        path (string) a local path, of a file or a directory of files, or
+            None if the task wrote no file
+
+    Returns: (tuple) None for the number of rows, and the size of the file
+        (or the files in the directory) in bytes, or None if it is not on
+        the local filesystem
+    """
+    if path is None:
+        return None, None
+    if os.path.isdir(path):
+        return None, sum(
+            os.path.getsize(os.path.join(directory, filename))
+            for directory, _, filenames in os.walk(path)
+            for filename in filenames
+        )
+    if os.path.exists(path):
+        return None, os.path.getsize(path)
+    return None, None
+
+
+@contextmanager
+def task_telemetry(db_engine, experiment_hash, task_type, task_key):
+    """Measure the wall time, CPU time, and peak memory use of the code
+    run inside, and save them to results.task_telemetry
+
+    The yielded dict may be given 'rows' and 'bytes_written' for the
+    task's output. Errors saving the telemetry are logged, not raised.
+
+    Peak memory is that of the whole process, so is only recorded for
+    tasks run in a process's main thread, not in a thread pool.
+
+    Args:
+        db_engine (sqlalchemy.engine)
+        experiment_hash (string)
+        task_type (string) the kind of task, e.g. 'matrix'
+        task_key (string) identifies the task among those of its type
+    """
+    measurements = {'rows': None, 'bytes_written': None}
+    in_main_thread = _in_main_thread()
+    if in_main_thread:
+        _reset_peak_rss()
+    start_time = datetime.now()
+    wall_start = time.time()
+    cpu_start = _cpu_time()
+    try:
+        yield measurements
+    finally:
+        wall_time = time.time() - wall_start
+        cpu_time = _cpu_time() - cpu_start
+        try:
+            with db_engine.begin() as conn:
+                conn.execute(task_telemetry_table.insert().values(
+                    experiment_hash=experiment_hash,
+                    task_type=task_type,
+                    task_key=str(task_key),
+                    worker='{}:{}'.format(socket.gethostname(), os.getpid()),
+                    start_time=start_time,
+                    wall_time=wall_time,
+                    cpu_time=cpu_time,
+                    peak_rss=_peak_rss() if in_main_thread else None,
+                    rows=measurements['rows'],
+                    bytes_written=measurements['bytes_written'],
+                ))
+        except Exception:
+            logging.warning('Could not save task telemetry: %s', traceback.format_exc())
+
+
+def log_slowest_tasks(db_engine, experiment_hash, since=None, limit=10):
+    """Log the tasks of an experiment that took the longest
+
+    Args:
+        db_engine (sqlalchemy.engine)
+        experiment_hash (string)
+        since (datetime, optional) only include tasks started after this time
+        limit (int) the number of tasks to log
+    """
+    query = (
+        select([task_telemetry_table])
+        .where(task_telemetry_table.c.experiment_hash == experiment_hash)
+        .order_by(task_telemetry_table.c.wall_time.desc())
+        .limit(limit)
+    )
+    if since:
+        query = query.where(task_telemetry_table.c.start_time >= since)
+    try:
+        rows = db_engine.execute(query).fetchall()
+    except Exception:
+        logging.warning('Could not read task telemetry: %s', traceback.format_exc())
+        return
+    if not rows:
+        return
+    logging.info('Slowest %s tasks:', len(rows))
+    for row in rows:
+        logging.info(
+            '%s %s: %.1fs wall, %.1fs cpu, %s MB peak memory, %s rows, %s bytes written',
+            row.task_type,
+            row.task_key,
+            row.wall_time,
+            row.cpu_time,
+            row.peak_rss // (1024 * 1024) if row.peak_rss is not None else None,
+            row.rows,
+            row.bytes_written
+        )
@@ -3,10 +3,6 @@ import logging
 from datetime import datetime
 from textwrap import dedent
 
-from sklearn.model_selection import ParameterGrid
-
-from triage.component import architect
-from triage.component import catwalk
 from triage.component.timechop import Timechop
 
 from triage.util.conf import convert_str_to_relativedelta
@@ -293,7 +289,8 @@ class FeatureGroupDefinitionValidator(Validator):
             raise ValueError(dedent('''Section: feature_group_definition -
             feature_group_definition must be a dictionary'''))
 
-        available_subsetters = architect.feature_group_creator.FeatureGroupCreator.subsetters
+        from triage.component.architect.feature_group_creator import FeatureGroupCreator
+        available_subsetters = FeatureGroupCreator.subsetters
         for subsetter_name, value in feature_group_definition.items():
             if subsetter_name not in available_subsetters:
                 raise ValueError(dedent('''Section: feature_group_definition -
@@ -336,9 +333,9 @@ class FeatureGroupStrategyValidator(Validator):
         if not isinstance(feature_group_strategies, list):
             raise ValueError(dedent('''Section: feature_group_strategies -
             feature_group_strategies section must be a list'''))
+        from triage.component.architect.feature_group_mixer import FeatureGroupMixer
         available_strategies = {
-            key for key in
-            architect.feature_group_mixer.FeatureGroupMixer.strategy_lookup.keys()
+            key for key in FeatureGroupMixer.strategy_lookup.keys()
         }
         bad_strategies = set(feature_group_strategies) - available_strategies
         if bad_strategies:
@@ -394,6 +391,7 @@ class ModelGroupKeysValidator(Validator):
 
 class GridConfigValidator(Validator):
     def run(self, grid_config):
+        from sklearn.model_selection import ParameterGrid
         for classpath, parameter_config in grid_config.items():
             try:
                 module_name, class_name = classpath.rsplit(".", 1)
@@ -419,7 +417,8 @@ class ScoringConfigValidator(Validator):
                             'Your experiment may run, but you will not have any ' +
                             'evaluation metrics computed'
                             )
-        metric_lookup = catwalk.evaluation.ModelEvaluator.available_metrics
+        from triage.component.catwalk.evaluation import ModelEvaluator
+        metric_lookup = ModelEvaluator.available_metrics
         available_metrics = set(metric_lookup.keys())
         for metric_group in scoring_config['metric_groups']:
             given_metrics = set(metric_group['metrics'])
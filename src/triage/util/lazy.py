@@ -0,0 +1,38 @@
+import importlib
+import sys
+import types
+
+
+class LazyModule(types.ModuleType):
+    """A module whose listed attributes are only imported when first used"""
+
+    def __getattr__(self, name):
+        lazy_attributes = self.__dict__.get('_lazy_attributes', {})
+        if name not in lazy_attributes:
+            raise AttributeError(
+                "module '{}' has no attribute '{}'".format(self.__name__, name)
+            )
+        module_name, attribute = lazy_attributes[name]
+        value = importlib.import_module(module_name, self.__name__)
+        if attribute:
+            value = getattr(value, attribute)
+        setattr(self, name, value)
+        return value
+
+    def __dir__(self):
+        return sorted(set(super(LazyModule, self).__dir__()) | set(self._lazy_attributes))
+
+
+def lazy_attributes(module_name, attributes):
+    """Make a package's public names import their modules on first use, so
+    importing one of its lightweight modules doesn't import the heavy ones
+
+    Args:
+        module_name (string) the name of the package, usually __name__
+        attributes (dict) attribute names to (module name, attribute name)
+            tuples. The module name may be relative to the package, and if
+            the attribute name is None, the module itself is used
+    """
+    module = sys.modules[module_name]
+    module._lazy_attributes = attributes
+    module.__class__ = LazyModule